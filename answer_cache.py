@@ -0,0 +1,154 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from lexical_index import tokenize
+from logger_config import setup_logger
+from config import settings
+
+logger = setup_logger('answer_cache')
+
+class AnswerCache:
+    """In-memory cache of generated answers keyed by collection version, model and query.
+
+    A lookup hits on the exact (normalised) question, or on any cached
+    question for the same model whose embedding has cosine similarity of at
+    least similarity_threshold and the same identifiers and numbers (so
+    "error ERR-1234" never answers "error ERR-1235"). Entries expire after
+    ttl_seconds and the least recently used ones are evicted beyond
+    max_entries. Everything is dropped as soon as the collection version
+    changes.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity_threshold: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._version = None
+        self._matrix = None  # (keys, normalised embeddings) rebuilt lazily after changes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalise(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    @staticmethod
+    def _exact_terms(query: str) -> frozenset:
+        """Tokens with a digit (codes, versions, numbers), which embeddings barely tell apart"""
+        return frozenset(token for token in tokenize(query) if any(char.isdigit() for char in token))
+
+    def _check_version(self, version):
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+                logger.info(f"Collection changed, dropping {len(self._entries)} cached answers")
+            self._entries.clear()
+            self._matrix = None
+            self._version = version
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl_seconds
+        expired = [key for key, entry in self._entries.items() if entry["created"] < cutoff]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _nearest(self, model: str, embedding: list, terms: frozenset):
+        if self._matrix is None:
+            keys = list(self._entries.keys())
+            vectors = np.array([self._entries[key]["embedding"] for key in keys], dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+            self._matrix = (keys, vectors)
+        keys, vectors = self._matrix
+        query = np.array(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) + 1e-12
+        scores = vectors @ query
+        for index in np.argsort(-scores):
+            if scores[index] < self.similarity_threshold:
+                break
+            if keys[index][0] == model and self._entries[keys[index]]["terms"] == terms:
+                return keys[index], float(scores[index])
+        return None, 0.0
+
+    def lookup(self, version, model: str, query: str, embedding: list):
+        """Return the cached {answer, sources} for this question, or None"""
+        with self._lock:
+            self._check_version(version)
+            self._expire()
+            key = (model, self._normalise(query))
+            if key in self._entries:
+                self.exact_hits += 1
+            else:
+                key, score = (None, 0.0) if not self._entries else self._nearest(
+                    model, embedding, self._exact_terms(query)
+                )
+                if key is None:
+                    self.misses += 1
+                    return None
+                self.similar_hits += 1
+                logger.debug(f"Similar cached question found (score={score:.3f})")
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def store(self, version, model: str, query: str, embedding: list, answer: str, sources: list):
+        with self._lock:
+            self._check_version(version)
+            key = (model, self._normalise(query))
+            self._entries[key] = {
+                "answer": answer,
+                "sources": sources,
+                "embedding": list(embedding),
+                "terms": self._exact_terms(query),
+                "created": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        hits = self.exact_hits + self.similar_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+def replay(answer: str):
+    """Yield a cached answer in word-sized pieces so the UI streams it like a live one"""
+    for piece in re.findall(r'\S+\s*|\s+', answer):
+        yield piece
+
+_answer_cache = None
+
+def get_answer_cache():
+    """Process-wide answer cache shared by all sessions, or None when disabled"""
+    global _answer_cache
+    if not settings.answer_cache_enabled:
+        return None
+    if _answer_cache is None:
+        _answer_cache = AnswerCache(
+            max_entries=settings.answer_cache_max_entries,
+            ttl_seconds=settings.answer_cache_ttl_seconds,
+            similarity_threshold=settings.answer_cache_similarity_threshold
+        )
+    return _answer_cache
@@ -1,54 +1,240 @@
 import streamlit as st
-from query import get_query_handler
-from embed import embed
-from get_vector_db import get_vector_db, archive_current_documents, clear_documents  # Update import
-import os, time
-import requests
+from query_client import RemoteQueryHandler
+from ingest_queue import get_ingest_queue, ACTIVE_STATUSES
+from get_vector_db import (
+    archive_current_documents, clear_documents, get_collection_stats, delete_document, get_collections, restore_collection
+)
+from document_registry import get_document_registry
+from llm_registry import get_llm_registry
+from conversation import Conversation
+from warmup import warm_up
+import time
 from config import settings
 from logger_config import setup_logger
 
 logger = setup_logger('app')
-os.makedirs(settings.logs_path, exist_ok=True)
 
 # Constants
-OLLAMA_API_TIMEOUT = 5  # seconds
+STREAM_RENDER_INTERVAL = 0.05  # seconds between repaints while streaming
+STREAM_RENDER_MAX_CHARS = 256  # repaint early once this much text is pending
+
+class StreamRenderer:
+    """Coalesce streamed chunks and repaint the placeholder at most once per window.
+
+    Chunks are buffered and appended to the rendered text only when the
+    time or size window is reached, so the full response is never rebuilt
+    per token. Also measures time to first token and tokens per second
+    (one streamed chunk is one token for Ollama).
+    """
+
+    def __init__(self, container):
+        self.container = container
+        self.text = ""
+        self.pending = []
+        self.pending_chars = 0
+        self.tokens = 0
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.last_render = 0.0
+
+    def write(self, chunk: str):
+        now = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = now
+        self.tokens += 1
+        self.pending.append(chunk)
+        self.pending_chars += len(chunk)
+        if now - self.last_render >= STREAM_RENDER_INTERVAL or self.pending_chars >= STREAM_RENDER_MAX_CHARS:
+            self._render(now, cursor=True)
+
+    def _render(self, now, cursor):
+        self.text += "".join(self.pending)
+        self.pending.clear()
+        self.pending_chars = 0
+        self.last_render = now
+        if cursor:
+            self.container.markdown(f'{self.text}<span class="stream-cursor">▋</span>', unsafe_allow_html=True)
+        else:
+            self.container.markdown(self.text)
+
+    def finish(self) -> str:
+        self.finished_at = time.perf_counter()
+        self._render(self.finished_at, cursor=False)
+        return self.text
+
+    def stats(self) -> dict:
+        if self.first_token_at is None:
+            return {}
+        end = self.finished_at or time.perf_counter()
+        generation = end - self.first_token_at
+        return {
+            "ttft": self.first_token_at - self.started,
+            "tokens": self.tokens,
+            "tokens_per_sec": (self.tokens - 1) / generation if generation > 0 and self.tokens > 1 else 0.0,
+        }
+
+def render_stream_stats(stats: dict):
+    if stats:
+        st.caption(f"⏱ first token {stats['ttft']:.2f}s · {stats['tokens']} tokens · {stats['tokens_per_sec']:.1f} tok/s")
+
+def render_latency_breakdown(container):
+    """Per-stage timings of the last answered question, in milliseconds"""
+    timings = next(
+        (message["timings"] for message in reversed(st.session_state.messages) if message.get("timings")),
+        None
+    )
+    with container:
+        st.markdown("**Latency breakdown (last query)**")
+        if not timings:
+            st.caption("No query timings yet")
+            return
+        st.bar_chart({stage: seconds * 1000 for stage, seconds in timings.items() if stage != "total"}, horizontal=True)
+        st.caption(f"Total {timings.get('total', 0.0) * 1000:.0f} ms")
+
+def create_query_handler():
+    """Use the shared query service when configured, otherwise query in-process"""
+    if settings.query_service_url:
+        logger.info(f"Using query service at {settings.query_service_url}")
+        return RemoteQueryHandler(settings.query_service_url)
+    from query import get_query_handler
+    return get_query_handler()
 
 def init_session():
     """Initialize all session state variables"""
     if "messages" not in st.session_state:
         st.session_state.messages = [{
             "role": "assistant",
-            "content": get_query_handler().get_welcome_message()
+            "content": st.session_state.query_handler.get_welcome_message()
         }]
+    if "conversation" not in st.session_state:
+        st.session_state.conversation = Conversation()
     if "processed_files" not in st.session_state:
         st.session_state.processed_files = set()
     if "show_uploader" not in st.session_state:
         st.session_state.show_uploader = False
 
 def get_available_models():
-    try:
-        response = requests.get(
-            'http://localhost:11434/api/tags',
-            timeout=OLLAMA_API_TIMEOUT
-        )
-        if response.ok:
-            models = [m['name'] for m in response.json()['models']]
-            return sorted(models, key=lambda x: x != settings.llm_model)
-    except requests.exceptions.RequestException:
+    """Installed models with the default first; the registry caches the listing between reruns"""
+    models = get_llm_registry().list_models()
+    if not models:
         st.sidebar.error("⚠️ Could not connect to Ollama API")
-    return [settings.llm_model]
+        return [settings.llm_model]
+    return sorted(models, key=lambda x: x != settings.llm_model)
+
+def apply_model_selection(model: str):
+    """Route following questions to the selected model and load it in the background"""
+    if st.session_state.get("active_model") == model:
+        return
+    st.session_state.query_handler.set_model(model)
+    if settings.llm_prewarm:
+        get_llm_registry().prewarm(model)
+    st.session_state.active_model = model
+
+def collection_label(name: str) -> str:
+    if name == settings.collection_name:
+        return "Current documents"
+    if name == settings.archive_collection_name:
+        return "Archive"
+    return f"Project: {name}"
+
+def apply_collection_selection(collections: list):
+    """Search the selected collections for following questions"""
+    if st.session_state.get("active_collections") == collections:
+        return
+    st.session_state.query_handler.set_collections(collections)
+    st.session_state.active_collections = collections
+
+def render_collections(ingesting: bool):
+    """Choose the collections to search, restore archived documents or save the session as a project"""
+    collections = get_collections()
+    default = [name for name in [settings.collection_name] + list(settings.search_collections) if name in collections]
+    with st.expander("🗂️ Collections"):
+        selected = st.multiselect(
+            "Search in", collections, default=default, format_func=collection_label, key="search_collections"
+        )
+        apply_collection_selection(selected or [settings.collection_name])
+
+        archived = [name for name in collections if name != settings.collection_name]
+        restore_from = st.selectbox("Restore from", archived, format_func=collection_label, key="restore_from")
+        if st.button("♻️ Restore documents", use_container_width=True, disabled=ingesting or not restore_from):
+            progress = st.progress(0.0, text="Restoring documents...")
+            try:
+                restore_collection(
+                    restore_from,
+                    progress_callback=lambda done, total: progress.progress(
+                        min(done / max(total, 1), 1.0), text=f"Checked {done}/{total} chunks"
+                    )
+                )
+            except Exception as e:
+                logger.error(f"Restore failed: {str(e)}")
+                st.error(f"Failed to restore from {collection_label(restore_from)}")
+            else:
+                st.rerun()
+
+        project = st.text_input("Project name", key="project_name", placeholder="e.g. quarterly-report")
+        if st.button("💾 Save session as project", use_container_width=True, disabled=ingesting or not project):
+            if archive_current_documents(collection=project.strip()):
+                st.session_state.clear()
+                st.rerun()
+            else:
+                st.error(f"Failed to save project {project}")
 
 def handle_file_upload(uploaded_files):
+    """Hand new uploads to the background ingestion queue; progress is shown by render_ingest_jobs()"""
     if not uploaded_files:
         return
 
-    with st.spinner(f"Processing {len(uploaded_files)} files..."):
-        for file in uploaded_files:
-            if file.name not in st.session_state.processed_files:
-                if embed(file):
-                    st.session_state.processed_files.add(file.name)
-                else:
-                    st.error(f"Failed to process {file.name}")
+    new_files = [file for file in uploaded_files if file.name not in st.session_state.processed_files]
+    queue = get_ingest_queue()
+    for file in new_files:
+        try:
+            queue.submit(file.name, file)
+            st.session_state.processed_files.add(file.name)
+        except Exception as e:
+            logger.error(f"Could not queue {file.name}: {str(e)}")
+            st.error(f"Failed to queue {file.name}")
+
+def job_progress(job: dict) -> tuple:
+    """(fraction, label) for a job's progress bar"""
+    name, stage, done, total = job["source"], job["stage"], job["done"], job["total"]
+    if job["status"] == "queued":
+        return 0.0, f"{name}: {'waiting to retry' if job['attempts'] else 'queued'}"
+    if stage == "embedding" and total:
+        return min(done / total, 1.0), f"{name}: embedding {done}/{total} chunks"
+    if stage == "embedding":
+        return 0.5, f"{name}: embedded {done} chunks"
+    return 0.0, f"{name}: {stage or 'starting'}"
+
+@st.fragment(run_every=settings.ingest_poll_seconds)
+def render_ingest_jobs():
+    """Background ingestion progress, refreshed on its own without rerunning the chat"""
+    queue = get_ingest_queue()
+    for job in reversed(queue.jobs(statuses=ACTIVE_STATUSES)):
+        bar_col, cancel_col = st.columns([5, 1])
+        fraction, label = job_progress(job)
+        bar_col.progress(fraction, text=label)
+        if cancel_col.button("✖", key=f"cancel_{job['job_id']}", help=f"Cancel {job['source']}"):
+            queue.cancel(job["job_id"])
+            st.session_state.processed_files.discard(job["source"])
+            st.rerun(scope="fragment")
+
+    for job in queue.jobs(statuses=("failed",), limit=5):
+        st.error(f"Failed to process {job['source']}")
+        retry_col, dismiss_col = st.columns(2)
+        if retry_col.button("Retry", key=f"retry_{job['job_id']}", use_container_width=True):
+            queue.retry(job["job_id"])
+            st.rerun(scope="fragment")
+        if dismiss_col.button("Dismiss", key=f"dismiss_{job['job_id']}", use_container_width=True):
+            queue.dismiss(job["job_id"])
+            st.session_state.processed_files.discard(job["source"])
+            st.rerun(scope="fragment")
+
+    # Rerun the whole page when a job finished, so the document list is current
+    finished = queue.finished_count()
+    if st.session_state.setdefault("ingest_jobs_finished", finished) != finished:
+        st.session_state.ingest_jobs_finished = finished
+        st.rerun()
 
 def render_chat():
     st.markdown("""
@@ -87,11 +273,13 @@ def render_chat():
             key="model_selector",
             label_visibility="hidden"  # Hide the label but keep it for accessibility
         )
+    apply_model_selection(selected_model)
 
     # Display chat messages and their sources
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.write(message["content"])
+            render_stream_stats(message.get("stream_stats"))
             
             # Display sources if they exist for this message
             if message.get("sources"):
@@ -135,32 +323,36 @@ def render_chat():
         # Handle assistant response
         with st.chat_message("assistant"):
             try:
-                full_response = []
-                response_container = st.empty()
+                renderer = StreamRenderer(st.empty())
+                answered_by_handler = True
+                question = prompt
                 
                 # Handle Yes/No response to direct chat prompt
                 if is_direct_prompt_response and prompt.lower().strip() in ['yes', 'y']:
                     logger.info("User opted for direct chat")
+                    question = st.session_state.messages[-3]["content"]  # Original question, before the Yes/No prompt
                     response_iterator = st.session_state.query_handler.stream_query(
-                        st.session_state.messages[-2]["content"],  # Get original question
-                        force_direct=True
+                        question,
+                        force_direct=True,
+                        conversation=st.session_state.conversation
                     )
                 elif is_direct_prompt_response:
                     logger.info("User declined direct chat")
+                    answered_by_handler = False
                     response_iterator = iter(["Okay, I'll only answer based on the documents I know about."])
                 else:
-                    response_iterator = st.session_state.query_handler.stream_query(prompt)
+                    response_iterator = st.session_state.query_handler.stream_query(
+                        prompt,
+                        conversation=st.session_state.conversation
+                    )
 
                 for chunk in response_iterator:
-                    full_response.append(chunk)
-                    response_container.markdown(
-                        f'{"".join(full_response)}<span class="stream-cursor">▋</span>', 
-                        unsafe_allow_html=True
-                    )
-                    time.sleep(0.02)
+                    renderer.write(chunk)
                 
-                final_response = "".join(full_response)
-                response_container.markdown(final_response)
+                final_response = renderer.finish()
+                stream_stats = renderer.stats()
+                render_stream_stats(stream_stats)
+                logger.info(f"Stream stats: {stream_stats}")
                 
                 # Get sources before adding message to history
                 sources = st.session_state.query_handler.get_last_sources()
@@ -169,9 +361,15 @@ def render_chat():
                 st.session_state.messages.append({
                     "role": "assistant", 
                     "content": final_response,
-                    "sources": sources if sources else None
+                    "sources": sources if sources else None,
+                    "stream_stats": stream_stats,
+                    "timings": st.session_state.query_handler.get_last_timings() if answered_by_handler else None
                 })
                 logger.info("Response generated successfully")
+                if answered_by_handler and "Would you like me to answer using general knowledge?" not in final_response:
+                    st.session_state.conversation.add_exchange(
+                        question, final_response, model=st.session_state.get("active_model")
+                    )
                 
                 # Show sources if available with improved formatting
                 if sources:
@@ -210,9 +408,11 @@ def main():
         layout="wide",
         initial_sidebar_state="expanded"
     )
+    # Once per process; only creating the data directories holds up the first page load
+    warm_up(answer_queries=not settings.query_service_url)
     
     if 'query_handler' not in st.session_state:
-        st.session_state.query_handler = get_query_handler()
+        st.session_state.query_handler = create_query_handler()
     
     init_session()
 
@@ -225,13 +425,21 @@ def main():
             if st.button("🧹 Clear Chat", use_container_width=True):
                 st.session_state.messages = [{
                     "role": "assistant",
-                    "content": get_query_handler().get_welcome_message()
+                    "content": st.session_state.query_handler.get_welcome_message()
                 }]
+                st.session_state.conversation.clear()
                 st.rerun()
                 
+        # Archiving or clearing while files are being ingested would race with the worker
+        ingesting = bool(get_ingest_queue().jobs(statuses=ACTIVE_STATUSES, limit=1))
         with col2:
-            if st.button("🗑️ New Session", use_container_width=True):
-                if archive_current_documents():
+            if st.button("🗑️ New Session", use_container_width=True, disabled=ingesting):
+                progress = st.progress(0.0, text="Archiving documents...")
+                if archive_current_documents(
+                    progress_callback=lambda done, total: progress.progress(
+                        min(done / max(total, 1), 1.0), text=f"Archived {done}/{total} chunks"
+                    )
+                ):
                     st.session_state.clear()
                     st.rerun()
                 else:
@@ -245,27 +453,46 @@ def main():
             key="doc_uploader"
         )
         handle_file_upload(uploaded_files)
+        render_ingest_jobs()
 
-        # Document Status and List
-        if st.session_state.processed_files:
-            st.success(f"Loaded documents: {len(st.session_state.processed_files)}")
+        # Document Status and List (from the persistent registry, so it survives restarts)
+        documents = get_document_registry().sources()
+        if documents:
+            st.success(f"Loaded documents: {len(documents)}")
             st.write("Active Documents:")
-            for file in sorted(st.session_state.processed_files):
-                st.write(f"📄 {file}")
+            for source in documents:
+                doc_col, delete_col = st.columns([5, 1])
+                doc_col.write(f"📄 {source}")
+                if delete_col.button("✖", key=f"delete_{source}", help=f"Remove {source}"):
+                    if delete_document(source):
+                        st.session_state.processed_files.discard(source)
+                        st.rerun()
+                    else:
+                        st.error(f"Failed to remove {source}")
+            st.caption(f"{get_collection_stats()['count']} chunks indexed")
         else:
             st.info("No documents loaded yet")
 
         # Clear Documents Button
-        if st.session_state.processed_files and st.button("🗑️ Clear Documents", use_container_width=True):
+        if documents and st.button("🗑️ Clear Documents", use_container_width=True, disabled=ingesting):
             if clear_documents():
                 st.session_state.processed_files.clear()
                 st.rerun()  # Simply rerun without trying to modify file_uploader state
             else:
                 st.error("Failed to clear documents")
 
+        render_collections(ingesting)
+
+        show_latency = st.toggle("Show latency breakdown", key="show_latency")
+        latency_panel = st.container()
+
     # Main Chat Interface
     # st.caption("Powered by Ollama LLMs")
     render_chat()
 
+    # Filled after the chat so it includes the question just answered
+    if show_latency:
+        render_latency_breakdown(latency_panel)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,271 @@
+"""Answer many questions from a JSONL file without the chat UI.
+
+    python batch_query.py questions.jsonl --output answers.jsonl
+    python batch_query.py requests.jsonl --output answers.jsonl --concurrency 8
+
+Each input line is a JSON object. The question is its "query" or
+"question" field, or its "title" and "body" joined (the requests.jsonl
+format), or the fields named with --fields; its id is the "id" or
+"request_id" field, else the line number. An optional "force_direct"
+answers without the documents.
+
+Questions are embedded settings.batch_query_size at a time and searched
+together (see get_vector_db.search_many), then answered through
+QueryHandler, settings.batch_query_concurrency at once. Each answer is
+appended to the output as one JSON line, with its sources and scores, the
+answer mode and per-stage timings; embed and retrieve are the batch's
+time divided among its questions. Rerunning with the same output resumes:
+questions that already have an answer are skipped, failed ones are
+asked again and appended, so the last line for an id is the one to use.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from context_builder import source_score
+from get_vector_db import get_embeddings, has_documents, search_many
+from metrics import get_metrics
+from query import QueryHandler, get_llm, retrieval_candidates
+from logger_config import setup_logger
+from config import settings
+
+logger = setup_logger('batch_query')
+
+QUERY_FIELDS = ("query", "question")
+ID_FIELDS = ("id", "request_id")
+PROGRESS_INTERVAL = 30  # seconds between progress lines
+
+def question_text(record: dict, fields: list = None) -> str:
+    if fields:
+        return "\n\n".join(str(record[field]) for field in fields if record.get(field))
+    for field in QUERY_FIELDS:
+        if record.get(field):
+            return str(record[field])
+    return "\n\n".join(str(record[field]) for field in ("title", "body") if record.get(field))
+
+def read_questions(path: str, fields: list = None) -> list:
+    """[{"id", "line", "query", "force_direct"}] for every non-blank line with a question"""
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.error(f"Skipping line {line_number}: {str(e)}")
+                continue
+            query = question_text(record, fields)
+            if not query.strip():
+                logger.warning(f"Skipping line {line_number}: no question")
+                continue
+            question_id = next((record[field] for field in ID_FIELDS if record.get(field) is not None), line_number)
+            questions.append({
+                "id": question_id,
+                "line": line_number,
+                "query": query,
+                "force_direct": bool(record.get("force_direct")),
+            })
+    return questions
+
+def answered_ids(path: str) -> set:
+    """Ids already answered in an earlier run's output.
+
+    A line cut short by a crash is removed, so new lines start on a line of
+    their own; answers that failed do not count.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            logger.warning(f"Dropping an incomplete last line from {path}")
+            f.truncate(end)
+    done = set()
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if not record.get("error"):
+            done.add(record.get("id"))
+    return done
+
+def output_source(source: dict, include_content: bool) -> dict:
+    return dict(
+        {key: value for key, value in source.items() if include_content or key != "content"},
+        score=source_score(source)
+    )
+
+class BatchRunner:
+    """Embed and search questions in batches, and generate their answers in a thread pool.
+
+    The main thread prepares the next batch while earlier answers are being
+    generated; at most twice the concurrency of prepared questions wait for
+    a worker, so a long input is never held in memory as retrieved sources.
+    """
+
+    def __init__(self, output, model: str = None, collections: list = None, batch_size: int = None,
+                 concurrency: int = None, include_content: bool = False):
+        self.output = output
+        self.model = model or settings.llm_model
+        self.collections = list(collections or [settings.collection_name])
+        self.batch_size = batch_size or settings.batch_query_size
+        self.concurrency = concurrency or settings.batch_query_concurrency
+        self.include_content = include_content
+        self.answered = 0
+        self.failed = 0
+        self.timings = {"embed": 0.0, "retrieve": 0.0}
+
+    def _prepare(self, batch: list, documents_available: bool):
+        """Embed and search a batch; sets each question's 'embedding', 'sources' and shared timings"""
+        rag = [question for question in batch if documents_available and not question["force_direct"]]
+        if not rag:
+            return
+        queries = [question["query"] for question in rag]
+        start = time.perf_counter()
+        embeddings = get_embeddings().embed_documents(queries)
+        embedded = time.perf_counter()
+        results = search_many(queries, embeddings, k=retrieval_candidates(), collections=self.collections)
+        searched = time.perf_counter()
+        self.timings["embed"] += embedded - start
+        self.timings["retrieve"] += searched - embedded
+        for question, embedding, sources in zip(rag, embeddings, results):
+            question["embedding"] = embedding
+            question["sources"] = sources
+            question["timings"] = {
+                "embed": (embedded - start) / len(rag),
+                "retrieve": (searched - embedded) / len(rag),
+            }
+
+    def _answer(self, question: dict) -> dict:
+        handler = QueryHandler(get_llm(self.model))
+        handler.set_collections(self.collections)
+        answer = "".join(handler.stream_query(
+            question["query"],
+            force_direct=question["force_direct"],
+            embedding=question.get("embedding"),
+            sources=question.get("sources")
+        ))
+        timings = dict(question.get("timings", {}), **handler.get_last_timings())
+        record = {
+            "id": question["id"],
+            "line": question["line"],
+            "query": question["query"],
+            "answer": answer,
+            "mode": handler.last_mode,
+            "model": self.model,
+            "sources": [output_source(source, self.include_content) for source in handler.get_last_sources()],
+            "timings_ms": {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()},
+        }
+        if handler.last_mode == "error":
+            record["error"] = answer
+        return record
+
+    def _write(self, record: dict):
+        self.output.write(json.dumps(record, default=str) + "\n")
+        self.output.flush()
+        self.answered += 1
+        self.failed += bool(record.get("error"))
+
+    def _collect(self, pending: dict, block: bool):
+        """Write the answers that are ready, and drop their futures from pending"""
+        done, _ = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            question = pending.pop(future)
+            question.pop("embedding", None)
+            question.pop("sources", None)
+            try:
+                record = future.result()
+            except Exception as e:
+                logger.error(f"Answering question {question['id']} failed: {str(e)}")
+                record = {"id": question["id"], "line": question["line"], "query": question["query"], "error": str(e)}
+            self._write(record)
+
+    def run(self, questions: list):
+        start = time.perf_counter()
+        last_progress = start
+        documents_available = has_documents(self.collections)
+        if not documents_available:
+            logger.warning("No documents indexed; answering every question in direct chat mode")
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch") as pool:
+            try:
+                for i in range(0, len(questions), self.batch_size):
+                    batch = questions[i:i + self.batch_size]
+                    try:
+                        self._prepare(batch, documents_available)
+                    except Exception as e:
+                        # Each question then embeds and searches on its own
+                        logger.error(f"Batch embedding or search failed: {str(e)}")
+                    for question in batch:
+                        while len(pending) >= 2 * self.concurrency:
+                            self._collect(pending, block=True)
+                        pending[pool.submit(self._answer, question)] = question
+                    self._collect(pending, block=False)
+                    if time.perf_counter() - last_progress >= PROGRESS_INTERVAL:
+                        last_progress = time.perf_counter()
+                        logger.info(
+                            f"{self.answered}/{len(questions)} answered, {self.failed} failed, "
+                            f"{self.answered / (last_progress - start):.2f} questions/s"
+                        )
+                while pending:
+                    self._collect(pending, block=True)
+            except KeyboardInterrupt:
+                logger.warning("Interrupted; rerun with the same output to resume")
+                for future in pending:
+                    future.cancel()
+                raise
+
+        total = time.perf_counter() - start
+        get_metrics().record_trace(
+            "batch", dict(self.timings, total=total), observe=False,
+            questions=len(questions), answered=self.answered, failed=self.failed, model=self.model
+        )
+        logger.info(
+            f"Answered {self.answered} questions in {total:.1f}s ({self.answered / total if total else 0:.2f}/s), "
+            f"{self.failed} failed; batch embedding {self.timings['embed']:.1f}s, search {self.timings['retrieve']:.1f}s"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of questions")
+    parser.add_argument("--output", "-o", required=True, help="JSONL file the answers are appended to")
+    parser.add_argument("--fields", nargs="+", help="input fields joined into the question")
+    parser.add_argument("--model", help=f"chat model (default {settings.llm_model})")
+    parser.add_argument("--collections", nargs="+", help="collections to search (default: the current one)")
+    parser.add_argument("--batch-size", type=int, default=settings.batch_query_size)
+    parser.add_argument("--concurrency", type=int, default=settings.batch_query_concurrency)
+    parser.add_argument("--include-content", action="store_true", help="include each source's text")
+    parser.add_argument("--no-answer-cache", action="store_true", help="generate every answer, even repeated ones")
+    parser.add_argument("--limit", type=int, help="answer at most this many questions")
+    args = parser.parse_args()
+    if args.no_answer_cache:
+        settings.answer_cache_enabled = False
+
+    questions = read_questions(args.input, args.fields)
+    done = answered_ids(args.output)
+    todo = [question for question in questions if question["id"] not in done]
+    logger.info(f"{len(questions)} questions, {len(questions) - len(todo)} already answered, {len(todo)} to go")
+    if args.limit is not None:
+        todo = todo[:args.limit]
+    if not todo:
+        return
+
+    with open(args.output, "a", encoding="utf-8") as output:
+        runner = BatchRunner(
+            output, model=args.model, collections=args.collections, batch_size=args.batch_size,
+            concurrency=args.concurrency, include_content=args.include_content
+        )
+        try:
+            runner.run(todo)
+        except KeyboardInterrupt:
+            sys.exit(130)
+    if runner.failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
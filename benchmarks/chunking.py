@@ -0,0 +1,138 @@
+"""Compare chunking strategies on the same documents.
+
+    python -m benchmarks.chunking
+    python -m benchmarks.chunking --paragraphs 4000 --strategies recursive structured:256 structured:128:512
+
+A strategy is "recursive" (the character splitter, settings.chunk_size and
+chunk_overlap) or "structured:<chunk tokens>[:<parent tokens>]". The corpus
+is synthetic Markdown (benchmarks.corpus.make_structured_files): sections
+of paragraphs of varying length, each paragraph holding one identifier.
+Every strategy ingests the corpus through embed_files() against the fake
+Ollama server, then answers the same queries, each about the words
+around one identifier (--query-window). The report covers chunking
+time, chunk count and size, on-disk index size, recall@k of the searched
+chunks, how often the packed prompt context still contains the answer,
+and the mean number of context tokens sent to the model.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from config import settings
+from benchmarks.corpus import make_chunks, make_queries, make_structured_files
+from benchmarks.fake_ollama import FakeOllamaConfig, start_fake_ollama
+from benchmarks.run import reset_state
+
+def apply_strategy(strategy: str):
+    name, *sizes = strategy.split(":")
+    settings.chunk_strategy = name
+    settings.chunk_tokens_by_type = {}
+    if sizes:
+        settings.chunk_tokens = int(sizes[0])
+        settings.parent_chunk_tokens = int(sizes[1]) if len(sizes) > 1 else 0
+
+def directory_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+    )
+
+def bench_strategy(strategy: str, paragraphs: list, queries: list, args) -> dict:
+    from chunking import count_tokens
+    from context_builder import build_context, context_token_budget
+    from embed import embed_files, iter_file_chunks
+    from get_vector_db import get_embeddings, get_collection_stats, search
+    from query import RAG_PROMPT
+
+    workdir = tempfile.mkdtemp(prefix="bench_chunking_")
+    try:
+        reset_state(workdir)
+        apply_strategy(strategy)
+        files = make_structured_files(paragraphs, seed=args.seed)
+
+        start = time.perf_counter()
+        sizes = []
+        for file in files:
+            file.seek(0)
+            sizes.extend(count_tokens(chunk.page_content) for chunk in iter_file_chunks(file, file.name))
+        split_seconds = time.perf_counter() - start
+
+        for file in files:
+            file.seek(0)
+        start = time.perf_counter()
+        results = embed_files(files)
+        ingest_seconds = time.perf_counter() - start
+
+        hits, context_hits, context_tokens = 0, 0, []
+        for query, expected in queries:
+            embedding = get_embeddings().embed_query(query)
+            sources = search(query, embedding, k=max(args.k, settings.context_candidates))
+            context, _ = build_context(query, sources, context_token_budget(settings.llm_model, RAG_PROMPT + query))
+            hits += any(expected in source["content"] for source in sources[:args.k])
+            context_hits += expected in context
+            context_tokens.append(count_tokens(context))
+
+        return {
+            "strategy": strategy,
+            "failed_files": sum(1 for ok in results.values() if not ok),
+            "chunks": get_collection_stats()["count"],
+            "chunk_tokens": {"mean": statistics.fmean(sizes), "max": max(sizes)},
+            "split_s": split_seconds,
+            "ingest_s": ingest_seconds,
+            "index_mb": directory_size(settings.chroma_path) / 2**20,
+            f"recall_at_{args.k}": hits / len(queries),
+            "answer_recall": context_hits / len(queries),
+            "context_tokens": statistics.fmean(context_tokens),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paragraphs", type=int, default=1000)
+    parser.add_argument("--min-words", type=int, default=20)
+    parser.add_argument("--max-words", type=int, default=400)
+    parser.add_argument("--strategies", nargs="+", default=[
+        "recursive", "structured:128", "structured:256", "structured:512", "structured:128:512"
+    ])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query-window", type=int, default=40, help="query words come from this many words around the answer")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_ollama(FakeOllamaConfig(dim=args.dim, embed_latency_ms=0, embed_item_latency_ms=0))
+    settings.ollama_base_url = base_url
+    settings.embedding_cache_enabled = False
+    settings.answer_cache_enabled = False
+
+    paragraphs = make_chunks(args.paragraphs, args.min_words, seed=args.seed, max_words=args.max_words)
+    queries = make_queries(paragraphs, args.queries, seed=args.seed + 1, window=args.query_window)
+    results = []
+    try:
+        for strategy in args.strategies:
+            result = bench_strategy(strategy, paragraphs, queries, args)
+            results.append(result)
+            print(
+                f"{strategy:<20} chunks={result['chunks']:<6} mean={result['chunk_tokens']['mean']:.0f}tok "
+                f"index={result['index_mb']:.1f}MB recall@{args.k}={result[f'recall_at_{args.k}']:.3f} "
+                f"answer={result['answer_recall']:.3f} context={result['context_tokens']:.0f}tok",
+                file=sys.stderr
+            )
+    finally:
+        server.shutdown()
+
+    output = json.dumps({"args": vars(args), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
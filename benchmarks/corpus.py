@@ -0,0 +1,112 @@
+"""Synthetic corpora for benchmarks.
+
+Chunk text is drawn from a Zipf-distributed vocabulary, so term statistics
+look roughly like natural language, and every chunk carries a unique
+identifier (e.g. ERR-000042). Each query is built from a few words of one
+chunk plus, for a share of queries, its identifier. A retrieved result
+counts as a hit when it contains that identifier. Off-topic queries use
+ordinary English words, none of which occur in the corpus. make_structured_files()
+lays such passages out as paragraphs of varying length under Markdown
+headings, for comparing chunking strategies.
+"""
+import io
+import random
+
+VOCABULARY_SIZE = 20000
+
+class UploadedText(io.BytesIO):
+    """Minimal stand-in for a Streamlit UploadedFile"""
+
+    def __init__(self, name: str, data: bytes):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+
+def _vocabulary(rng):
+    syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "xe", "zu", "pa", "de"]
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def chunk_identifier(index: int) -> str:
+    return f"ERR-{index:07d}"
+
+def make_chunks(n_chunks: int, words_per_chunk: int = 120, seed: int = 0, max_words: int = None) -> list:
+    """Passages of words_per_chunk words, or of a random length up to max_words when given"""
+    rng = random.Random(seed)
+    vocabulary = _vocabulary(rng)
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    chunks = []
+    for index in range(n_chunks):
+        length = rng.randint(words_per_chunk, max_words) if max_words else words_per_chunk
+        words = rng.choices(vocabulary, weights=weights, k=length)
+        words.insert(rng.randrange(len(words)), chunk_identifier(index))
+        sentences, start = [], 0
+        while start < len(words):
+            end = start + rng.randint(8, 24)
+            sentence = " ".join(words[start:end])
+            sentences.append(sentence[0].upper() + sentence[1:] + ".")
+            start = end
+        chunks.append(" ".join(sentences) if max_words else " ".join(words))
+    return chunks
+
+def make_queries(chunks: list, n_queries: int, identifier_share: float = 0.3, seed: int = 1, window: int = None) -> list:
+    """Return [(query, expected identifier)].
+
+    With a window, query words are drawn from that many words around the
+    identifier rather than from the whole chunk, like a question about one
+    fact in a long passage.
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n_queries):
+        index = rng.randrange(len(chunks))
+        words = chunks[index].split()
+        if window:
+            position = next(i for i, word in enumerate(words) if word.startswith("ERR-"))
+            words = words[max(0, position - window // 2):position + window // 2]
+        words = [word for word in words if not word.startswith("ERR-")]
+        query = " ".join(rng.sample(words, min(6, len(words))))
+        if rng.random() < identifier_share:
+            query = f"{query} {chunk_identifier(index)}"
+        queries.append((query, chunk_identifier(index)))
+    return queries
+
+OFF_TOPIC_WORDS = """
+weather recipe football holiday guitar painting garden coffee mountain river election movie
+history planet ocean birthday poem chess marathon kitchen train airport museum jazz volcano
+""".split()
+
+def make_off_topic_queries(n_queries: int, seed: int = 2) -> list:
+    """Questions about nothing in the corpus, for calibrating the relevance threshold"""
+    rng = random.Random(seed)
+    return [f"what about the {' '.join(rng.sample(OFF_TOPIC_WORDS, 4))}" for _ in range(n_queries)]
+
+def make_files(chunks: list, chunks_per_file: int = 100, prefix: str = "doc") -> list:
+    """Pack chunks into .txt uploads, one paragraph per chunk"""
+    files = []
+    for start in range(0, len(chunks), chunks_per_file):
+        text = "\n\n".join(chunks[start:start + chunks_per_file])
+        files.append(UploadedText(f"{prefix}_{start // chunks_per_file:05d}.txt", text.encode("utf-8")))
+    return files
+
+def make_structured_files(paragraphs: list, paragraphs_per_section: int = 6, sections_per_file: int = 8,
+                          prefix: str = "doc", seed: int = 0) -> list:
+    """Lay paragraphs out as Markdown documents: sections under headings, subsections under some of them"""
+    rng = random.Random(seed)
+    files, per_file = [], paragraphs_per_section * sections_per_file
+    for start in range(0, len(paragraphs), per_file):
+        lines = [f"# Document {start // per_file}", ""]
+        for section in range(0, per_file, paragraphs_per_section):
+            lines += [f"## Section {section // paragraphs_per_section + 1}", ""]
+            for offset in range(paragraphs_per_section):
+                index = start + section + offset
+                if index >= len(paragraphs):
+                    break
+                if offset and rng.random() < 0.2:
+                    lines += [f"### Topic {index}", ""]
+                lines += [paragraphs[index], ""]
+        text = "\n".join(lines)
+        files.append(UploadedText(f"{prefix}_{start // per_file:05d}.txt", text.encode("utf-8")))
+    return files
@@ -0,0 +1,195 @@
+"""Deterministic local stand-in for the parts of the Ollama HTTP API the app uses.
+
+Embeddings are hashed bag-of-words vectors, so similar texts really are
+close and retrieval benchmarks are meaningful. Chat responses stream a
+fixed number of tokens at a configurable rate after a configurable time to
+first token, plus a prefill delay proportional to the prompt length. The
+first request for each model also waits for a simulated model load.
+
+    python -m benchmarks.fake_ollama --port 11435 --tokens-per-sec 40
+"""
+import argparse
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+(?:[\-_.][a-z0-9]+)*")
+
+class FakeOllamaConfig:
+    def __init__(self, dim=768, embed_latency_ms=5.0, embed_item_latency_ms=0.5,
+                 ttft_ms=150.0, tokens_per_sec=50.0, answer_tokens=64, prefill_ms_per_1k_tokens=100.0,
+                 models=None, load_ms=0.0):
+        self.dim = dim
+        self.embed_latency_ms = embed_latency_ms
+        self.embed_item_latency_ms = embed_item_latency_ms
+        self.ttft_ms = ttft_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.answer_tokens = answer_tokens
+        self.prefill_ms_per_1k_tokens = prefill_ms_per_1k_tokens
+        self.models = models or ["llama3.2:latest", "nomic-embed-text:latest"]
+        self.load_ms = load_ms  # paid once per model, like Ollama loading it into memory
+
+def fake_embedding(text: str, dim: int) -> list:
+    vector = [0.0] * dim
+    for word in WORD_PATTERN.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def make_handler(config: FakeOllamaConfig):
+    loaded, load_lock = set(), threading.Lock()
+
+    def load(model: str):
+        with load_lock:
+            if model not in loaded:
+                time.sleep(config.load_ms / 1000)
+                loaded.add(model)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # Headers and body go out as separate writes
+
+        def log_message(self, format, *args):
+            pass
+
+        def _read_json(self) -> dict:
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _send_json(self, payload: dict, status: int = 200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _stream(self, events):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for event in events:
+                line = json.dumps(event).encode("utf-8") + b"\n"
+                self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_GET(self):
+            if self.path.startswith("/api/tags"):
+                self._send_json({"models": [
+                    {"name": name, "model": name, "modified_at": _now(), "size": 0, "digest": "", "details": {}}
+                    for name in config.models
+                ]})
+            elif self.path.startswith("/api/ps"):
+                self._send_json({"models": []})
+            elif self.path == "/":
+                self._send_json({"status": "Ollama is running"})
+            else:
+                self._send_json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            request = self._read_json()
+            if self.path.startswith("/api/embed"):
+                inputs = request.get("input", request.get("prompt", ""))
+                inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+                load(request.get("model", ""))
+                time.sleep((config.embed_latency_ms + config.embed_item_latency_ms * len(inputs)) / 1000)
+                embeddings = [fake_embedding(text, config.dim) for text in inputs]
+                if self.path.startswith("/api/embeddings"):
+                    self._send_json({"embedding": embeddings[0]})
+                else:
+                    self._send_json({"model": request.get("model", ""), "embeddings": embeddings})
+            elif self.path.startswith("/api/chat") or self.path.startswith("/api/generate"):
+                self._generate(request, chat=self.path.startswith("/api/chat"))
+            else:
+                self._send_json({"error": "not found"}, 404)
+
+        def _generate(self, request: dict, chat: bool):
+            model = request.get("model", "")
+            load(model)
+            tokens = [f"token{i} " for i in range(config.answer_tokens)]
+            if not (request.get("prompt") or request.get("messages")):
+                tokens = []  # Empty prompt: Ollama just loads the model
+            prompt = request.get("prompt") or "".join(m.get("content", "") for m in request.get("messages") or [])
+            prompt_tokens = len(prompt) // 4
+            prefill = prompt_tokens / 1000 * config.prefill_ms_per_1k_tokens / 1000
+
+            def event(text, done):
+                payload = {"model": model, "created_at": _now(), "done": done}
+                if chat:
+                    payload["message"] = {"role": "assistant", "content": text}
+                else:
+                    payload["response"] = text
+                if done:
+                    payload.update({
+                        "done_reason": "stop",
+                        "eval_count": len(tokens),
+                        "prompt_eval_count": prompt_tokens,
+                        "prompt_eval_duration": int(prefill * 1e9)
+                    })
+                return payload
+
+            def events():
+                if tokens:
+                    time.sleep(config.ttft_ms / 1000 + prefill)
+                for i, token in enumerate(tokens):
+                    if i:
+                        time.sleep(1 / config.tokens_per_sec)
+                    yield event(token, False)
+                yield event("", True)
+
+            if request.get("stream", True):
+                self._stream(events())
+            else:
+                time.sleep(config.ttft_ms / 1000 + prefill + len(tokens) / config.tokens_per_sec)
+                self._send_json(event("".join(tokens), True))
+
+    return Handler
+
+def start_fake_ollama(config: FakeOllamaConfig = None, host: str = "127.0.0.1", port: int = 0):
+    """Start the server in a daemon thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), make_handler(config or FakeOllamaConfig()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--embed-latency-ms", type=float, default=5.0)
+    parser.add_argument("--embed-item-latency-ms", type=float, default=0.5)
+    parser.add_argument("--ttft-ms", type=float, default=150.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--answer-tokens", type=int, default=64)
+    parser.add_argument("--prefill-ms-per-1k-tokens", type=float, default=100.0)
+    parser.add_argument("--load-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    config = FakeOllamaConfig(
+        dim=args.dim,
+        embed_latency_ms=args.embed_latency_ms,
+        embed_item_latency_ms=args.embed_item_latency_ms,
+        ttft_ms=args.ttft_ms,
+        tokens_per_sec=args.tokens_per_sec,
+        answer_tokens=args.answer_tokens,
+        prefill_ms_per_1k_tokens=args.prefill_ms_per_1k_tokens,
+        load_ms=args.load_ms
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    print(f"Fake Ollama listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Recall vs latency of vector index settings, to help choose the index options in config.Settings.
+
+    python -m benchmarks.index_tuning --vectors 100000 --m 16 32 --search-ef 10 50 100
+    python -m benchmarks.index_tuning --vectors 20000 --output tuning.json
+
+Vectors are synthetic unit-length embeddings drawn around random topic
+centres, so nearest neighbours are meaningful. Ground truth is an exact
+brute-force search. For every HNSW combination (space, M, construction_ef,
+search_ef) a Chroma collection is built, because Chroma fixes these at
+creation. The quantized stores (int8, float16; vector_store "quantized")
+are built in a temporary directory and scanned as get_vector_db would.
+Each configuration reports recall@k, p50/p95 query latency, build time
+and index size.
+"""
+import argparse
+import itertools
+import json
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from benchmarks.run import percentiles
+from vector_store import QuantizedVectorStore
+
+def make_vectors(n: int, centres: np.ndarray, noise: float, rng) -> np.ndarray:
+    vectors = centres[rng.integers(0, len(centres), n)]
+    vectors = vectors + noise * rng.standard_normal(vectors.shape).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> list:
+    scores = queries @ vectors.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row.tolist()) for row in top]
+
+def recall(found: list, truth: list) -> float:
+    return float(np.mean([len(set(f) & t) / len(t) for f, t in zip(found, truth)]))
+
+def bench_hnsw(vectors, queries, truth, k, space, m, construction_ef, search_ef, batch_size) -> dict:
+    import chromadb
+    workdir = tempfile.mkdtemp(prefix="index_tuning_")
+    try:
+        client = chromadb.PersistentClient(path=workdir)
+        collection = client.create_collection("tuning", metadata={
+            "hnsw:space": space, "hnsw:M": m, "hnsw:construction_ef": construction_ef, "hnsw:search_ef": search_ef
+        })
+        start = time.perf_counter()
+        for i in range(0, len(vectors), batch_size):
+            collection.add(
+                ids=[str(j) for j in range(i, min(i + batch_size, len(vectors)))],
+                embeddings=vectors[i:i + batch_size]
+            )
+        build = time.perf_counter() - start
+
+        times, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            result = collection.query(query_embeddings=[query], n_results=k, include=[])
+            times.append(time.perf_counter() - start)
+            found.append([int(chunk_id) for chunk_id in result['ids'][0]])
+        # hnswlib graph: float32 vectors plus about 2*M neighbour links per element on level 0
+        size = len(vectors) * (vectors.shape[1] * 4 + 2 * m * 4)
+        return {
+            "index": "hnsw", "space": space, "m": m, "construction_ef": construction_ef, "search_ef": search_ef,
+            "recall": recall(found, truth), "latency": percentiles(times), "build_s": build, "size_mb": size / 2**20,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def bench_quantized(vectors, queries, truth, k, dtype, space, batch_size) -> dict:
+    workdir = tempfile.mkdtemp(prefix="index_tuning_")
+    try:
+        store = QuantizedVectorStore(f"{workdir}/tuning", dtype, space=space)
+        start = time.perf_counter()
+        for i in range(0, len(vectors), batch_size):
+            ids = [str(j) for j in range(i, min(i + batch_size, len(vectors)))]
+            store.add(ids, vectors[i:i + batch_size], [""] * len(ids), [{}] * len(ids))
+        build = time.perf_counter() - start
+
+        times, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            hits = store.search(query, k)
+            times.append(time.perf_counter() - start)
+            found.append([int(hit["id"]) for hit in hits])
+        return {
+            "index": dtype, "space": space,
+            "recall": recall(found, truth), "latency": percentiles(times), "build_s": build,
+            "size_mb": store.nbytes / 2**20,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def describe(result: dict) -> str:
+    if result["index"] == "hnsw":
+        name = f"hnsw {result['space']} M={result['m']} ef_c={result['construction_ef']} ef_s={result['search_ef']}"
+    else:
+        name = f"{result['index']} {result['space']} flat scan"
+    return (
+        f"{name:<44} recall={result['recall']:.3f} p50={result['latency']['p50_ms']:.2f}ms "
+        f"p95={result['latency']['p95_ms']:.2f}ms build={result['build_s']:.1f}s size={result['size_mb']:.0f}MB"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.08, help="spread around each topic centre")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--space", nargs="+", default=["l2"])
+    parser.add_argument("--m", type=int, nargs="+", default=[16, 32])
+    parser.add_argument("--construction-ef", type=int, nargs="+", default=[100])
+    parser.add_argument("--search-ef", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--quantized", nargs="*", default=["int8", "float16"])
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    centres = rng.standard_normal((args.topics, args.dim)).astype(np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    vectors = make_vectors(args.vectors, centres, args.noise, rng)
+    queries = make_vectors(args.queries, centres, args.noise, rng)
+    truth = exact_top_k(vectors, queries, args.k)
+
+    results = []
+    for space, m, construction_ef, search_ef in itertools.product(
+        args.space, args.m, args.construction_ef, args.search_ef
+    ):
+        results.append(bench_hnsw(vectors, queries, truth, args.k, space, m, construction_ef, search_ef, args.batch_size))
+        print(describe(results[-1]), file=sys.stderr)
+    for dtype, space in itertools.product(args.quantized, args.space):
+        results.append(bench_quantized(vectors, queries, truth, args.k, dtype, space, args.batch_size))
+        print(describe(results[-1]), file=sys.stderr)
+
+    output = json.dumps({"args": vars(args), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
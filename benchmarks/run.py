@@ -0,0 +1,298 @@
+"""Retrieval and end-to-end latency benchmarks against a local Ollama stand-in.
+
+    python -m benchmarks.run --chunks 1000 10000 --output bench.json
+    python -m benchmarks.run --chunks 1000 10000 --compare bench.json
+
+For each corpus size this ingests a synthetic corpus through embed_files(),
+then measures retrieval latency (embedding plus search) and end-to-end
+streaming through QueryHandler. It reports ingestion throughput,
+p50/p95/p99 latencies, time to first token, recall@k, the size of the
+packed prompt context and how often it still contains the answer, the
+relevance threshold that best separates the corpus queries from off-topic
+ones (relevance.calibrate_min_similarity), and the process memory
+high-water mark as JSON. With --ollama-url a real Ollama replaces the
+stand-in, so the suggested threshold fits the real embedding model. With
+--compare, metrics are checked against a previous run and the exit code
+is 1 if any regressed by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from config import settings
+from benchmarks.corpus import make_chunks, make_files, make_off_topic_queries, make_queries
+from benchmarks.fake_ollama import FakeOllamaConfig, start_fake_ollama
+
+# Metrics where a larger value is better; everything else is a cost
+HIGHER_IS_BETTER = ("per_sec", "recall", "accuracy")
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "p50_ms": pick(0.50) * 1000,
+        "p95_ms": pick(0.95) * 1000,
+        "p99_ms": pick(0.99) * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+    }
+
+def max_rss_mb() -> tuple:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own / scale, children / scale
+
+def reset_state(workdir: str):
+    """Point every store at a fresh directory and drop the module-level singletons"""
+    settings.chroma_path = os.path.join(workdir, "chroma")
+    settings.archive_chroma_path = os.path.join(workdir, "chroma_archive")
+    settings.temp_folder = os.path.join(workdir, "temp")
+    settings.embedding_cache_path = os.path.join(workdir, "embedding_cache", "embeddings.sqlite3")
+
+    import get_vector_db
+    import document_registry
+    import answer_cache
+    import llm_registry
+    import embed
+    if embed._parse_pool is not None:
+        # Worker processes keep the settings they were started with
+        embed._parse_pool.shutdown()
+        embed._parse_pool = None
+    get_vector_db._vector_store = None
+    get_vector_db._archive_store = None
+    get_vector_db._project_stores = {}
+    get_vector_db._embeddings = None
+    get_vector_db._lexical_index = None
+    get_vector_db._stats = None
+    get_vector_db._collection_state = None
+    document_registry._registry = None
+    answer_cache._answer_cache = None
+    llm_registry._registry = None
+
+def bench_size(n_chunks: int, args) -> dict:
+    from embed import embed_files
+    from get_vector_db import get_embeddings, get_collection_stats, search
+    from context_builder import build_context, context_token_budget, estimate_tokens
+    from query import QueryHandler, RAG_PROMPT
+    from relevance import best_similarity, calibrate_min_similarity
+
+    workdir = tempfile.mkdtemp(prefix=f"bench_{n_chunks}_")
+    try:
+        reset_state(workdir)
+        chunks = make_chunks(n_chunks, seed=args.seed)
+        files = make_files(chunks, chunks_per_file=args.chunks_per_file)
+        queries = make_queries(chunks, args.queries, seed=args.seed + 1)
+
+        start = time.perf_counter()
+        results = embed_files(files)
+        ingest_seconds = time.perf_counter() - start
+        indexed = get_collection_stats()["count"]
+
+        embed_times, search_times, hits = [], [], 0
+        pack_times, context_tokens, context_hits = [], [], 0
+        in_scope = []
+        for query, expected in queries:
+            start = time.perf_counter()
+            embedding = get_embeddings().embed_query(query)
+            embedded = time.perf_counter()
+            sources = search(query, embedding, k=max(args.k, settings.context_candidates))
+            searched = time.perf_counter()
+            context, _ = build_context(query, sources, context_token_budget(settings.llm_model, RAG_PROMPT + query))
+            packed = time.perf_counter()
+            embed_times.append(embedded - start)
+            search_times.append(searched - embedded)
+            pack_times.append(packed - searched)
+            context_tokens.append(estimate_tokens(context))
+            hits += any(expected in source["content"] for source in sources[:args.k])
+            context_hits += expected in context
+            in_scope.append(best_similarity(sources))
+
+        off_topic = []
+        for query in make_off_topic_queries(len(queries), seed=args.seed + 2):
+            embedding = get_embeddings().embed_query(query)
+            off_topic.append(best_similarity(search(query, embedding, k=settings.context_candidates)))
+        threshold = calibrate_min_similarity(in_scope, off_topic)
+
+        def accuracy(value):
+            correct = sum(score >= value for score in in_scope) + sum(score < value for score in off_topic)
+            return correct / (len(in_scope) + len(off_topic)) if in_scope or off_topic else 0.0
+
+        print(
+            f"Relevance threshold: suggested {threshold:.3f} (accuracy {accuracy(threshold):.3f}), "
+            f"configured {settings.relevance_min_similarity:.3f} (accuracy {accuracy(settings.relevance_min_similarity):.3f})",
+            file=sys.stderr
+        )
+
+        handler = QueryHandler()
+        ttft, totals, tokens = [], [], 0
+        for query, _ in queries[:args.llm_queries]:
+            start = time.perf_counter()
+            first = None
+            for _ in handler.stream_query(query):
+                if first is None:
+                    first = time.perf_counter()
+                tokens += 1
+            end = time.perf_counter()
+            ttft.append((first or end) - start)
+            totals.append(end - start)
+
+        own_rss, child_rss = max_rss_mb()
+        return {
+            "chunks": n_chunks,
+            "ingest": {
+                "files": len(files),
+                "failed_files": sum(1 for ok in results.values() if not ok),
+                "indexed_chunks": indexed,
+                "seconds": ingest_seconds,
+                "chunks_per_sec": indexed / ingest_seconds if ingest_seconds else 0.0,
+            },
+            "retrieval": {
+                "queries": len(queries),
+                "embed": percentiles(embed_times),
+                "search": percentiles(search_times),
+                "total": percentiles([a + b for a, b in zip(embed_times, search_times)]),
+                f"recall_at_{args.k}": hits / len(queries) if queries else 0.0,
+            },
+            "context": {
+                "pack": percentiles(pack_times),
+                "mean_tokens": statistics.fmean(context_tokens) if context_tokens else 0.0,
+                "answer_recall": context_hits / len(queries) if queries else 0.0,
+            },
+            "relevance": {
+                "suggested_min_similarity": threshold,
+                "accuracy_at_suggested": accuracy(threshold),
+                "accuracy_at_configured": accuracy(settings.relevance_min_similarity),
+            },
+            "generation": {
+                "queries": len(ttft),
+                "ttft": percentiles(ttft),
+                "total": percentiles(totals),
+                "tokens_per_sec": tokens / sum(totals) if totals else 0.0,
+            },
+            "memory": {"max_rss_mb": own_rss, "children_max_rss_mb": child_rss},
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def flatten(value, prefix="") -> dict:
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(flatten(item, f"{prefix}.{key}" if prefix else key))
+        return flat
+    return {prefix: value} if isinstance(value, (int, float)) and not isinstance(value, bool) else {}
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """Return [(metric, baseline, current, relative change)] for regressions beyond tolerance"""
+    baseline_by_size = {run["chunks"]: flatten(run) for run in baseline.get("results", [])}
+    regressions = []
+    for run in current["results"]:
+        before = baseline_by_size.get(run["chunks"])
+        if not before:
+            continue
+        for metric, value in flatten(run).items():
+            old = before.get(metric)
+            if old in (None, 0) or metric == "chunks" or metric.endswith(("queries", "files", "indexed_chunks", "min_similarity")):
+                continue
+            change = (value - old) / abs(old)
+            higher_is_better = any(marker in metric for marker in HIGHER_IS_BETTER)
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append((f"{run['chunks']}:{metric}", old, value, change))
+    return regressions
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--chunks-per-file", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--llm-queries", type=int, default=20)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--embed-latency-ms", type=float, default=5.0)
+    parser.add_argument("--embed-item-latency-ms", type=float, default=0.5)
+    parser.add_argument("--ttft-ms", type=float, default=150.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--answer-tokens", type=int, default=32)
+    parser.add_argument("--prefill-ms-per-1k-tokens", type=float, default=100.0)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--embedding-cache", action="store_true", help="keep the embedding cache enabled")
+    parser.add_argument("--answer-cache", action="store_true", help="keep the answer cache enabled")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--ollama-url", help="benchmark against this Ollama instead of the stand-in")
+    parser.add_argument("--compare", help="baseline JSON from a previous run")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    args = parser.parse_args()
+
+    server = None
+    if args.ollama_url:
+        settings.ollama_base_url = args.ollama_url
+    else:
+        server, settings.ollama_base_url = start_fake_ollama(FakeOllamaConfig(
+            dim=args.dim,
+            embed_latency_ms=args.embed_latency_ms,
+            embed_item_latency_ms=args.embed_item_latency_ms,
+            ttft_ms=args.ttft_ms,
+            tokens_per_sec=args.tokens_per_sec,
+            answer_tokens=args.answer_tokens,
+            prefill_ms_per_1k_tokens=args.prefill_ms_per_1k_tokens
+        ))
+    settings.embedding_cache_enabled = args.embedding_cache
+    settings.answer_cache_enabled = args.answer_cache
+
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": [],
+    }
+    try:
+        for n_chunks in args.chunks:
+            print(f"Benchmarking {n_chunks} chunks...", file=sys.stderr)
+            report["results"].append(bench_size(n_chunks, args))
+    finally:
+        if server:
+            server.shutdown()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for metric, old, new, change in regressions:
+            print(f"REGRESSION {metric}: {old:.4g} -> {new:.4g} ({change:+.1%})", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("No regressions beyond tolerance", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
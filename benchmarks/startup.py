@@ -0,0 +1,209 @@
+"""Import and startup latency, and the first query with and without warm-up.
+
+    python -m benchmarks.startup --output startup.json
+    python -m benchmarks.startup --compare startup.json
+
+Every measurement runs in a fresh interpreter. Import timings are the
+median wall time of importing each entry point (--repeats runs), with the
+slowest direct dependencies from python -X importtime alongside. Streamlit
+is optional here: when it is not installed, "app" is skipped and
+"app_modules" (everything app.py imports besides Streamlit) stands in.
+
+For the first query a synthetic corpus is ingested once, then a new
+process answers one question against a fresh fake Ollama server, whose
+first request per model waits --load-ms as if loading it: "cold" asks
+straight away, "warm" runs warmup.warm_up() first. With --compare the
+results are checked against a previous run, as in benchmarks.run.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from config import settings
+from benchmarks.corpus import make_chunks, make_files, make_queries
+from benchmarks.fake_ollama import FakeOllamaConfig, start_fake_ollama
+from benchmarks.run import _git_commit, compare, reset_state
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_TARGETS = {
+    "config": ["config"],
+    "app_modules": [
+        "query_client", "ingest_queue", "get_vector_db", "document_registry", "llm_registry", "conversation", "warmup"
+    ],
+    "app": ["app"],
+    "server": ["server"],
+    "query": ["query"],
+    "embed": ["embed"],
+}
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+def child_env(workdir: str, base_url: str = "") -> dict:
+    """Environment for a measured process: stores under workdir, quiet logs, no caches"""
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")])),
+        "CHROMA_PATH": os.path.join(workdir, "chroma"),
+        "ARCHIVE_CHROMA_PATH": os.path.join(workdir, "chroma_archive"),
+        "TEMP_FOLDER": os.path.join(workdir, "temp"),
+        "LOGS_PATH": os.path.join(workdir, "logs"),
+        "METRICS_LOG_PATH": "",
+        "EMBEDDING_CACHE_ENABLED": "false",
+        "ANSWER_CACHE_ENABLED": "false",
+        "LOG_LEVEL": "WARNING",
+    })
+    if base_url:
+        env["OLLAMA_BASE_URL"] = base_url
+    return env
+
+def time_import(modules: list, env: dict, cwd: str, repeats: int, top: int) -> dict:
+    """Median import time of modules in fresh interpreters, plus their slowest direct dependencies"""
+    code = f"import time; start = time.perf_counter(); import {', '.join(modules)}; print(time.perf_counter() - start)"
+    seconds, slowest = [], []
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code], env=env, cwd=cwd, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"}
+        seconds.append(float(result.stdout.strip().splitlines()[-1]))
+        dependencies = [
+            (match.group(4), int(match.group(2)) / 1000)
+            for match in map(IMPORTTIME_LINE.match, result.stderr.splitlines())
+            if match and len(match.group(3)) == 2  # Imported by one of the modules themselves
+        ]
+        slowest = sorted(dependencies, key=lambda item: item[1], reverse=True)[:top]
+    return {"ms": statistics.median(seconds) * 1000, "slowest": [[name, round(ms, 1)] for name, ms in slowest]}
+
+def first_query(mode: str, query: str):
+    """Child process: time to ready and the first answer, as one JSON line on stdout"""
+    start = time.perf_counter()
+    timings = {}
+    if mode == "warm":
+        from warmup import warm_up, warmup_status
+        warm_up(wait=True)
+        timings["warmup_ms"] = (time.perf_counter() - start) * 1000
+        timings["warmup_steps_ms"] = {
+            step: seconds * 1000 for step, seconds in warmup_status()["timings"].items() if step != "total"
+        }
+    from query import get_query_handler
+    handler = get_query_handler()
+    ready = time.perf_counter()
+    timings["ready_ms"] = (ready - start) * 1000
+    first = None
+    for _ in handler.stream_query(query):
+        if first is None:
+            first = time.perf_counter()
+    end = time.perf_counter()
+    timings["ttft_ms"] = ((first or end) - ready) * 1000
+    timings["query_ms"] = (end - ready) * 1000
+    timings["process_ms"] = (end - start) * 1000
+    print(json.dumps(timings))
+
+def run_first_query(mode: str, query: str, workdir: str, args) -> dict:
+    # A fresh server per run, so every run starts with no model loaded
+    server, base_url = start_fake_ollama(FakeOllamaConfig(
+        dim=args.dim, ttft_ms=args.ttft_ms, answer_tokens=args.answer_tokens, load_ms=args.load_ms
+    ))
+    try:
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup", "--child", mode, "--query", query],
+            env=child_env(workdir, base_url), cwd=workdir, capture_output=True, text=True
+        )
+    finally:
+        server.shutdown()
+    if result.returncode != 0:
+        raise RuntimeError(f"{mode} run failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def build_corpus(workdir: str, args) -> str:
+    """Ingest the corpus into workdir; returns a question about it"""
+    server, base_url = start_fake_ollama(FakeOllamaConfig(dim=args.dim, embed_latency_ms=0, embed_item_latency_ms=0))
+    settings.ollama_base_url = base_url
+    settings.embedding_cache_enabled = False
+    try:
+        reset_state(workdir)
+        from embed import embed_files
+        chunks = make_chunks(args.chunks, seed=args.seed)
+        embed_files(make_files(chunks))
+        return make_queries(chunks, 1, seed=args.seed + 1)[0][0]
+    finally:
+        reset_state(workdir)
+        server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", nargs="+", default=list(IMPORT_TARGETS), choices=list(IMPORT_TARGETS))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--importtime-top", type=int, default=5, help="slowest direct dependencies listed per target")
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--load-ms", type=float, default=1000.0, help="simulated model load per model")
+    parser.add_argument("--ttft-ms", type=float, default=150.0)
+    parser.add_argument("--answer-tokens", type=int, default=32)
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON from a previous run")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    parser.add_argument("--child", choices=["cold", "warm"], help=argparse.SUPPRESS)
+    parser.add_argument("--query", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        first_query(args.child, args.query)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    try:
+        imports = {}
+        for target in args.targets:
+            imports[target] = time_import(
+                IMPORT_TARGETS[target], child_env(workdir), workdir, args.repeats, args.importtime_top
+            )
+            print(f"import {target:<12} {imports[target].get('ms', 0):8.0f} ms {imports[target].get('error', '')}", file=sys.stderr)
+
+        query = build_corpus(workdir, args)
+        runs = {mode: run_first_query(mode, query, workdir, args) for mode in ("cold", "warm")}
+        for mode, run in runs.items():
+            print(
+                f"{mode:<5} ready={run['ready_ms']:.0f}ms ttft={run['ttft_ms']:.0f}ms query={run['query_ms']:.0f}ms"
+                + (f" warmup={run['warmup_ms']:.0f}ms" if "warmup_ms" in run else ""),
+                file=sys.stderr
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": [{"chunks": args.chunks, "imports": imports, "first_query": runs}],
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for metric, old, new, change in regressions:
+            print(f"REGRESSION {metric}: {old:.4g} -> {new:.4g} ({change:+.1%})", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("No regressions beyond tolerance", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Compare the vector store engines behind settings.vector_store on the same data.
+
+    python -m benchmarks.vector_stores --chunks 10000 50000 100000
+    python -m benchmarks.vector_stores --chunks 20000 --stores numpy --output stores.json
+
+For each collection size, synthetic unit-length embeddings (as in
+benchmarks.index_tuning) are inserted through the VectorStore interface in
+batches of settings.insert_batch_size. Each store then answers the same
+queries, and the results are compared with an exact brute-force search.
+The report covers insert throughput, p50/p95 search latency, recall@k, how
+long it takes to reopen the store from disk (for numpy, the snapshot
+written by persist()) and the process memory high-water mark.
+"""
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from config import settings
+from benchmarks.index_tuning import exact_top_k, make_vectors, recall
+from benchmarks.run import max_rss_mb, percentiles
+from vector_store import ChromaVectorStore, NumpyVectorStore
+
+def open_store(name: str, workdir: str):
+    if name == "chroma":
+        return ChromaVectorStore(workdir, "benchmark")
+    return NumpyVectorStore(f"{workdir}/benchmark.vectors.pkl")
+
+def bench_store(name: str, vectors, queries, truth, k: int) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f"vector_store_{name}_")
+    try:
+        store = open_store(name, workdir)
+        ids = [str(i) for i in range(len(vectors))]
+        documents = [f"chunk {i}" for i in range(len(vectors))]
+        metadatas = [{"source": f"doc_{i // 100:05d}.txt"} for i in range(len(vectors))]
+        start = time.perf_counter()
+        for i in range(0, len(vectors), settings.insert_batch_size):
+            end = i + settings.insert_batch_size
+            store.add(ids[i:end], vectors[i:end], documents[i:end], metadatas[i:end])
+        store.persist()
+        insert = time.perf_counter() - start
+
+        times, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            hits = store.search(query, k)
+            times.append(time.perf_counter() - start)
+            found.append([int(hit["id"]) for hit in hits])
+
+        del store
+        start = time.perf_counter()
+        reopened = open_store(name, workdir)
+        count = reopened.count()
+        reopen = time.perf_counter() - start
+        return {
+            "store": name,
+            "insert_s": insert,
+            "inserts_per_sec": len(vectors) / insert,
+            "search": percentiles(times),
+            "recall": recall(found, truth),
+            "reopen_s": reopen,
+            "reopened_count": count,
+            "max_rss_mb": max_rss_mb()[0],
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[10000, 50000, 100000])
+    parser.add_argument("--stores", nargs="+", default=["numpy", "chroma"], choices=["numpy", "chroma"])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.08)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    results = []
+    for n in args.chunks:
+        rng = np.random.default_rng(args.seed)
+        centres = rng.standard_normal((args.topics, args.dim)).astype(np.float32)
+        centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+        vectors = make_vectors(n, centres, args.noise, rng)
+        queries = make_vectors(args.queries, centres, args.noise, rng)
+        truth = exact_top_k(vectors, queries, args.k)
+        for name in args.stores:
+            result = dict(bench_store(name, vectors, queries, truth, args.k), chunks=n)
+            results.append(result)
+            print(
+                f"{name:<7} n={n:<7} insert={result['inserts_per_sec']:.0f}/s "
+                f"p50={result['search']['p50_ms']:.2f}ms p95={result['search']['p95_ms']:.2f}ms "
+                f"recall={result['recall']:.3f} reopen={result['reopen_s']:.2f}s",
+                file=sys.stderr
+            )
+
+    output = json.dumps({"args": vars(args), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
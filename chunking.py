@@ -0,0 +1,232 @@
+import os
+import re
+from logger_config import setup_logger
+from config import settings
+
+logger = setup_logger('chunking')
+
+CHUNK_STRATEGIES = ("structured", "recursive")
+
+# Word pieces and punctuation; long words count as several tokens, roughly
+# as a BPE tokenizer would split them
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+WORD_PIECE_CHARS = 6
+
+PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n\s*")
+# How oversized paragraphs are cut, from the most to the least natural break
+SEPARATORS = (
+    re.compile(r"\n\s*"),
+    re.compile(r"(?<=[.!?;:])\s+"),
+    re.compile(r"\s+"),
+)
+ATX_HEADING = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$")
+SETEXT_UNDERLINE = re.compile(r"^(=+|-+)[ \t]*$")
+MAX_HEADING_CHARS = 200
+
+def count_tokens(text: str) -> int:
+    """Approximate LLM token count; Ollama does not expose the model's tokenizer"""
+    return sum(1 + (len(piece) - 1) // WORD_PIECE_CHARS for piece in TOKEN_PATTERN.findall(text))
+
+def file_type(source: str) -> str:
+    return os.path.splitext(source)[1].lower().lstrip('.')
+
+def chunk_limits(source: str) -> tuple:
+    """(chunk tokens, overlap tokens, parent tokens) for a file, with per-type overrides applied"""
+    overrides = settings.chunk_tokens_by_type.get(file_type(source), {})
+    return (
+        overrides.get("chunk", settings.chunk_tokens),
+        overrides.get("overlap", settings.chunk_overlap_tokens),
+        overrides.get("parent", settings.parent_chunk_tokens),
+    )
+
+def full_chunk_tokens() -> int:
+    """Size of the largest passage a single search hit can put into the prompt"""
+    if settings.chunk_strategy == "recursive":
+        return settings.chunk_size // 4
+    sizes = [(settings.chunk_tokens, settings.parent_chunk_tokens)] + [
+        (overrides.get("chunk", settings.chunk_tokens), overrides.get("parent", settings.parent_chunk_tokens))
+        for overrides in settings.chunk_tokens_by_type.values()
+    ]
+    return max(max(chunk, parent) for chunk, parent in sizes)
+
+def _trim(text: str, start: int, end: int) -> tuple:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+def _segments(text: str, start: int, end: int, pattern) -> list:
+    """Non-blank spans of text[start:end] between matches of pattern"""
+    spans, position = [], start
+    for match in pattern.finditer(text, start, end):
+        spans.append(_trim(text, position, match.start()))
+        position = match.end()
+    spans.append(_trim(text, position, end))
+    return [(s, e) for s, e in spans if s < e]
+
+def _heading(block: str):
+    """(level, title) if the paragraph starts with a Markdown heading"""
+    lines = block.split("\n", 2)
+    match = ATX_HEADING.match(lines[0])
+    if match and len(lines[0]) <= MAX_HEADING_CHARS:
+        return len(match.group(1)), match.group(2)
+    if len(lines) > 1 and lines[0].strip() and SETEXT_UNDERLINE.match(lines[1]) and len(lines[0]) <= MAX_HEADING_CHARS:
+        return (1 if lines[1].startswith("=") else 2), lines[0].strip()
+    return None
+
+class StructuredChunker:
+    """Token-sized chunks that follow the structure of the text.
+
+    Chunks never cross a page or a heading. Paragraphs are packed whole
+    while they fit; one that does not fit starts a new chunk, and only
+    paragraphs larger than a chunk are cut, at line, sentence and finally
+    word boundaries (filling up the current chunk first when it is less
+    than half full). When a chunk is closed in the middle of a paragraph,
+    the next one repeats its last pieces, up to the overlap.
+
+    With a parent size set, consecutive chunks of a section are also
+    grouped into parent spans: the small chunks are embedded and searched,
+    and their parent span (metadata 'parent_content', starting at
+    'parent_start') is what goes into the prompt.
+
+    Every chunk is an exact slice of its page, starting at metadata
+    'start_index', so neighbouring chunks can be merged at query time. The
+    chunker keeps the current heading path (metadata 'section') from one
+    page to the next, so use one instance per file.
+    """
+
+    def __init__(self, chunk_tokens: int, overlap_tokens: int = 0, parent_tokens: int = 0):
+        self.chunk_tokens = max(chunk_tokens, 16)
+        self.overlap_tokens = min(overlap_tokens, self.chunk_tokens // 2)
+        self.parent_tokens = parent_tokens if parent_tokens > self.chunk_tokens else 0
+        self.headings = []
+
+    def _pieces(self, text: str, start: int, end: int, level: int = 0) -> list:
+        """Split an oversized span into (start, end, tokens) pieces that each fit in a chunk"""
+        tokens = count_tokens(text[start:end])
+        if tokens <= self.chunk_tokens:
+            return [(start, end, tokens)]
+        if level == len(SEPARATORS):
+            # A single run of characters longer than a chunk
+            step = max(1, (end - start) * self.chunk_tokens // tokens)
+            return [
+                (s, min(s + step, end), count_tokens(text[s:min(s + step, end)]))
+                for s in range(start, end, step)
+            ]
+        pieces = []
+        for s, e in _segments(text, start, end, SEPARATORS[level]):
+            pieces.extend(self._pieces(text, s, e, level + 1))
+        return pieces
+
+    def _sections(self, text: str) -> list:
+        """[(heading path, [(start, end, tokens) per paragraph])], split at headings"""
+        sections, paragraphs = [], []
+        for start, end in _segments(text, 0, len(text), PARAGRAPH_BREAK):
+            heading = _heading(text[start:end])
+            if heading:
+                if paragraphs:
+                    sections.append((" > ".join(self._titles()), paragraphs))
+                    paragraphs = []
+                level, title = heading
+                self.headings = [(lvl, t) for lvl, t in self.headings if lvl < level] + [(level, title)]
+            paragraphs.append((start, end, count_tokens(text[start:end])))
+        if paragraphs:
+            sections.append((" > ".join(self._titles()), paragraphs))
+        return sections
+
+    def _titles(self) -> list:
+        return [title for _, title in self.headings]
+
+    def _pack(self, text: str, paragraphs: list) -> list:
+        """Group paragraphs (cut when oversized) into [(start, end, tokens)] chunks"""
+        chunks, current, used, carried = [], [], 0, 0
+
+        def close(keep_overlap: bool):
+            nonlocal current, used, carried
+            chunks.append((current[0][0], current[-1][1], used))
+            overlap = []
+            if keep_overlap:
+                for piece in reversed(current[1:]):
+                    if sum(t for _, _, t in overlap) + piece[2] > self.overlap_tokens:
+                        break
+                    overlap.insert(0, piece)
+            current, used, carried = overlap, sum(t for _, _, t in overlap), len(overlap)
+
+        for paragraph in paragraphs:
+            if used + paragraph[2] <= self.chunk_tokens:
+                current.append(paragraph)
+                used += paragraph[2]
+                continue
+            if paragraph[2] <= self.chunk_tokens:
+                if current:
+                    close(keep_overlap=False)
+                current, used, carried = [paragraph], paragraph[2], 0
+                continue
+            # An oversized paragraph is cut anyway; it only starts a new chunk
+            # if the current one is reasonably full, so a heading stays with it
+            if used >= self.chunk_tokens // 2:
+                close(keep_overlap=False)
+            for piece in self._pieces(text, paragraph[0], paragraph[1]):
+                if used + piece[2] > self.chunk_tokens:
+                    if len(current) > carried:
+                        close(keep_overlap=True)
+                    if used + piece[2] > self.chunk_tokens:  # No room for the overlap
+                        current, used, carried = [], 0, 0
+                current.append(piece)
+                used += piece[2]
+        if current:
+            chunks.append((current[0][0], current[-1][1], used))
+        return chunks
+
+    def _parents(self, chunks: list) -> list:
+        """(start, end) of the parent span of each chunk"""
+        spans, group, used = [], [], 0
+        for start, end, tokens in chunks:
+            if group and used + tokens > self.parent_tokens:
+                spans.extend([(group[0][0], group[-1][1])] * len(group))
+                group, used = [], 0
+            group.append((start, end))
+            used += tokens
+        if group:
+            spans.extend([(group[0][0], group[-1][1])] * len(group))
+        return spans
+
+    def split(self, page) -> list:
+        from langchain_core.documents import Document
+        text = page.page_content
+        documents = []
+        for section, paragraphs in self._sections(text):
+            chunks = self._pack(text, paragraphs)
+            parents = self._parents(chunks) if self.parent_tokens else [None] * len(chunks)
+            for (start, end, _), parent in zip(chunks, parents):
+                metadata = dict(page.metadata, start_index=start)
+                if section:
+                    metadata["section"] = section
+                if parent and parent != (start, end):
+                    metadata["parent_start"] = parent[0]
+                    metadata["parent_content"] = text[parent[0]:parent[1]]
+                documents.append(Document(page_content=text[start:end], metadata=metadata))
+        return documents
+
+class RecursiveChunker:
+    """The original fixed-size character splitter, kept for comparison"""
+
+    def __init__(self):
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=settings.chunk_size,
+            chunk_overlap=settings.chunk_overlap,
+            add_start_index=True
+        )
+
+    def split(self, page) -> list:
+        return self.splitter.split_documents([page])
+
+def get_chunker(source: str):
+    """A fresh chunker for one file, following settings.chunk_strategy"""
+    if settings.chunk_strategy == "recursive":
+        return RecursiveChunker()
+    if settings.chunk_strategy != "structured":
+        logger.warning(f"Unknown chunk strategy {settings.chunk_strategy}, using structured")
+    return StructuredChunker(*chunk_limits(source))
@@ -0,0 +1,57 @@
+import sqlite3
+import threading
+from pathlib import Path
+from logger_config import setup_logger
+
+logger = setup_logger('collection_state')
+
+class CollectionState:
+    """Version counter shared by every process that uses the collections under one path.
+
+    The Streamlit app ingests while the query service answers, each with its
+    own in-memory caches (chunk count, answer cache version, indexes, the
+    numpy store). A process that changed the collections calls publish()
+    once its changes are on disk; the others see the new version through
+    changed() and reload what they cached. Reading the version is a single
+    indexed SELECT, cheap enough to run on every query.
+    """
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO state (name, version) VALUES ('collections', 0)")
+        self._seen = self._read()
+
+    def _read(self) -> int:
+        return self._conn.execute("SELECT version FROM state WHERE name = 'collections'").fetchone()[0]
+
+    def changed(self) -> bool:
+        """Whether another process published a change since this one last looked"""
+        with self._lock:
+            version = self._read()
+            if version == self._seen:
+                return False
+            self._seen = version
+            return True
+
+    def publish(self) -> bool:
+        """Tell the other processes the collections changed.
+
+        Returns whether another process had also published a change that this
+        one had not seen yet, so the caller can reload its own caches too.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = self._read()
+                self._conn.execute("UPDATE state SET version = ? WHERE name = 'collections'", (version + 1,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            missed = version != self._seen
+            self._seen = version + 1
+            return missed
@@ -4,17 +4,92 @@ from pathlib import Path
 
 class Settings(BaseSettings):
     llm_model: str = "llama3.2:latest"
+    ollama_base_url: str = "http://localhost:11434"
     temp_folder: str = "./_temp"
     chroma_path: str = "./chroma"
     logs_path: str = "./logs"
     collection_name: str = "LocalRAG"
     text_embedding_model: str = "nomic-embed-text"
     log_level: str = "INFO"
-    chunk_size: int = 2048
+    chunk_strategy: str = "structured"  # structured (token-sized, follows headings and paragraphs) | recursive
+    chunk_tokens: int = 256
+    chunk_overlap_tokens: int = 32  # repeated when a paragraph has to be cut
+    parent_chunk_tokens: int = 0  # > chunk_tokens: search small chunks, send their enclosing span as context
+    chunk_tokens_by_type: dict = {}  # per extension, e.g. {"pdf": {"chunk": 384, "overlap": 48, "parent": 1024}}
+    chunk_size: int = 2048  # characters, recursive strategy only
     chunk_overlap: int = 16
-    max_context_docs: int = 3
+    llm_keep_alive: str = "30m"  # how long Ollama keeps a used model loaded
+    llm_max_loaded_models: int = 2  # least recently used models beyond this are unloaded
+    llm_prewarm: bool = True
+    warmup_enabled: bool = True  # open the collection and load the models in the background at startup
+    model_list_ttl_seconds: int = 60
+    history_window_messages: int = 4  # recent messages sent verbatim; older ones are summarised
+    history_max_tokens: int = 768
+    history_summary_max_tokens: int = 256
+    query_rewrite: str = "auto"  # auto (follow-ups only) | always | off
+    llm_num_ctx: int = 4096  # context window requested from Ollama
+    model_context_tokens: dict = {}  # per-model overrides, e.g. {"llama3.1:8b": 8192}
+    context_candidates: int = 8  # retrieved chunks considered for the prompt
+    context_max_tokens: int = 2048  # cap on retrieved context, even with larger windows
+    context_min_relative_score: float = 0.5  # skip chunks scoring below this share of the best
+    answer_token_reserve: int = 1024
+    context_compression: bool = False  # keep only query-bearing sentences of each chunk
+    ingest_parse_workers: int = 4
+    embed_concurrency: int = 4
+    embed_batch_size: int = 64
+    insert_batch_size: int = 256
+    stream_threshold_mb: int = 50
+    ingest_batch_files: int = 8  # queued uploads ingested together by the background worker
+    ingest_max_attempts: int = 3
+    ingest_retry_delay_seconds: int = 10  # doubled after each failed attempt
+    ingest_poll_seconds: float = 1.0  # how often the sidebar refreshes job progress
+    vector_store: str = "chroma"  # chroma | numpy (in-memory exact search, for small or hot collections) | quantized (memory-mapped int8/float16 vectors, flat scan)
+    numpy_store_snapshot: bool = True  # persist the numpy store to a snapshot file next to the collection
+    vector_space: str = "l2"  # l2 | cosine | ip; fixed once a collection is created
+    hnsw_m: int = 16
+    hnsw_construction_ef: int = 100
+    hnsw_search_ef: int = 10
+    quantized_dtype: str = "int8"  # int8 | float16, for vector_store quantized
     archive_chroma_path: str = "./chroma_archive"
     archive_collection_name: str = "LocalRAG_Archive"
+    archive_batch_size: int = 500
+    search_collections: list = []  # searched along with the current collection, e.g. ["LocalRAG_Archive"]
+    collection_search_timeout: float = 2.0  # seconds per collection when searching several
+    collection_search_workers: int = 4
+    embedding_cache_enabled: bool = True
+    embedding_cache_path: str = "./embedding_cache/embeddings.sqlite3"
+    embedding_cache_max_entries: int = 500_000
+    hybrid_search: bool = True
+    hybrid_candidates: int = 20
+    hybrid_vector_weight: float = 1.0
+    hybrid_lexical_weight: float = 1.0
+    rrf_k: int = 60
+    relevance_mode: str = "score"  # score | cross_encoder | llm
+    relevance_min_similarity: float = 0.5
+    relevance_cross_encoder_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    relevance_cross_encoder_threshold: float = 0.5
+    relevance_min_lexical_coverage: float = 0.75
+    rerank_enabled: bool = False  # re-order retrieved chunks with a cross-encoder (needs sentence-transformers)
+    rerank_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    rerank_candidates: int = 20  # retrieved and scored; the best context_candidates are kept
+    rerank_batch_size: int = 8
+    rerank_min_score: float = 0.1  # chunks scored below this probability are dropped
+    rerank_budget_ms: float = 300  # scoring time allowed per query; 0 = unlimited
+    rerank_skip_after_ms: float = 1500  # skip re-ranking when the query has already taken this long; 0 = never
+    rerank_cache_entries: int = 50_000
+    query_service_url: str = ""  # e.g. http://localhost:8000 to use server.py
+    query_service_timeout: int = 300
+    server_host: str = "0.0.0.0"
+    server_port: int = 8000
+    server_max_concurrent: int = 4
+    server_max_queue: int = 32
+    batch_query_size: int = 32  # questions embedded and searched together by batch_query.py
+    batch_query_concurrency: int = 4  # answers generated at once; match Ollama's OLLAMA_NUM_PARALLEL
+    answer_cache_enabled: bool = True
+    answer_cache_max_entries: int = 256
+    answer_cache_ttl_seconds: int = 3600
+    answer_cache_similarity_threshold: float = 0.97
+    metrics_log_path: str = "./logs/metrics.jsonl"  # one JSON line per query / ingested file; "" to disable
     
     @property
     def log_level_value(self) -> int:
@@ -25,5 +100,4 @@ class Settings(BaseSettings):
         Path(self.chroma_path).mkdir(parents=True, exist_ok=True)
         Path(self.archive_chroma_path).mkdir(parents=True, exist_ok=True)
 
-settings = Settings()
-settings.validate_paths()
\ No newline at end of file
+settings = Settings()
\ No newline at end of file
@@ -0,0 +1,171 @@
+import hashlib
+import re
+from chunking import count_tokens, full_chunk_tokens
+from get_vector_db import distance_to_similarity
+from lexical_index import tokenize
+from logger_config import setup_logger
+from config import settings
+
+logger = setup_logger('context_builder')
+
+# Rough size of a token for Llama-family tokenizers on English text, for cutting text to a token limit
+CHARS_PER_TOKEN = 4
+
+# Chunks from the same page that are at most this far apart are merged
+MERGE_GAP_CHARS = 4
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+
+def estimate_tokens(text: str) -> int:
+    """Token estimate, the same one chunks are sized with; Ollama does not expose the model's tokenizer"""
+    return count_tokens(text) + 1
+
+def model_context_window(model: str) -> int:
+    return settings.model_context_tokens.get(model, settings.llm_num_ctx)
+
+def context_token_budget(model: str, fixed_text: str = "") -> int:
+    """Tokens available for retrieved context once the prompt template, the
+    question (fixed_text) and the answer reserve are accounted for"""
+    available = model_context_window(model) - settings.answer_token_reserve - estimate_tokens(fixed_text)
+    return max(0, min(settings.context_max_tokens, available))
+
+def source_score(source: dict) -> float:
+    if 'rerank_score' in source:
+        return source['rerank_score']
+    if 'fusion_score' in source:
+        return source['fusion_score']
+    if 'normalized_score' in source:  # Merged from several collections
+        return max(source['normalized_score'], 0.0)
+    if 'similarity_score' in source:
+        return max(distance_to_similarity(source['similarity_score']), 0.0)
+    return 0.0
+
+def expand_parent(source: dict) -> dict:
+    """Swap a small search chunk for the parent span it was cut from, when it has one"""
+    metadata = source.get('metadata') or {}
+    if 'parent_content' not in metadata:
+        return source
+    metadata = dict(metadata)
+    content = metadata.pop('parent_content')
+    metadata['start_index'] = metadata.pop('parent_start', metadata.get('start_index'))
+    return dict(source, content=content, metadata=metadata)
+
+def _dedupe(sources: list) -> list:
+    """Drop chunks whose text repeats, or is contained in, a better ranked chunk"""
+    kept, seen = [], set()
+    for source in sources:
+        content = (source.get('content') or "").strip()
+        digest = hashlib.sha256(content.encode("utf-8")).digest()
+        if not content or digest in seen or any(content in other['content'] for other in kept):
+            continue
+        seen.add(digest)
+        kept.append(dict(source, content=content))
+    return kept
+
+def compress(query: str, text: str) -> str:
+    """Keep only the sentences that share terms with the query, in document order"""
+    terms = set(tokenize(query))
+    sentences = [sentence.strip() for sentence in SENTENCE_PATTERN.split(text) if sentence.strip()]
+    if not terms or len(sentences) < 2:
+        return text
+    keep = [i for i, sentence in enumerate(sentences) if terms & set(tokenize(sentence))]
+    if not keep:
+        return text
+    parts, previous = [], -1
+    for i in keep:
+        if previous >= 0 and i != previous + 1:
+            parts.append("…")
+        parts.append(sentences[i])
+        previous = i
+    return " ".join(parts)
+
+def _span(source: dict):
+    metadata = source.get('metadata') or {}
+    start = metadata.get('start_index')
+    if start is None or source.get('compressed'):
+        return None
+    return (metadata.get('source'), metadata.get('page')), start, start + len(source['content'])
+
+def _merge_adjacent(selected: list) -> list:
+    """Merge chunks that are neighbours (or overlap) in the same source page"""
+    merged, by_position = [], []
+    for source in selected:
+        span = _span(source)
+        if span is None:
+            merged.append(source)
+        else:
+            by_position.append((span, source))
+    by_position.sort(key=lambda item: (str(item[0][0]), item[0][1]))
+
+    current = current_key = current_end = None
+    for (key, start, end), source in by_position:
+        if current is not None and key == current_key and start <= current_end + MERGE_GAP_CHARS:
+            if start < current_end:
+                content = current['content'] + source['content'][current_end - start:]
+            else:
+                content = current['content'] + "\n\n" + source['content']
+            current = dict(
+                current,
+                content=content,
+                ids=current['ids'] + [source.get('id')],
+                score=max(current['score'], source['score']),
+                rank=min(current['rank'], source['rank'])
+            )
+            current_end = max(current_end, end)
+            continue
+        if current is not None:
+            merged.append(current)
+        current, current_key, current_end = dict(source, ids=[source.get('id')]), key, end
+    if current is not None:
+        merged.append(current)
+    return merged
+
+def build_context(query: str, sources: list, budget_tokens: int, compression: bool = None) -> tuple:
+    """Pack retrieved chunks into at most budget_tokens of context.
+
+    Chunks with a parent span are replaced by it, then chunks are
+    deduplicated and optionally reduced to their query-bearing sentences.
+    The best ranked chunk goes in first (truncated if it alone exceeds the
+    budget); the rest, down to settings.context_min_relative_score
+    of the best score, are added greedily by score per token until the
+    budget is spent. Chosen chunks that are adjacent in the same document
+    are merged so their overlap is only sent once.
+
+    Returns (context text, packed sources in rank order).
+    """
+    compression = settings.context_compression if compression is None else compression
+    candidates = []
+    for rank, source in enumerate(_dedupe([expand_parent(source) for source in sources])):
+        candidate = dict(source, rank=rank, score=source_score(source))
+        if compression:
+            reduced = compress(query, candidate['content'])
+            if reduced != candidate['content']:
+                candidate.update(content=reduced, compressed=True)
+        candidate['tokens'] = estimate_tokens(candidate['content'])
+        candidates.append(candidate)
+    if not candidates:
+        return "", []
+
+    best = candidates[0]
+    if best['tokens'] > budget_tokens:
+        content = best['content'][:max(budget_tokens, 1) * CHARS_PER_TOKEN]
+        best = dict(best, content=content, tokens=estimate_tokens(content), truncated=True)
+    selected, used = [best], best['tokens']
+    floor = best['score'] * settings.context_min_relative_score
+    rest = [candidate for candidate in candidates[1:] if candidate['score'] >= floor]
+    # A short chunk is not more relevant per token than a full one, so costs
+    # are floored at a full chunk and only oversized passages are penalised
+    full_chunk = full_chunk_tokens()
+    for candidate in sorted(rest, key=lambda c: (-c['score'] / max(c['tokens'], full_chunk), c['rank'])):
+        if used + candidate['tokens'] <= budget_tokens:
+            selected.append(candidate)
+            used += candidate['tokens']
+
+    packed = sorted(_merge_adjacent(selected), key=lambda source: source['rank'])
+    for source in packed:
+        source['tokens'] = estimate_tokens(source['content'])
+    logger.debug(
+        f"Packed {len(selected)} of {len(candidates)} chunks into {len(packed)} passages, "
+        f"~{sum(source['tokens'] for source in packed)}/{budget_tokens} tokens"
+    )
+    return "\n\n".join(source['content'] for source in packed), packed
@@ -0,0 +1,169 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from context_builder import CHARS_PER_TOKEN, estimate_tokens
+from llm_registry import get_llm_registry
+from logger_config import setup_logger
+from config import settings
+
+logger = setup_logger('conversation')
+
+REWRITE_PROMPT = """Rewrite the follow-up question as a standalone question that can be understood without the conversation. Keep names, numbers and identifiers. Reply with the question only.
+
+Conversation:
+{history}
+
+Follow-up question: {question}
+Standalone question:"""
+
+SUMMARY_PROMPT = """Update the summary of a conversation with the new messages. Keep facts, names, document references and open questions; drop pleasantries. Reply with the summary only, at most {max_words} words.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+
+Updated summary:"""
+
+# Questions that probably lean on earlier turns ("and what about section 3?")
+FOLLOW_UP_PATTERN = re.compile(
+    r"^\s*(and|but|so|also|then|what about|how about)\b"
+    r"|\b(it|its|they|them|their|this|that|these|those|he|she|him|his|her|there|above|previous|same|former|latter)\b",
+    re.IGNORECASE
+)
+
+_summary_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+
+def needs_rewrite(question: str) -> bool:
+    """Cheap check for questions that need the conversation to be understood"""
+    return bool(FOLLOW_UP_PATTERN.search(question)) or len(question.split()) <= 3
+
+def _clip(text: str, max_tokens: int) -> str:
+    limit = max_tokens * CHARS_PER_TOKEN
+    return text if len(text) <= limit else text[:limit].rstrip() + " …"
+
+def _format(messages: list) -> str:
+    return "\n".join(f"{'User' if role == 'user' else 'Assistant'}: {content}" for role, content in messages)
+
+class Conversation:
+    """Bounded history for one chat session.
+
+    The last settings.history_window_messages messages are kept verbatim.
+    Older ones are folded into a rolling summary in the background, one
+    batch at a time, so each turn only sends the summary plus the window
+    and the prompt stays the same size however long the chat gets.
+    Summarised messages are dropped, so memory stays bounded too.
+    """
+
+    def __init__(self, messages: list = None, summary: str = ""):
+        self.messages = list(messages or [])
+        self.summary = summary
+        self._generation = 0
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def add_exchange(self, question: str, answer: str, model: str = None):
+        with self._lock:
+            self.messages.extend([("user", question), ("assistant", answer)])
+        self._schedule_summary(model)
+
+    def clear(self):
+        with self._lock:
+            self.messages, self.summary = [], ""
+            self._generation += 1
+
+    def __bool__(self):
+        return bool(self.messages or self.summary)
+
+    def window(self) -> list:
+        """The most recent messages, newest last, within settings.history_max_tokens"""
+        with self._lock:
+            recent = self.messages[-settings.history_window_messages:] if settings.history_window_messages else []
+        per_message = max(settings.history_max_tokens // max(len(recent), 1), 1)
+        return [(role, _clip(content, per_message)) for role, content in recent]
+
+    def as_messages(self) -> list:
+        """Summary and window as chat messages to put before the current question"""
+        from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+        messages = []
+        if self.summary:
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation:\n{self.summary}"))
+        for role, content in self.window():
+            messages.append(HumanMessage(content=content) if role == "user" else AIMessage(content=content))
+        return messages
+
+    def history_text(self) -> str:
+        parts = [f"(Earlier: {self.summary})"] if self.summary else []
+        window = self.window()
+        if window:
+            parts.append(_format(window))
+        return "\n".join(parts)
+
+    def token_estimate(self) -> int:
+        return estimate_tokens(self.history_text()) if self else 0
+
+    def rewrite(self, question: str, llm) -> str:
+        """Standalone version of a follow-up question; the question itself if none is needed"""
+        if not self or settings.query_rewrite == "off":
+            return question
+        if settings.query_rewrite == "auto" and not needs_rewrite(question):
+            return question
+        try:
+            prompt = REWRITE_PROMPT.format(history=self.history_text(), question=question)
+            response = llm.invoke(prompt)
+            text = (response.content if hasattr(response, 'content') else str(response)).strip()
+            rewritten = text.splitlines()[0].strip().strip('"') if text else ""
+            if rewritten:
+                logger.debug(f"Rewrote '{question}' as '{rewritten}'")
+                return rewritten
+        except Exception as e:
+            logger.error(f"Query rewrite failed: {str(e)}")
+        return question
+
+    def _schedule_summary(self, model: str = None):
+        with self._lock:
+            behind = len(self.messages) - settings.history_window_messages
+            if behind <= 0 or (self._pending is not None and not self._pending.done()):
+                return
+            self._pending = _summary_pool.submit(self._summarize, model)
+
+    def _summarize(self, model: str = None):
+        """Fold messages that left the window into the summary; only the new ones are sent"""
+        with self._lock:
+            end = len(self.messages) - settings.history_window_messages
+            new_messages = self.messages[:end]
+            summary = self.summary
+            generation = self._generation
+        if not new_messages:
+            with self._lock:
+                self._pending = None
+            return
+        try:
+            prompt = SUMMARY_PROMPT.format(
+                summary=summary or "(none)",
+                messages=_format([(role, _clip(content, settings.history_max_tokens)) for role, content in new_messages]),
+                max_words=settings.history_summary_max_tokens * 3 // 4
+            )
+            response = get_llm_registry().get(model).invoke(prompt)
+            text = response.content if hasattr(response, 'content') else str(response)
+            with self._lock:
+                if self._generation == generation:  # Not cleared meanwhile
+                    self.summary = _clip(text.strip(), settings.history_summary_max_tokens)
+                    del self.messages[:end]
+            logger.debug(f"Folded {end} messages into the conversation summary")
+        except Exception as e:
+            logger.error(f"Conversation summary failed: {str(e)}")
+            return
+        with self._lock:
+            self._pending = None
+        self._schedule_summary(model)  # Catch up with messages added meanwhile
+
+    def to_dict(self) -> dict:
+        """What a remote query service needs: the summary and the window"""
+        return {"summary": self.summary, "messages": [list(message) for message in self.window()]}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Rebuild a request's history; the sender keeps the summary up to date"""
+        return cls([tuple(message) for message in data.get("messages") or []], data.get("summary") or "")
@@ -0,0 +1,129 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from logger_config import setup_logger
+from config import settings
+
+logger = setup_logger('document_registry')
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def hash_file(file) -> str:
+    """sha256 of a binary stream, read in blocks; leaves the stream at position 0"""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def chunk_hash(chunk) -> str:
+    """Hash of a chunk's text, and of its parent span when it has one, so a changed parent gets a new id"""
+    parent = chunk.metadata.get('parent_content')
+    return hash_text(chunk.page_content if parent is None else f"{chunk.page_content}\0{parent}")
+
+def chunk_id(source: str, chunk_hash: str, occurrence: int) -> str:
+    """Deterministic chunk id, so unchanged chunks keep their id across re-ingestion"""
+    return hashlib.sha256(f"{source}\0{chunk_hash}\0{occurrence}".encode("utf-8")).hexdigest()[:32]
+
+def assign_chunk_ids(source: str, chunks: list) -> list:
+    """Return (chunk_id, chunk_hash) for each chunk; repeated texts get distinct ids"""
+    seen = {}
+    assigned = []
+    for chunk in chunks:
+        digest = chunk_hash(chunk)
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        assigned.append((chunk_id(source, digest, occurrence), digest))
+    return assigned
+
+class DocumentRegistry:
+    """Persistent record of ingested documents: file hash plus chunk hashes and ids per source"""
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                source TEXT PRIMARY KEY,
+                file_hash TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_hash ON documents(file_hash);
+            CREATE TABLE IF NOT EXISTS chunks (
+                chunk_id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                chunk_hash TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source);
+        """)
+        self._conn.commit()
+
+    def get_document(self, source: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source, file_hash, chunk_count, updated_at FROM documents WHERE source = ?", (source,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"source": row[0], "file_hash": row[1], "chunk_count": row[2], "updated_at": row[3]}
+
+    def find_by_hash(self, file_hash: str):
+        """Source name of an already ingested file with this content, if any"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source FROM documents WHERE file_hash = ? LIMIT 1", (file_hash,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def chunk_ids(self, source: str) -> set:
+        with self._lock:
+            rows = self._conn.execute("SELECT chunk_id FROM chunks WHERE source = ?", (source,)).fetchall()
+        return {row[0] for row in rows}
+
+    def sources(self) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT source FROM documents ORDER BY source").fetchall()
+        return [row[0] for row in rows]
+
+    def record(self, source: str, file_hash: str, chunks: list):
+        """Replace the registry entry for source with [(chunk_id, chunk_hash)]"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, source, chunk_hash) VALUES (?, ?, ?)",
+                [(cid, source, chunk_hash) for cid, chunk_hash in chunks]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (source, file_hash, chunk_count, updated_at) VALUES (?, ?, ?, ?)",
+                (source, file_hash, len(chunks), time.time())
+            )
+
+    def delete_document(self, source: str) -> list:
+        """Forget a document and return the chunk ids it owned"""
+        with self._lock, self._conn:
+            ids = [row[0] for row in self._conn.execute("SELECT chunk_id FROM chunks WHERE source = ?", (source,))]
+            self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conn.execute("DELETE FROM documents WHERE source = ?", (source,))
+        return ids
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM documents")
+
+_registry = None
+
+def get_document_registry():
+    global _registry
+    if _registry is None:
+        _registry = DocumentRegistry(Path(settings.chroma_path) / "document_registry.sqlite3")
+    return _registry
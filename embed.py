@@ -1,50 +1,435 @@
-import os
-from datetime import datetime
-from werkzeug.utils import secure_filename
-from langchain_community.document_loaders import TextLoader, PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from get_vector_db import get_vector_db
+import io
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pypdf import PdfReader
+from langchain_core.documents import Document
+from get_vector_db import get_embeddings, add_embedded_documents, delete_chunks, invalidate_stats, save_indexes
+from document_registry import get_document_registry, hash_file, chunk_hash, chunk_id, assign_chunk_ids
+from chunking import get_chunker
+from metrics import get_metrics
 from logger_config import setup_logger
 from config import settings
 
 logger = setup_logger('embed')
-os.makedirs(settings.logs_path, exist_ok=True)
 
-def embed(file):
-    if not file or not file.name.lower().endswith(('.pdf', '.txt')):
-        logger.warning(f"Invalid file type: {file.name if file else 'No file'}")
-        return False
+SUPPORTED_EXTENSIONS = ('.pdf', '.txt')
+
+# Text files are fed to the chunker in segments of roughly this many characters,
+# cut at a blank line so paragraphs stay whole
+TEXT_SEGMENT_CHARS = 64 * 1024
+
+class IngestCancelled(Exception):
+    """Raised inside a file's ingestion when it has been cancelled"""
+
+_parse_pool = None
+_embed_pool = None
+_stream_pool = None
+
+def _get_pools():
+    global _parse_pool, _embed_pool, _stream_pool
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(max_workers=settings.ingest_parse_workers)
+    if _embed_pool is None:
+        _embed_pool = ThreadPoolExecutor(max_workers=settings.embed_concurrency, thread_name_prefix="embed")
+    if _stream_pool is None:
+        _stream_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ingest-stream")
+    return _parse_pool, _embed_pool, _stream_pool
+
+def _file_size(file) -> int:
+    size = getattr(file, 'size', None)
+    if size is None:
+        position = file.tell()
+        size = file.seek(0, io.SEEK_END)
+        file.seek(position)
+    return size
+
+def _iter_pages(stream, source: str):
+    """Yield one Document per PDF page or text segment, parsing lazily from a binary stream"""
+    if source.lower().endswith('.pdf'):
+        reader = PdfReader(stream)
+        for page_number, page in enumerate(reader.pages):
+            yield Document(
+                page_content=page.extract_text() or "",
+                metadata={"source": source, "page": page_number}
+            )
+        return
+
+    text = io.TextIOWrapper(stream, encoding='utf-8', errors='replace')
+    try:
+        lines, size, offset = [], 0, 0
+        for line in text:
+            lines.append(line)
+            size += len(line)
+            if size >= TEXT_SEGMENT_CHARS and (not line.strip() or size >= 4 * TEXT_SEGMENT_CHARS):
+                yield Document(page_content="".join(lines), metadata={"source": source, "offset": offset})
+                lines, size, offset = [], 0, offset + size
+        if lines:
+            yield Document(page_content="".join(lines), metadata={"source": source, "offset": offset})
+    finally:
+        text.detach()  # Leave the caller's stream open
 
+def iter_file_chunks(stream, source: str, timings: dict = None):
+    """Yield chunks page by page without materialising the whole document.
+
+    Chunks come from chunking.get_chunker(), so their size and structure
+    follow settings.chunk_strategy and the limits for this file type. Each
+    chunk records its character offset in the page (or text file) as
+    metadata 'start_index', so neighbouring chunks can be merged at query
+    time. If timings is given, time spent loading pages and splitting them
+    is accumulated into its "load" and "split" entries.
+    """
+    timings = {} if timings is None else timings
+    chunker = get_chunker(source)
+    pages = _iter_pages(stream, source)
+    while True:
+        start = time.perf_counter()
+        page = next(pages, None)
+        loaded = time.perf_counter()
+        timings["load"] = timings.get("load", 0.0) + loaded - start
+        if page is None:
+            return
+        if page.page_content.strip():
+            offset = page.metadata.pop("offset", 0)
+            chunks = chunker.split(page)
+            for chunk in chunks:
+                chunk.metadata["start_index"] += offset
+                if "parent_start" in chunk.metadata:
+                    chunk.metadata["parent_start"] += offset
+            timings["split"] = timings.get("split", 0.0) + time.perf_counter() - loaded
+            yield from chunks
+
+def _load_and_split(data: bytes, source: str) -> tuple:
+    """Parse and split one in-memory file; runs in a worker process. Returns (chunks, timings)"""
+    timings = {}
+    chunks = list(iter_file_chunks(io.BytesIO(data), source, timings))
+    return chunks, timings
+
+def _embed_batch(chunks: list, ids: list) -> tuple:
+    start = time.perf_counter()
+    with get_metrics().span("ingest", "embed"):
+        vectors = get_embeddings().embed_documents([chunk.page_content for chunk in chunks])
+    return chunks, ids, vectors, time.perf_counter() - start
+
+def _stream_ingest(file, embed_pool, progress: dict, existing_ids: set, timings: dict, is_cancelled=None) -> list:
+    """Embed and insert a large file in bounded batches as its pages are parsed.
+
+    At most settings.embed_concurrency batches are in flight, so peak memory
+    depends on the batch size rather than on the size of the document.
+    Chunks whose id is already in existing_ids are not re-embedded.
+    Progress is published through the shared dict, since UI callbacks must
+    run on the caller's thread. Stage timings are accumulated into timings.
+    If is_cancelled(name) turns true, the chunks inserted so far are removed
+    and IngestCancelled is raised; any other error removes them too before
+    it propagates.
+    Returns [(chunk_id, chunk_hash)] for the file.
+    """
+    in_flight = deque()
+    assigned = []
+    inserted = []
+    occurrences = {}
+    done = 0
+
+    def check_cancelled():
+        if is_cancelled and is_cancelled(file.name):
+            for future in in_flight:
+                future.cancel()
+            delete_chunks(inserted, file.name)
+            raise IngestCancelled(file.name)
+
+    def drain_one():
+        nonlocal done
+        chunks, ids, vectors, seconds = in_flight.popleft().result()
+        timings["embed"] = timings.get("embed", 0.0) + seconds
+        start = time.perf_counter()
+        add_embedded_documents(chunks, vectors, ids=ids)
+        inserted.extend(ids)
+        timings["insert"] = timings.get("insert", 0.0) + time.perf_counter() - start
+        done += len(chunks)
+        progress[file.name] = done
+
+    file.seek(0)
+    batch, batch_ids = [], []
     try:
-        logger.info(f"Processing file: {file.name}")
-        timestamp = datetime.now().timestamp()
-        filename = f"{timestamp}_{secure_filename(file.name)}"
-        file_path = os.path.join(settings.temp_folder, filename)
-        
-        # Write file contents manually instead of using save()
-        with open(file_path, 'wb') as f:
-            f.write(file.read())
-
-        loader = PyPDFLoader(file_path) if filename.endswith('.pdf') else TextLoader(file_path)
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=settings.chunk_size,
-            chunk_overlap=settings.chunk_overlap
+        for chunk in iter_file_chunks(file, file.name, timings):
+            digest = chunk_hash(chunk)
+            occurrence = occurrences.get(digest, 0)
+            occurrences[digest] = occurrence + 1
+            cid = chunk_id(file.name, digest, occurrence)
+            assigned.append((cid, digest))
+            if cid in existing_ids:
+                continue
+            batch.append(chunk)
+            batch_ids.append(cid)
+            if len(batch) >= settings.embed_batch_size:
+                check_cancelled()
+                in_flight.append(embed_pool.submit(_embed_batch, batch, batch_ids))
+                batch, batch_ids = [], []
+                if len(in_flight) >= settings.embed_concurrency:
+                    drain_one()
+        check_cancelled()
+        if batch:
+            in_flight.append(embed_pool.submit(_embed_batch, batch, batch_ids))
+        while in_flight:
+            drain_one()
+    except IngestCancelled:
+        raise
+    except Exception:
+        # Chunks of a failed file would be searchable but missing from the registry
+        for future in in_flight:
+            future.cancel()
+        delete_chunks(inserted, file.name)
+        raise
+    return assigned
+
+def embed_files(files, progress_callback=None, is_cancelled=None) -> dict:
+    """Ingest several files through a staged pipeline and return {file name: success}.
+
+    Parsing and splitting run in a process pool, embedding requests are
+    batched and sent with bounded concurrency, and inserts are written to
+    Chroma in batches of settings.insert_batch_size. The stages overlap
+    across files, so total time approaches that of the slowest stage.
+    Files larger than settings.stream_threshold_mb skip the process pool and
+    are streamed page by page instead. Nothing is written to temp files.
+
+    The document registry makes ingestion incremental: files whose content
+    is already indexed (under any name) are skipped, and for changed files
+    only new chunks are embedded while chunks that disappeared are deleted.
+
+    progress_callback(name, stage, done, total) is called as each file moves
+    through "parsing", "embedding", then "done", "skipped", "failed" or
+    "cancelled". is_cancelled(name) is polled while files are in flight; a
+    cancelled file stops being processed and the chunks it had already
+    inserted are removed, while the other files carry on. A file that fails
+    has its chunks removed the same way, so everything in the store stays
+    in the registry.
+    """
+    def report(name, stage, done=0, total=0):
+        if progress_callback:
+            try:
+                progress_callback(name, stage, done, total)
+            except Exception as e:
+                logger.debug(f"Progress callback failed: {str(e)}")
+
+    results = {}
+    registry = get_document_registry()
+    metrics = get_metrics()
+    parse_pool, embed_pool, stream_pool = _get_pools()
+    pending = {}
+    file_hashes = {}
+    existing_ids = {}
+    assigned_ids = {}
+    remaining_batches = {}
+    embedded_chunks = {}
+    total_chunks = {}
+    insert_buffer = []
+    inserted_ids = {}
+    stream_progress = {}
+    reported_stream_progress = {}
+    file_timings = {}
+    started = {}
+
+    def flush():
+        if insert_buffer:
+            add_embedded_documents(
+                [doc for doc, _, _ in insert_buffer],
+                [vector for _, _, vector in insert_buffer],
+                ids=[cid for _, cid, _ in insert_buffer]
+            )
+            for doc, cid, _ in insert_buffer:
+                inserted_ids.setdefault(doc.metadata.get('source'), []).append(cid)
+            insert_buffer.clear()
+
+    def discard(name):
+        """Remove what a file that will not be registered has written or buffered so far"""
+        insert_buffer[:] = [item for item in insert_buffer if item[0].metadata.get('source') != name]
+        delete_chunks(inserted_ids.pop(name, []), name)
+
+    def fail(name, error):
+        logger.error(f"Embedding error for {name}: {error}")
+        results[name] = False
+        remaining_batches.pop(name, None)
+        discard(name)
+        metrics.increment("files_ingested", result="failed")
+        report(name, "failed")
+
+    def cancel(name):
+        logger.info(f"Cancelled ingestion of {name}")
+        results[name] = False
+        remaining_batches.pop(name, None)
+        for future, (stage, pending_name) in list(pending.items()):
+            if pending_name != name:
+                continue
+            # A stream that already started notices the cancellation itself and removes its chunks
+            if future.cancel() or stage != "stream":
+                del pending[future]
+        discard(name)
+        metrics.increment("files_ingested", result="cancelled")
+        report(name, "cancelled")
+
+    def finish(name):
+        flush()
+        current = {cid for cid, _ in assigned_ids[name]}
+        stale = [cid for cid in existing_ids[name] if cid not in current]
+        delete_chunks(stale, name)
+        registry.record(name, file_hashes[name], assigned_ids[name])
+        inserted_ids.pop(name, None)
+        results[name] = True
+        added = len(current - existing_ids[name])
+        logger.info(f"Indexed {name}: {len(assigned_ids[name])} chunks, {added} new, {len(stale)} removed")
+
+        # Embed and insert spans are observed as they run; parsing happened in a worker
+        timings = file_timings[name]
+        timings["total"] = time.perf_counter() - started[name]
+        for stage in ("load", "split", "total"):
+            if stage in timings:
+                metrics.observe("ingest", stage, timings[stage])
+        metrics.increment("files_ingested", result="done")
+        metrics.increment("chunks_embedded", added)
+        metrics.record_trace(
+            "ingest", timings, observe=False,
+            source=name, chunks=len(assigned_ids[name]), new=added, removed=len(stale)
         )
-        chunks = splitter.split_documents(loader.load())
-        logger.debug(f"Split into {len(chunks)} chunks")
+        report(name, "done", len(assigned_ids[name]), len(assigned_ids[name]))
+
+    try:
+        batch_hashes = {}
+        for file in files:
+            if not file or not file.name.lower().endswith(SUPPORTED_EXTENSIONS):
+                logger.warning(f"Invalid file type: {file.name if file else 'No file'}")
+                if file:
+                    results[file.name] = False
+                continue
+
+            file_hash = hash_file(file)
+            registered = registry.get_document(file.name)
+            if registered and registered["file_hash"] == file_hash:
+                logger.info(f"Skipping unchanged file: {file.name}")
+                results[file.name] = True
+                metrics.increment("files_ingested", result="skipped")
+                report(file.name, "skipped")
+                continue
+            duplicate_of = registry.find_by_hash(file_hash) or batch_hashes.get(file_hash)
+            if duplicate_of and duplicate_of != file.name:
+                logger.info(f"Skipping {file.name}: same content as {duplicate_of}")
+                results[file.name] = True
+                metrics.increment("files_ingested", result="skipped")
+                report(file.name, "skipped")
+                continue
+            batch_hashes[file_hash] = file.name
+            file_hashes[file.name] = file_hash
+            existing_ids[file.name] = registry.chunk_ids(file.name)
 
-        if chunks:
-            logger.info(f"Adding {len(chunks)} chunks to vector store")
-            get_vector_db().add_documents(chunks)
-            return True
+            logger.info(f"Processing file: {file.name}")
+            started[file.name] = time.perf_counter()
+            file_timings[file.name] = {}
+            if _file_size(file) > settings.stream_threshold_mb * 1024 * 1024:
+                future = stream_pool.submit(
+                    _stream_ingest, file, embed_pool, stream_progress, existing_ids[file.name], file_timings[file.name],
+                    is_cancelled
+                )
+                pending[future] = ("stream", file.name)
+            else:
+                pending[parse_pool.submit(_load_and_split, file.read(), file.name)] = ("parse", file.name)
+            report(file.name, "parsing")
+
+        while pending:
+            if is_cancelled:
+                for name in {name for _, name in pending.values()}:
+                    if name not in results and is_cancelled(name):
+                        cancel(name)
+                if not pending:
+                    break
+            finished, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            for name, done in list(stream_progress.items()):
+                if reported_stream_progress.get(name) != done:
+                    reported_stream_progress[name] = done
+                    report(name, "embedding", done, 0)
+            for future in finished:
+                stage, name = pending.pop(future)
+                if name in results:
+                    continue  # File already failed in another batch
+
+                try:
+                    result = future.result()
+                except IngestCancelled:
+                    cancel(name)
+                    continue
+                except Exception as e:
+                    fail(name, str(e))
+                    continue
+
+                if stage == "stream":
+                    if not result:
+                        fail(name, "no text could be extracted")
+                        continue
+                    assigned_ids[name] = result
+                    finish(name)
+                    continue
+
+                if stage == "parse":
+                    chunks, timings = result
+                    file_timings[name].update(timings)
+                    logger.debug(f"Split {name} into {len(chunks)} chunks")
+                    if not chunks:
+                        fail(name, "no text could be extracted")
+                        continue
+                    assigned_ids[name] = assign_chunk_ids(name, chunks)
+                    new_chunks = [
+                        (chunk, cid) for chunk, (cid, _) in zip(chunks, assigned_ids[name])
+                        if cid not in existing_ids[name]
+                    ]
+                    if not new_chunks:
+                        finish(name)
+                        continue
+                    total_chunks[name] = len(new_chunks)
+                    embedded_chunks[name] = 0
+                    batches = [
+                        new_chunks[i:i + settings.embed_batch_size]
+                        for i in range(0, len(new_chunks), settings.embed_batch_size)
+                    ]
+                    remaining_batches[name] = len(batches)
+                    for batch in batches:
+                        future = embed_pool.submit(
+                            _embed_batch, [chunk for chunk, _ in batch], [cid for _, cid in batch]
+                        )
+                        pending[future] = ("embed", name)
+                    report(name, "embedding", 0, total_chunks[name])
+                    continue
+
+                chunks, ids, vectors, seconds = result
+                file_timings[name]["embed"] = file_timings[name].get("embed", 0.0) + seconds
+                insert_buffer.extend(zip(chunks, ids, vectors))
+                if len(insert_buffer) >= settings.insert_batch_size:
+                    flush()
+                embedded_chunks[name] += len(chunks)
+                remaining_batches[name] -= 1
+                report(name, "embedding", embedded_chunks[name], total_chunks[name])
+                if remaining_batches[name] == 0:
+                    finish(name)
+
+        flush()
+        save_indexes()
+        if hasattr(get_embeddings(), 'stats'):
+            logger.info(f"Embedding cache: {get_embeddings().stats()}")
 
     except Exception as e:
+        invalidate_stats()
         logger.error(f"Embedding error: {str(e)}")
-        return False
-    
-    finally:
-        if 'file_path' in locals() and os.path.exists(file_path):
-            os.remove(file_path)
-            logger.debug(f"Cleaned up temp file: {file_path}")
+        for future in pending:
+            future.cancel()
+        for file in files:
+            if file and file.name not in results:
+                results[file.name] = False
+                try:
+                    discard(file.name)
+                except Exception as cleanup_error:
+                    logger.error(f"Could not remove chunks of {file.name}: {str(cleanup_error)}")
+
+    return results
 
-    return False
\ No newline at end of file
+def embed(file):
+    if not file:
+        logger.warning("Invalid file type: No file")
+        return False
+    return embed_files([file]).get(file.name, False)
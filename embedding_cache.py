@@ -0,0 +1,142 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+from langchain_core.embeddings import Embeddings
+from metrics import get_metrics
+from logger_config import setup_logger
+
+logger = setup_logger('embedding_cache')
+
+# SQLite caps the number of bound parameters per statement
+SQL_BATCH_SIZE = 500
+# Cache hits only note when a row was last used; the notes are written in
+# one transaction once this many are pending or this many seconds passed
+TOUCH_BATCH_SIZE = 256
+TOUCH_INTERVAL = 60
+
+class CachedEmbeddings(Embeddings):
+    """Content-addressed, persistent cache in front of an embedding client.
+
+    Vectors are stored in SQLite keyed by sha256(model, text), so the same
+    chunk is only ever embedded once per model, across sessions and users.
+    The cache is bounded to max_entries and evicts least recently used rows;
+    last-used times of hits are written in batches, so a lookup is read-only.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, path: str, max_entries: int):
+        self.embeddings = embeddings
+        self.model = model
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._touched = {}
+        self._touch_flushed = time.monotonic()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logger.info(f"Embedding cache opened at {path} with {self._size} entries")
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: list) -> dict:
+        found = {}
+        for i in range(0, len(keys), SQL_BATCH_SIZE):
+            batch = keys[i:i + SQL_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            for key, blob in rows:
+                vector = array('f')
+                vector.frombytes(blob)
+                found[key] = vector.tolist()
+        now = time.time()
+        self._touched.update((key, now) for key in found)
+        if len(self._touched) >= TOUCH_BATCH_SIZE or time.monotonic() - self._touch_flushed >= TOUCH_INTERVAL:
+            self._flush_touches()
+            self._conn.commit()
+        return found
+
+    def _flush_touches(self):
+        """Write pending last-used times; the caller commits"""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()]
+            )
+            self._touched = {}
+        self._touch_flushed = time.monotonic()
+
+    def _store(self, items: dict):
+        self._flush_touches()  # So eviction sees recent hits
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, array('f', vector).tobytes(), now) for key, vector in items.items()]
+        )
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = self._size - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (overflow,)
+            )
+            self._size -= overflow
+            self.evictions += overflow
+            logger.debug(f"Evicted {overflow} cached embeddings")
+        logger.debug(f"Cached {len(items)} new embeddings")
+
+    def embed_documents(self, texts: list) -> list:
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            cached = self._lookup(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        misses = sum(1 for key in keys if key not in cached)
+        self.hits += len(keys) - misses
+        self.misses += misses
+        metrics = get_metrics()
+        metrics.increment("embedding_cache_lookups", len(keys) - misses, result="hit")
+        metrics.increment("embedding_cache_lookups", misses, result="miss")
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            with self._lock:
+                self._store(computed)
+                self._conn.commit()
+            cached.update(computed)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
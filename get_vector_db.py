@@ -1,113 +1,650 @@
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
-from langchain_ollama import OllamaEmbeddings
-from langchain_chroma import Chroma
 from config import settings
+from collection_state import CollectionState
+from lexical_index import BM25Index, reciprocal_rank_fusion, tokenize
+from vector_store import open_vector_store, list_collections, vector_distances as _vector_distances
+from document_registry import get_document_registry, chunk_hash
+from metrics import get_metrics
 from logger_config import setup_logger
-import os
+import re
+import threading
+import time
+import uuid
+import numpy as np
 
 logger = setup_logger('vector_db')
-os.makedirs(settings.logs_path, exist_ok=True)
 
 _vector_store = None
 _archive_store = None
+_project_stores = {}
+_project_lock = threading.Lock()
+_search_pool = None
+_embeddings = None
+_lexical_index = None
+_stats = None
+_collection_version = 0
+_stats_lock = threading.Lock()
+_collection_state = None
+_state_lock = threading.Lock()
+STATS_PAGE_SIZE = 1000
+
+# Chroma's rule for collection names, which also keeps snapshot file names safe
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{1,61}[A-Za-z0-9]$")
+
+def get_embeddings():
+    """Shared embedding client used for both ingestion and queries"""
+    global _embeddings
+    if (_embeddings is None):
+        # Imported here so that importing this module stays cheap (see warmup.py)
+        from langchain_ollama import OllamaEmbeddings
+        from embedding_cache import CachedEmbeddings
+        _embeddings = OllamaEmbeddings(model=settings.text_embedding_model, base_url=settings.ollama_base_url)
+        if settings.embedding_cache_enabled:
+            _embeddings = CachedEmbeddings(
+                _embeddings,
+                model=settings.text_embedding_model,
+                path=settings.embedding_cache_path,
+                max_entries=settings.embedding_cache_max_entries
+            )
+    return _embeddings
 
 def get_vector_db():
+    """The current collection, in the engine chosen by settings.vector_store"""
     global _vector_store
     if (_vector_store is None):
-        logger.info("Initializing vector database")
-        Path(settings.chroma_path).mkdir(parents=True, exist_ok=True)
-        _vector_store = Chroma(
-            collection_name=settings.collection_name,
-            persist_directory=settings.chroma_path,
-            embedding_function=OllamaEmbeddings(model=settings.text_embedding_model)
-        )
+        logger.info(f"Initializing vector database ({settings.vector_store})")
+        _vector_store = open_vector_store(settings.chroma_path, settings.collection_name)
     return _vector_store
 
-def has_documents():
+def get_vector_space() -> str:
+    """Distance function of the current collection: 'l2', 'cosine' or 'ip'"""
+    return get_vector_db().space
+
+def get_lexical_index():
+    """BM25 index over chunk text, persisted next to the Chroma data.
+
+    Rebuilt from the collection when it is missing or out of sync, e.g. for
+    stores created before hybrid search existed. Changes made by other
+    processes are replayed from its journal (see sync_with_other_processes).
+    """
+    global _lexical_index
+    if (_lexical_index is None):
+        index = BM25Index(Path(settings.chroma_path) / "bm25_index.pkl")
+        loaded = index.load()
+        count = get_collection_stats()["count"]
+        if not loaded or len(index) != count:
+            logger.info(f"Rebuilding lexical index for {count} chunks")
+            index.rebuild(
+                (page['ids'], page['documents'])
+                for page in get_vector_db().export(include_embeddings=False, page_size=STATS_PAGE_SIZE)
+            )
+        _lexical_index = index
+    return _lexical_index
+
+def save_indexes():
+    """Persist the in-process indexes kept next to the collection, and the store itself if it is in memory.
+
+    Other processes using the same collections are then told to reload them.
+    """
+    if _vector_store is not None:
+        _vector_store.persist()
+    if settings.hybrid_search and _lexical_index is not None:
+        _lexical_index.save()
+    _publish_change()
+
+def _get_collection_state():
+    global _collection_state
+    with _state_lock:
+        if _collection_state is None:
+            _collection_state = CollectionState(Path(settings.chroma_path) / "collection_state.sqlite3")
+    return _collection_state
+
+def _drop_cached_state():
+    """Forget the stats and in-memory stores, and catch the lexical index up, so they are read again from disk"""
+    global _stats, _collection_version, _vector_store, _archive_store
+    with _stats_lock:
+        _collection_version += 1
+        _stats = None
+    if _lexical_index is not None:
+        _lexical_index.sync()  # Replays only what the other process journaled
+    # The numpy store is a snapshot loaded once, and a Chroma handle goes stale when its collection is dropped
+    with _project_lock:
+        _vector_store = None
+        _archive_store = None
+        _project_stores.clear()
+
+def _publish_change():
     try:
-        count = len(get_vector_db().get().get('ids', []))
+        if _get_collection_state().publish():
+            _drop_cached_state()
+    except Exception as e:
+        logger.error(f"Could not publish collection change: {str(e)}")
+
+def sync_with_other_processes():
+    """Reload cached collection state when another process changed the collections since the last call"""
+    try:
+        if _get_collection_state().changed():
+            logger.info("Collections changed in another process; reloading cached stats and indexes")
+            _drop_cached_state()
+    except Exception as e:
+        logger.error(f"Could not check for collection changes: {str(e)}")
+
+def _count_sources(store) -> dict:
+    """Page through chunks without their vectors to count chunks per source"""
+    counts = {}
+    for page in store.export(include_embeddings=False, page_size=STATS_PAGE_SIZE):
+        for metadata in page['metadatas']:
+            source = (metadata or {}).get('source', 'unknown')
+            counts[source] = counts.get(source, 0) + 1
+    return counts
+
+def get_collection_stats(include_sources: bool = False) -> dict:
+    """Cached collection stats: chunk count, per-source counts and last-modified time.
+
+    The count comes from the store's O(1) count() on first use and is then kept
+    up to date in-process by record_documents_added() and the clear/archive
+    paths, and read again after another process changed the collections
+    (see sync_with_other_processes). Per-source counts need a metadata scan,
+    so they are only built when asked for and then maintained incrementally
+    as well.
+    """
+    global _stats
+    sync_with_other_processes()
+    with _stats_lock:
+        if _stats is None:
+            _stats = {
+                "count": get_vector_db().count(),
+                "sources": None,
+                "last_modified": get_vector_db().last_modified(),
+            }
+        if include_sources and _stats["sources"] is None:
+            _stats["sources"] = _count_sources(get_vector_db()) if _stats["count"] else {}
+        stats = dict(_stats)
+        stats["sources"] = dict(_stats["sources"]) if _stats["sources"] is not None else None
+        return stats
+
+def get_collection_version() -> int:
+    """Counter bumped on every add, clear or archive, here or in another process; used to invalidate derived caches"""
+    sync_with_other_processes()
+    return _collection_version
+
+def record_documents_added(documents: list):
+    """Update the cached stats after documents were written to the store"""
+    global _collection_version
+    with _stats_lock:
+        _collection_version += 1
+        if _stats is None:
+            return
+        _stats["count"] += len(documents)
+        if _stats["sources"] is not None:
+            for doc in documents:
+                source = doc.metadata.get('source', 'unknown')
+                _stats["sources"][source] = _stats["sources"].get(source, 0) + 1
+        _stats["last_modified"] = time.time()
+
+def _record_documents_removed(count: int, source: str):
+    global _collection_version
+    with _stats_lock:
+        _collection_version += 1
+        if _stats is None:
+            return
+        _stats["count"] = max(_stats["count"] - count, 0)
+        if _stats["sources"] is not None and source in _stats["sources"]:
+            _stats["sources"][source] -= count
+            if _stats["sources"][source] <= 0:
+                del _stats["sources"][source]
+        _stats["last_modified"] = time.time()
+
+def add_embedded_documents(documents: list, embeddings: list, ids: list = None) -> list:
+    """Insert documents whose embeddings were already computed and return their ids"""
+    ids = ids or [str(uuid.uuid4()) for _ in documents]
+    # Load the lexical index (and with it the cached count) before the collection changes
+    lexical_index = get_lexical_index() if settings.hybrid_search else None
+    store = get_vector_db()
+    metrics = get_metrics()
+    with metrics.span("ingest", "insert"):
+        for i in range(0, len(documents), settings.insert_batch_size):
+            store.add(
+                ids[i:i + settings.insert_batch_size],
+                embeddings[i:i + settings.insert_batch_size],
+                [doc.page_content for doc in documents[i:i + settings.insert_batch_size]],
+                [doc.metadata for doc in documents[i:i + settings.insert_batch_size]]
+            )
+    if lexical_index is not None:
+        with metrics.span("ingest", "lexical_index"):
+            lexical_index.add(ids, [doc.page_content for doc in documents])
+    record_documents_added(documents)
+    metrics.increment("chunks_indexed", len(documents))
+    return ids
+
+def _remove_from_derived_indexes(ids: list, source: str = None):
+    if settings.hybrid_search:
+        get_lexical_index().remove(ids)
+    _record_documents_removed(len(ids), source)
+    get_metrics().increment("chunks_removed", len(ids))
+
+def _load_derived_indexes():
+    """Load the derived indexes (and with them the cached count) before the collection changes"""
+    if settings.hybrid_search:
+        get_lexical_index()
+
+def delete_chunks(ids: list, source: str = None):
+    """Delete chunks by id from the collection and the derived indexes"""
+    if not ids:
+        return
+    _load_derived_indexes()
+    get_vector_db().delete(ids)
+    _remove_from_derived_indexes(ids, source)
+
+def delete_document(source: str) -> bool:
+    """Remove one document using the chunk ids in the registry.
+
+    Documents the registry does not know, e.g. ones ingested before it
+    existed, are deleted by their 'source' metadata instead.
+    """
+    try:
+        ids = get_document_registry().delete_document(source)
+        if ids:
+            delete_chunks(ids, source)
+        else:
+            _load_derived_indexes()
+            ids = get_vector_db().delete_source(source)
+            if ids:
+                _remove_from_derived_indexes(ids, source)
+        save_indexes()
+        logger.info(f"Deleted {len(ids)} chunks of {source}")
+        return True
+    except Exception as e:
+        invalidate_stats()
+        logger.error(f"Delete document failed: {str(e)}")
+        return False
+
+def _reset_stats():
+    global _stats, _collection_version
+    with _stats_lock:
+        _collection_version += 1
+        _stats = {"count": 0, "sources": {}, "last_modified": time.time()}
+
+def invalidate_stats():
+    """Drop the cached stats so the next call re-reads them from the store"""
+    global _stats, _collection_version
+    with _stats_lock:
+        _collection_version += 1
+        _stats = None
+    _publish_change()  # The store may have changed before the failure
+
+def has_documents(collections: list = None):
+    """Whether the current collection, or any of the given collections, has chunks"""
+    try:
+        count = get_collection_stats()["count"]
         logger.debug(f"Vector store document count: {count}")
+        for name in collections or []:
+            if count:
+                break
+            if name != settings.collection_name:
+                count = get_collection_store(name).count()
         return count > 0
     except Exception as e:
         logger.error(f"Document check failed: {str(e)}")
         return False
 
-def archive_current_documents():
-    """Archive current documents before clearing"""
+def get_archive_db():
+    global _archive_store
+    with _project_lock:  # Also opened from the collection search threads
+        if (_archive_store is None):
+            _archive_store = open_vector_store(settings.archive_chroma_path, settings.archive_collection_name)
+    return _archive_store
+
+def get_collections() -> list:
+    """Names of the collections that can be searched: current, archive, then per-project ones"""
+    projects = [
+        name for name in set(list_collections(settings.chroma_path)) | set(_project_stores)
+        if name not in (settings.collection_name, settings.archive_collection_name)
+    ]
+    return [settings.collection_name, settings.archive_collection_name] + sorted(projects)
+
+def get_collection_store(name: str, create: bool = False):
+    """Store of a collection by name. Per-project collections live next to the current one"""
+    if name == settings.collection_name:
+        return get_vector_db()
+    if name == settings.archive_collection_name:
+        return get_archive_db()
+    with _project_lock:
+        if name not in _project_stores:
+            if not COLLECTION_NAME_PATTERN.match(name):
+                raise ValueError(f"Invalid collection name: {name} (3-63 letters, digits, '.', '_' or '-')")
+            if not create and name not in list_collections(settings.chroma_path):
+                raise ValueError(f"Unknown collection: {name}")
+            _project_stores[name] = open_vector_store(settings.chroma_path, name)
+        return _project_stores[name]
+
+def archive_current_documents(progress_callback=None, collection: str = None):
+    """Move current documents into the archive (or a per-project collection), then clear them.
+
+    Chunks are moved a page at a time together with their stored embeddings,
+    so nothing is re-embedded and memory stays bounded by the batch size.
+    Each page is upserted into the archive before it is deleted from the
+    current collection, which makes the operation resumable: after a crash
+    the next call simply continues with whatever is left.
+    """
     try:
+        collection = collection or settings.archive_collection_name
+        if collection == settings.collection_name:
+            raise ValueError("Cannot archive the current collection into itself")
+        if not COLLECTION_NAME_PATTERN.match(collection):
+            raise ValueError(f"Invalid collection name: {collection}")
         if not has_documents():
             return True
-            
-        logger.info("Archiving current documents")
-        current_db = get_vector_db()
-        
-        global _archive_store
-        if (_archive_store is None):
-            _archive_store = Chroma(
-                collection_name=settings.archive_collection_name,
-                persist_directory=settings.archive_chroma_path,
-                embedding_function=OllamaEmbeddings(model=settings.text_embedding_model)
-            )
-        
-        # Transfer documents to archive
-        current_data = current_db.get()
-        if current_data.get('documents'):
-            _archive_store.add_texts(
-                texts=current_data['documents'],
-                metadatas=current_data.get('metadatas', []),
-                ids=current_data.get('ids', [])
-            )
-            logger.info(f"Archived {len(current_data['documents'])} documents")
-            
-        # Clear current DB
-        current_db._collection.delete(current_data.get('ids', []))
-        logger.info("Cleared current documents")
+
+        logger.info(f"Archiving current documents into {collection}")
+        current = get_vector_db()
+        archive = get_collection_store(collection, create=True)
+        total = current.count()
+        moved = 0
+
+        while True:
+            # Always the first page: the previous one has been deleted
+            page = next(current.export(page_size=settings.archive_batch_size), None)
+            if page is None:
+                break
+            archive.import_pages([page])
+            current.delete(page['ids'])
+            moved += len(page['ids'])
+            logger.debug(f"Archived {moved}/{total} chunks")
+            if progress_callback:
+                progress_callback(moved, total)
+
+        archive.persist()
+        current.persist()
+        logger.info(f"Archived {moved} chunks into {collection}")
+        _reset_stats()
+        _clear_derived_indexes()
+        get_document_registry().clear()
+        _publish_change()
         return True
         
     except Exception as e:
+        invalidate_stats()
         logger.error(f"Archive failed: {str(e)}")
         return False
 
+def restore_collection(name: str = None, sources: list = None, progress_callback=None) -> int:
+    """Copy archived chunks back into the current collection and return how many were copied.
+
+    Vectors are copied as stored, so nothing is re-embedded. Documents that
+    are already in the current collection are skipped. Restored documents
+    are recorded in the registry, so they can be deleted as usual, and a
+    later upload of the same file only embeds the chunks that changed.
+    The archive itself is left as it is.
+    """
+    from langchain_core.documents import Document
+    name = name or settings.archive_collection_name
+    if name == settings.collection_name:
+        return 0
+    archive = get_collection_store(name)
+    registry = get_document_registry()
+    present = set(registry.sources())
+    wanted = set(sources) if sources else None
+    total = archive.count()
+    seen, copied = 0, 0
+    restored = {}
+    logger.info(f"Restoring documents from {name}")
+    for page in archive.export(page_size=settings.archive_batch_size):
+        keep = []
+        for i, metadata in enumerate(page['metadatas']):
+            source = (metadata or {}).get('source', 'unknown')
+            if source not in present and (wanted is None or source in wanted) and page['documents'][i]:
+                keep.append(i)
+        if keep:
+            documents = [Document(page_content=page['documents'][i], metadata=page['metadatas'][i] or {}) for i in keep]
+            ids = [page['ids'][i] for i in keep]
+            add_embedded_documents(documents, [page['embeddings'][i] for i in keep], ids=ids)
+            for doc, chunk_id in zip(documents, ids):
+                restored.setdefault(doc.metadata.get('source', 'unknown'), []).append((chunk_id, chunk_hash(doc)))
+            copied += len(keep)
+        seen += len(page['ids'])
+        if progress_callback:
+            progress_callback(seen, total)
+    for source, chunks in restored.items():
+        registry.record(source, f"restored:{name}", chunks)
+    save_indexes()
+    logger.info(f"Restored {copied} chunks of {len(restored)} documents from {name}")
+    return copied
+
+def _clear_derived_indexes():
+    # Clearing through the journal also empties the index of other processes
+    (_lexical_index or BM25Index(Path(settings.chroma_path) / "bm25_index.pkl")).clear()
+
 def clear_documents():
-    """Clear all documents from the current vector store"""
+    """Clear all documents from the current vector store by dropping the collection"""
     try:
         if not has_documents():
             return True
             
         logger.info("Clearing current documents")
-        current_db = get_vector_db()
-        current_data = current_db.get()
-        
-        # Clear current DB
-        if current_data.get('ids'):
-            current_db._collection.delete(current_data.get('ids', []))
-            logger.info("Cleared current documents")
+        get_vector_db().drop()
+        _reset_stats()
+        _clear_derived_indexes()
+        get_document_registry().clear()
+        _publish_change()
+        logger.info("Cleared current documents")
         return True
         
     except Exception as e:
+        invalidate_stats()
         logger.error(f"Clear documents failed: {str(e)}")
         return False
 
-def get_relevant_sources(query: str, k: int = 4) -> list:
-    """Get relevant source documents for a query"""
+def distance_to_similarity(distance: float, space: str = None) -> float:
+    """Map a Chroma distance to a similarity in [-1, 1].
+
+    Ollama returns unit length embeddings, so in the squared L2 space
+    distance = 2 - 2 * cosine, and in the cosine and inner product spaces
+    distance = 1 - cosine.
+    """
+    space = space or get_vector_space()
+    if space == "l2":
+        return 1.0 - float(distance) / 2.0
+    return 1.0 - float(distance)
+
+def vector_distances(query: list, vectors, space: str = None) -> np.ndarray:
+    """Exact Chroma-style distances from query to each row of vectors"""
+    return _vector_distances(query, vectors, space or get_vector_space())
+
+def search_by_vectors(embeddings: list, k: int = 4) -> list:
+    """search_by_vector() for several queries at once, as one vectorized search"""
     try:
-        if not has_documents():
-            return []
-            
-        # Get documents with scores
-        docs_and_scores = get_vector_db().similarity_search_with_score(query, k=k)
-        
-        # Filter out empty sources and include scores
-        sources = []
-        for doc, score in docs_and_scores:
-            if doc.page_content.strip():
-                sources.append({
-                    "content": doc.page_content,
-                    "metadata": doc.metadata,
-                    "similarity_score": float(score)  # Convert to float for JSON serialization
-                })
-        
-        return sources
+        # Filter out empty sources
+        return [
+            [source for source in hits if source["content"] and source["content"].strip()]
+            for hits in get_vector_db().search_many(embeddings, k)
+        ]
     except Exception as e:
         logger.error(f"Error getting sources: {str(e)}")
-        return []
\ No newline at end of file
+        return [[] for _ in embeddings]
+
+def search_by_vector(embedding: list, k: int = 4) -> list:
+    """Get relevant source documents for an already embedded query"""
+    return search_by_vectors([embedding], k)[0]
+
+def _fuse(query: str, vector_hits: list, lexical_hits: list, k: int) -> list:
+    """Top k of the vector and BM25 hits of one query by reciprocal-rank fusion"""
+    fused = reciprocal_rank_fusion(
+        [[source["id"] for source in vector_hits], [chunk_id for chunk_id, _, _ in lexical_hits]],
+        [settings.hybrid_vector_weight, settings.hybrid_lexical_weight],
+        k=settings.rrf_k
+    )
+    top_ids = sorted(fused, key=fused.get, reverse=True)[:k]
+
+    by_id = {source["id"]: source for source in vector_hits}
+    missing = [chunk_id for chunk_id in top_ids if chunk_id not in by_id]
+    if missing:
+        page = get_vector_db().get(missing)
+        for chunk_id, content, metadata in zip(page['ids'], page['documents'], page['metadatas']):
+            by_id[chunk_id] = {"id": chunk_id, "content": content, "metadata": metadata or {}}
+    lexical = {chunk_id: (score, coverage) for chunk_id, score, coverage in lexical_hits}
+
+    sources = []
+    for chunk_id in top_ids:
+        source = by_id.get(chunk_id)
+        if not source or not (source["content"] or "").strip():
+            continue
+        source = dict(source, fusion_score=fused[chunk_id])
+        if chunk_id in lexical:
+            source["lexical_score"], source["lexical_coverage"] = lexical[chunk_id]
+        sources.append(source)
+    return sources
+
+def search(query: str, embedding: list, k: int = 4) -> list:
+    """Hybrid search: vector and BM25 results fused with reciprocal-rank fusion.
+
+    Each retriever contributes its top settings.hybrid_candidates hits. Fused
+    results carry 'fusion_score'; hits found by the lexical index also carry
+    'lexical_score' and 'lexical_coverage' (share of query terms matched).
+    """
+    if not settings.hybrid_search:
+        return search_by_vector(embedding, k=k)
+    try:
+        candidates = max(k, settings.hybrid_candidates)
+        metrics = get_metrics()
+        with metrics.span("query", "vector_search"):
+            vector_hits = search_by_vector(embedding, k=candidates)
+        with metrics.span("query", "lexical_search"):
+            lexical_hits = get_lexical_index().search(query, candidates)
+        return _fuse(query, vector_hits, lexical_hits, k)
+    except Exception as e:
+        logger.error(f"Hybrid search failed, using vector search only: {str(e)}")
+        return search_by_vector(embedding, k=k)
+
+def search_many(queries: list, embeddings: list, k: int = 4, collections: list = None) -> list:
+    """search_collections() for several embedded queries, one result list per query.
+
+    On the current collection alone the vector search runs once for all
+    queries (one Chroma query, or one scan of the numpy or quantized
+    store); BM25 and fusion are still per query. Other
+    collections are searched query by query.
+    """
+    collections = list(dict.fromkeys(collections or [settings.collection_name]))
+    if collections != [settings.collection_name]:
+        return [search_collections(query, embedding, k, collections) for query, embedding in zip(queries, embeddings)]
+    if not settings.hybrid_search:
+        return search_by_vectors(embeddings, k=k)
+    try:
+        candidates = max(k, settings.hybrid_candidates)
+        vector_hits = search_by_vectors(embeddings, k=candidates)
+        lexical_index = get_lexical_index()
+        return [
+            _fuse(query, hits, lexical_index.search(query, candidates), k)
+            for query, hits in zip(queries, vector_hits)
+        ]
+    except Exception as e:
+        logger.error(f"Hybrid search failed, using vector search only: {str(e)}")
+        return search_by_vectors(embeddings, k=k)
+
+def _get_search_pool():
+    global _search_pool
+    if _search_pool is None:
+        _search_pool = ThreadPoolExecutor(max_workers=settings.collection_search_workers, thread_name_prefix="search")
+    return _search_pool
+
+def _prepare_collections(collections: list) -> list:
+    """Open the stores and load (or rebuild) the lexical index; returns the collections that could be opened"""
+    ready = []
+    for name in collections:
+        try:
+            if name == settings.collection_name:
+                get_collection_stats()
+                _load_derived_indexes()
+            else:
+                get_collection_store(name)
+            ready.append(name)
+        except Exception as e:
+            logger.error(f"Could not open collection {name}: {str(e)}")
+    return ready
+
+def _collection_hits(name: str, query: str, embedding: list, k: int) -> list:
+    """Top k hits of one collection, each with its 'collection' and a 'normalized_score' similarity.
+
+    The current collection is searched as usual (hybrid when enabled);
+    hits found only lexically get their similarity from the stored vectors.
+    """
+    if name == settings.collection_name:
+        store = get_vector_db()
+        hits = search(query, embedding, k=k) if store.count() else []
+    else:
+        store = get_collection_store(name)
+        hits = [hit for hit in store.search(embedding, k) if hit["content"] and hit["content"].strip()]
+    distances = {}
+    missing = [hit["id"] for hit in hits if "similarity_score" not in hit]
+    if missing:
+        page = store.get(missing, include_embeddings=True)
+        if page['ids']:
+            distances = dict(zip(page['ids'], vector_distances(embedding, page['embeddings'], store.space)))
+    for hit in hits:
+        distance = hit.get("similarity_score", distances.get(hit["id"]))
+        hit["collection"] = name
+        hit["normalized_score"] = distance_to_similarity(distance, store.space) if distance is not None else -1.0
+    return hits
+
+def search_collections(query: str, embedding: list, k: int = 4, collections: list = None) -> list:
+    """Search several collections at once and merge their hits.
+
+    Each collection is searched in a thread pool and gets at most
+    settings.collection_search_timeout seconds; slower ones are left out of
+    the result. Stores are opened and the lexical index loaded beforehand,
+    so a first search or an index rebuild does not use up that time.
+    Scores are made comparable by converting each collection's distances
+    (which depend on its space) to a similarity, the field
+    'normalized_score', keeping the best copy of a chunk found in several
+    collections. With hybrid search on, the merged candidates are re-ranked
+    by fusing that similarity with the share of query terms each one
+    contains, so archived collections (which have no BM25 index) are ranked
+    the same way as the current one.
+    """
+    collections = list(dict.fromkeys(collections or [settings.collection_name]))
+    if collections == [settings.collection_name]:
+        return search(query, embedding, k=k)
+
+    candidates = max(k, settings.hybrid_candidates) if settings.hybrid_search else k
+    futures = {
+        _get_search_pool().submit(_collection_hits, name, query, embedding, candidates): name
+        for name in _prepare_collections(collections)
+    }
+    done, not_done = wait(futures, timeout=settings.collection_search_timeout)
+    metrics = get_metrics()
+    for future in not_done:
+        future.cancel()
+        logger.warning(f"Search of collection {futures[future]} timed out")
+        metrics.increment("collection_search_timeouts", collection=futures[future])
+
+    merged = {}
+    for future in done:
+        try:
+            hits = future.result()
+        except Exception as e:
+            logger.error(f"Search of collection {futures[future]} failed: {str(e)}")
+            continue
+        for hit in hits:
+            kept = merged.get(hit["id"])
+            if kept is None or hit["normalized_score"] > kept["normalized_score"]:
+                merged[hit["id"]] = hit
+    by_similarity = sorted(merged.values(), key=lambda hit: hit["normalized_score"], reverse=True)
+    if not settings.hybrid_search:
+        return by_similarity[:k]
+
+    terms = set(tokenize(query))
+    for hit in by_similarity:
+        if "lexical_coverage" not in hit:
+            hit["lexical_coverage"] = len(terms & set(tokenize(hit["content"]))) / len(terms) if terms else 0.0
+    by_coverage = sorted(
+        (hit for hit in by_similarity if hit["lexical_coverage"] > 0), key=lambda hit: hit["lexical_coverage"], reverse=True
+    )
+    fused = reciprocal_rank_fusion(
+        [[hit["id"] for hit in by_similarity], [hit["id"] for hit in by_coverage]],
+        [settings.hybrid_vector_weight, settings.hybrid_lexical_weight],
+        k=settings.rrf_k
+    )
+    for hit in by_similarity:
+        hit["fusion_score"] = fused[hit["id"]]
+    return sorted(by_similarity, key=lambda hit: hit["fusion_score"], reverse=True)[:k]
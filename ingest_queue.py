@@ -0,0 +1,333 @@
+import io
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from document_registry import hash_file
+from metrics import get_metrics
+from logger_config import setup_logger
+from config import settings
+
+logger = setup_logger('ingest_queue')
+
+ACTIVE_STATUSES = ("queued", "running")
+JOB_RETENTION_SECONDS = 7 * 24 * 3600  # finished jobs older than this are purged at start-up
+IDLE_WAIT_SECONDS = 1.0  # how often an idle worker looks for due retries
+
+class SpooledUpload(io.BufferedReader):
+    """A spooled upload opened for ingestion, named after the original file"""
+
+    def __init__(self, path, source: str):
+        super().__init__(io.FileIO(path, "rb"))
+        self._source = source
+
+    @property
+    def name(self):
+        return self._source
+
+class IngestQueue:
+    """Persistent queue of ingestion jobs, worked off by a background thread.
+
+    submit() copies the upload to a spool directory and records a job in
+    SQLite, so the caller returns at once and a refresh or restart loses
+    nothing: jobs that were running when the process stopped are queued
+    again on start-up. Re-running a job is idempotent, since chunk ids are
+    deterministic and writes are upserts. Up to settings.ingest_batch_files
+    queued jobs are ingested together through embed_files(), whose progress
+    is written back to each job. Failed jobs are retried with a doubling
+    delay up to settings.ingest_max_attempts; cancel() stops a job and
+    removes the chunks it had already written.
+
+    The worker is a thread rather than a separate process because the
+    vector store is not safe to write from several processes (and the
+    numpy store lives in this one); parsing still runs in embed's process
+    pool, and queries keep being served from the chunks already indexed.
+    """
+
+    def __init__(self, db_path, spool_path):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.spool_path = Path(spool_path)
+        self.spool_path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                path TEXT NOT NULL,
+                file_hash TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                done INTEGER NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, next_attempt_at);
+        """)
+        self._conn.commit()
+        self._cancelled = set()
+        self._finished = 0
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._recover()
+
+    def _recover(self):
+        """Requeue jobs interrupted by a restart and purge old finished ones"""
+        now = time.time()
+        with self._lock:
+            requeued = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = NULL, updated_at = ? WHERE status = 'running'", (now,)
+            ).rowcount
+            expired = self._conn.execute(
+                "SELECT job_id, path FROM jobs WHERE status IN ('done', 'cancelled') AND updated_at < ?",
+                (now - JOB_RETENTION_SECONDS,)
+            ).fetchall()
+            self._conn.executemany("DELETE FROM jobs WHERE job_id = ?", [(row['job_id'],) for row in expired])
+            self._conn.commit()
+        for row in expired:
+            Path(row['path']).unlink(missing_ok=True)
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted ingestion jobs")
+
+    def start(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._stopping.clear()
+                self._worker = threading.Thread(target=self._run, name="ingest-worker", daemon=True)
+                self._worker.start()
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        self._wake.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+    def submit(self, source: str, stream) -> str:
+        """Queue a binary stream for ingestion under the given name and return the job id.
+
+        Submitting the same content for a source that is already queued or
+        running returns the existing job instead of adding another.
+        """
+        file_hash = hash_file(stream)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id FROM jobs WHERE source = ? AND file_hash = ? AND status IN ('queued', 'running')",
+                (source, file_hash)
+            ).fetchone()
+        if row:
+            return row['job_id']
+
+        job_id = uuid.uuid4().hex
+        path = self.spool_path / f"{job_id}{Path(source).suffix.lower()}"
+        stream.seek(0)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(stream, f)
+        stream.seek(0)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, source, path, file_hash, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, source, str(path), file_hash, now, now)
+            )
+            self._conn.commit()
+        logger.info(f"Queued {source} as job {job_id}")
+        self.start()
+        self._wake.set()
+        return job_id
+
+    def jobs(self, statuses: tuple = None, limit: int = 50) -> list:
+        """Most recent jobs first, optionally only those with the given statuses"""
+        query = "SELECT * FROM jobs"
+        params = []
+        if statuses:
+            query += f" WHERE status IN ({', '.join('?' for _ in statuses)})"
+            params.extend(statuses)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query, (*params, limit))]
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def finished_count(self) -> int:
+        """Jobs finished by this process; changes whenever the indexed documents may have"""
+        return self._finished
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued job at once, or ask the worker to stop a running one"""
+        with self._lock:
+            row = self._conn.execute("SELECT status, path FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None or row['status'] not in ACTIVE_STATUSES:
+                return False
+            if row['status'] == "running":
+                self._cancelled.add(job_id)
+                return True
+            self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', stage = 'cancelled', updated_at = ? WHERE job_id = ?",
+                (time.time(), job_id)
+            )
+            self._conn.commit()
+        Path(row['path']).unlink(missing_ok=True)
+        logger.info(f"Cancelled queued job {job_id}")
+        return True
+
+    def retry(self, job_id: str) -> bool:
+        """Queue a failed job again with a fresh set of attempts"""
+        with self._lock:
+            row = self._conn.execute("SELECT status, path FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None or row['status'] != "failed" or not Path(row['path']).exists():
+                return False
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = NULL, attempts = 0, error = NULL, next_attempt_at = 0, "
+                "updated_at = ? WHERE job_id = ?",
+                (time.time(), job_id)
+            )
+            self._conn.commit()
+        self.start()
+        self._wake.set()
+        return True
+
+    def dismiss(self, job_id: str) -> bool:
+        """Forget a finished job and its spooled file"""
+        with self._lock:
+            row = self._conn.execute("SELECT status, path FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None or row['status'] in ACTIVE_STATUSES:
+                return False
+            self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            self._conn.commit()
+        Path(row['path']).unlink(missing_ok=True)
+        return True
+
+    def _update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def _claim(self) -> list:
+        """Mark the next due jobs as running, at most one per source"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND next_attempt_at <= ? ORDER BY created_at LIMIT ?",
+                (time.time(), max(settings.ingest_batch_files, 1) * 4)
+            ).fetchall()
+            claimed, sources = [], set()
+            for row in rows:
+                if row['source'] in sources:
+                    continue  # A later upload of the same file waits for this one
+                sources.add(row['source'])
+                claimed.append(dict(row))
+                if len(claimed) >= settings.ingest_batch_files:
+                    break
+            self._conn.executemany(
+                "UPDATE jobs SET status = 'running', stage = 'parsing', done = 0, total = 0, updated_at = ? "
+                "WHERE job_id = ?",
+                [(time.time(), job['job_id']) for job in claimed]
+            )
+            self._conn.commit()
+        return claimed
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                jobs = self._claim()
+            except Exception as e:
+                logger.error(f"Could not claim ingestion jobs: {str(e)}")
+                jobs = []
+            if not jobs:
+                self._wake.wait(IDLE_WAIT_SECONDS)
+                self._wake.clear()
+                continue
+            self._process(jobs)
+
+    def _process(self, jobs: list):
+        from embed import embed_files  # The ingest pipeline is only loaded once there is work for it
+        by_source = {job['source']: job for job in jobs}
+        files, results = [], {}
+        for job in jobs:
+            try:
+                files.append(SpooledUpload(job['path'], job['source']))
+            except OSError as e:
+                self._finish(job, "failed", error=f"Spooled file is missing: {str(e)}")
+                del by_source[job['source']]
+
+        def on_progress(name, stage, done, total):
+            try:
+                self._update(by_source[name]['job_id'], stage=stage, done=done, total=total)
+            except Exception as e:
+                logger.debug(f"Job progress update failed: {str(e)}")
+
+        def is_cancelled(name):
+            return by_source[name]['job_id'] in self._cancelled
+
+        try:
+            if files:
+                logger.info(f"Ingesting {len(files)} queued files")
+                results = embed_files(files, progress_callback=on_progress, is_cancelled=is_cancelled)
+        except Exception as e:
+            logger.error(f"Ingestion batch failed: {str(e)}")
+        finally:
+            for file in files:
+                file.close()
+
+        for source, job in by_source.items():
+            cancelled = job['job_id'] in self._cancelled
+            self._cancelled.discard(job['job_id'])
+            if results.get(source):
+                self._finish(job, "done")  # Finished before the cancellation was seen
+            elif cancelled:
+                self._finish(job, "cancelled")
+            else:
+                self._fail(job)
+
+    def _fail(self, job: dict):
+        attempts = job['attempts'] + 1
+        if attempts < settings.ingest_max_attempts:
+            delay = settings.ingest_retry_delay_seconds * 2 ** (attempts - 1)
+            logger.warning(f"Ingestion of {job['source']} failed; retrying in {delay}s (attempt {attempts})")
+            self._update(
+                job['job_id'], status="queued", stage="retrying", attempts=attempts, next_attempt_at=time.time() + delay
+            )
+            get_metrics().increment("ingest_jobs", result="retried")
+            return
+        self._update(job['job_id'], attempts=attempts)
+        self._finish(job, "failed", error=f"Ingestion failed after {attempts} attempts; see the embed log")
+
+    def _finish(self, job: dict, status: str, error: str = None):
+        fields = {"status": status, "error": error}
+        if status == "cancelled":
+            fields["stage"] = "cancelled"
+        self._update(job['job_id'], **fields)
+        if status != "failed":
+            Path(job['path']).unlink(missing_ok=True)  # Failed jobs keep their file for retry()
+        self._finished += 1
+        get_metrics().increment("ingest_jobs", result=status)
+        logger.info(f"Job {job['job_id']} ({job['source']}): {status}")
+
+_ingest_queue = None
+_ingest_queue_lock = threading.Lock()
+
+def get_ingest_queue():
+    """The process-wide ingestion queue, with its worker started"""
+    global _ingest_queue
+    with _ingest_queue_lock:
+        if _ingest_queue is None:
+            _ingest_queue = IngestQueue(
+                Path(settings.temp_folder) / "ingest_jobs.sqlite3",
+                Path(settings.temp_folder) / "ingest"
+            )
+            _ingest_queue.start()
+    return _ingest_queue
@@ -0,0 +1,376 @@
+import math
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import zlib
+from array import array
+from collections import Counter
+from pathlib import Path
+import numpy as np
+from logger_config import setup_logger
+
+logger = setup_logger('lexical_index')
+
+# Keeps identifiers such as part numbers and error codes (AB-1234, 0x1F, v2.3.1) intact
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[\-_.:/][a-z0-9]+)*")
+STOPWORDS = frozenset("""
+a an and are as at be but by can could did do does for from had has have how i if in into is it
+its me my no not of on or our so such that the their then there these they this to was we were
+what when where which who why will with would you your
+""".split())
+
+# A term in more documents than this is only scored on documents the rarer query terms matched
+COMMON_TERM_POSTINGS = 50_000
+# Journaled chunks after which save() writes a new snapshot in the background
+CHECKPOINT_CHANGES = 50_000
+
+def tokenize(text: str) -> list:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+class BM25Index:
+    """Incremental BM25 index over chunk text backed by compact typed arrays.
+
+    Each term owns two parallel arrays: internal document numbers (uint32)
+    and term frequencies (uint16). Scoring walks only the postings of the
+    query terms with NumPy, so top-k stays in the low milliseconds even for
+    millions of chunks. Removed chunks are tombstoned and squeezed out by
+    compact() once they make up half of the index.
+
+    The index is persisted as a pickled snapshot at path plus a SQLite
+    journal next to it: every add and remove is appended to the journal as
+    it happens, and save() writes a new snapshot (in the background) only
+    once enough changes piled up. Other processes sharing the files catch
+    up by replaying the journal entries they have not seen (see sync()).
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = Path(path)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._seq = 0                          # last journal entry reflected in memory
+        self._checkpoint_thread = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            self.path.with_suffix(".journal.sqlite3"), check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                op TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                payload BLOB
+            );
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            INSERT OR IGNORE INTO meta (name, value) VALUES ('snapshot_seq', 0);
+        """)
+        self._reset()
+
+    def _reset(self):
+        with self._lock:
+            self.chunk_ids = []                # internal doc number -> chunk id
+            self.doc_lengths = array('I')
+            self.alive = bytearray()
+            self.terms = {}                    # term -> term number
+            self.postings_docs = []            # term number -> array('I')
+            self.postings_tfs = []             # term number -> array('H')
+            self.total_length = 0
+            self.live_count = 0
+            self._doc_numbers = {}             # chunk id -> internal doc number
+
+    def __len__(self):
+        return self.live_count
+
+    def clear(self):
+        """Empty the index, for every process sharing its files"""
+        with self._lock:
+            self._reset()
+            self._write_snapshot(self._state())
+
+    def add(self, chunk_ids: list, texts: list):
+        with self._lock:
+            self._journal("add", chunk_ids, texts)
+            self._apply_add(chunk_ids, texts)
+
+    def _apply_add(self, chunk_ids: list, texts: list):
+        with self._lock:
+            for chunk_id, text in zip(chunk_ids, texts):
+                if chunk_id in self._doc_numbers:
+                    self._remove_one(chunk_id)
+                doc = len(self.chunk_ids)
+                self.chunk_ids.append(chunk_id)
+                self._doc_numbers[chunk_id] = doc
+                tokens = tokenize(text)
+                self.doc_lengths.append(len(tokens))
+                self.alive.append(1)
+                self.total_length += len(tokens)
+                self.live_count += 1
+
+                terms = self.terms
+                for token, count in Counter(tokens).items():
+                    term = terms.get(token)
+                    if term is None:
+                        term = terms[token] = len(self.postings_docs)
+                        self.postings_docs.append(array('I'))
+                        self.postings_tfs.append(array('H'))
+                    self.postings_docs[term].append(doc)
+                    self.postings_tfs[term].append(min(count, 65535))
+
+    def _remove_one(self, chunk_id: str):
+        doc = self._doc_numbers.pop(chunk_id)
+        self.alive[doc] = 0
+        self.total_length -= self.doc_lengths[doc]
+        self.live_count -= 1
+
+    def remove(self, chunk_ids: list):
+        with self._lock:
+            self._journal("remove", chunk_ids)
+            self._apply_remove(chunk_ids)
+
+    def _apply_remove(self, chunk_ids: list):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                if chunk_id in self._doc_numbers:
+                    self._remove_one(chunk_id)
+            if len(self.chunk_ids) > 1024 and self.live_count < len(self.chunk_ids) / 2:
+                self.compact()
+
+    def compact(self):
+        """Drop tombstoned documents and renumber the survivors"""
+        with self._lock:
+            alive = np.frombuffer(self.alive, dtype=np.uint8).astype(bool)
+            remap = np.cumsum(alive, dtype=np.int64) - 1
+            postings_docs, postings_tfs, terms = [], [], {}
+            for token, term in self.terms.items():
+                docs = np.frombuffer(self.postings_docs[term], dtype=np.uint32)
+                keep = alive[docs]
+                if not keep.any():
+                    continue
+                terms[token] = len(postings_docs)
+                postings_docs.append(array('I', remap[docs[keep]].astype(np.uint32).tobytes()))
+                postings_tfs.append(array('H', np.frombuffer(self.postings_tfs[term], dtype=np.uint16)[keep].tobytes()))
+            lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32)[alive]
+
+            self.chunk_ids = [chunk_id for chunk_id, live in zip(self.chunk_ids, alive) if live]
+            self._doc_numbers = {chunk_id: doc for doc, chunk_id in enumerate(self.chunk_ids)}
+            self.doc_lengths = array('I', lengths.tobytes())
+            self.alive = bytearray(b'\x01' * len(self.chunk_ids))
+            self.terms, self.postings_docs, self.postings_tfs = terms, postings_docs, postings_tfs
+            logger.info(f"Compacted lexical index to {len(self.chunk_ids)} chunks")
+
+    def search(self, query: str, k: int) -> list:
+        """Return [(chunk_id, bm25_score, query_term_coverage)] for the top k chunks.
+
+        Terms with more than COMMON_TERM_POSTINGS postings are only scored on
+        the documents the other query terms matched (or, when every term is
+        that common, the rarest one), so a query full of common words does
+        not walk millions of postings. Those documents keep their exact
+        scores; a document that only contains the common terms is dropped,
+        which can cost recall when it would have outscored a rarer-term
+        match. When the rarer terms match fewer than k documents, the common
+        terms are scored on every document instead.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            if not tokens or not self.live_count:
+                return []
+            n_docs = len(self.chunk_ids)
+            lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32)
+            avg_length = self.total_length / self.live_count or 1.0
+            scores = np.zeros(n_docs, dtype=np.float32)
+            matched = np.zeros(n_docs, dtype=np.uint8)
+
+            postings = sorted(
+                ((self.postings_docs[term], self.postings_tfs[term])
+                 for term in (self.terms.get(token) for token in tokens) if term is not None),
+                key=lambda pair: len(pair[0])
+            )
+            candidates, restrict = None, None
+            for i, (term_docs, term_tfs) in enumerate(postings):
+                docs = np.frombuffer(term_docs, dtype=np.uint32)
+                tfs = np.frombuffer(term_tfs, dtype=np.uint16)
+                df = len(docs)
+                if i and df > COMMON_TERM_POSTINGS and restrict is None:
+                    candidates = np.flatnonzero(matched)
+                    restrict = int(np.frombuffer(self.alive, dtype=np.uint8)[candidates].sum()) >= k
+                if i and df > COMMON_TERM_POSTINGS and restrict:
+                    # Postings are in ascending document order
+                    positions = np.minimum(np.searchsorted(docs, candidates), df - 1)
+                    positions = positions[docs[positions] == candidates]
+                    docs, tfs = docs[positions], tfs[positions]
+                tfs = tfs.astype(np.float32)
+                idf = math.log(1 + (self.live_count - df + 0.5) / (df + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * lengths[docs] / avg_length)
+                scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+                matched[docs] += 1
+
+            scores *= np.frombuffer(self.alive, dtype=np.uint8)
+            k = min(k, n_docs)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                (self.chunk_ids[doc], float(scores[doc]), float(matched[doc]) / len(tokens))
+                for doc in top if scores[doc] > 0
+            ]
+
+    def _state(self) -> dict:
+        """Copies of the index structures, so a snapshot can be written while the index keeps changing"""
+        with self._lock:
+            return {
+                "chunk_ids": list(self.chunk_ids),
+                "doc_lengths": self.doc_lengths[:],
+                "alive": bytearray(self.alive),
+                "terms": dict(self.terms),
+                "postings_docs": [docs[:] for docs in self.postings_docs],
+                "postings_tfs": [tfs[:] for tfs in self.postings_tfs],
+                "total_length": self.total_length,
+                "live_count": self.live_count,
+            }
+
+    def _journal(self, op: str, chunk_ids: list, texts: list = None):
+        """Append a change to the journal, first replaying what other processes appended before it"""
+        payload = zlib.compress(pickle.dumps((chunk_ids, texts), protocol=pickle.HIGHEST_PROTOCOL))
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._catch_up()
+                cursor = self._conn.execute(
+                    "INSERT INTO changes (op, size, payload) VALUES (?, ?, ?)", (op, len(chunk_ids), payload)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._seq = cursor.lastrowid
+        except Exception as e:
+            # The change is still applied in memory; a restart rebuilds the index if counts differ
+            logger.error(f"Could not journal lexical index change: {str(e)}")
+
+    def _catch_up(self, reload: bool = False):
+        """Apply journal entries after self._seq, reloading the snapshot first if the journal was truncated past it"""
+        snapshot_seq = self._conn.execute("SELECT value FROM meta WHERE name = 'snapshot_seq'").fetchone()[0]
+        if reload or snapshot_seq > self._seq:
+            self._reset()
+            if self.path.exists():
+                with open(self.path, 'rb') as f:
+                    for key, value in pickle.load(f).items():
+                        setattr(self, key, value)
+                self._doc_numbers = {
+                    chunk_id: doc for doc, chunk_id in enumerate(self.chunk_ids) if self.alive[doc]
+                }
+            self._seq = snapshot_seq
+        for seq, op, payload in self._conn.execute(
+            "SELECT seq, op, payload FROM changes WHERE seq > ? ORDER BY seq", (self._seq,)
+        ).fetchall():
+            chunk_ids, texts = pickle.loads(zlib.decompress(payload))
+            if op == "add":
+                self._apply_add(chunk_ids, texts)
+            elif op == "remove":
+                self._apply_remove(chunk_ids)
+            self._seq = seq
+
+    def sync(self):
+        """Apply the changes other processes journaled since this one last looked"""
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN")
+                try:
+                    self._catch_up()
+                finally:
+                    self._conn.execute("COMMIT")
+            except Exception as e:
+                logger.error(f"Could not sync lexical index: {str(e)}")
+
+    def _write_snapshot(self, state: dict, seq: int = None) -> bool:
+        """Make state, as of journal entry seq, the snapshot and drop the journal entries it covers.
+
+        Without seq the snapshot replaces everything journaled so far (clear
+        and rebuild). A snapshot older than the current one is discarded.
+        """
+        temp_path = self.path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if seq is None:
+                    # Takes the next sequence number; deleted below, so nobody replays it
+                    seq = self._conn.execute(
+                        "INSERT INTO changes (op, size) VALUES ('snapshot', 0)"
+                    ).lastrowid
+                    self._seq = seq
+                snapshot_seq = self._conn.execute("SELECT value FROM meta WHERE name = 'snapshot_seq'").fetchone()[0]
+                if seq <= snapshot_seq:
+                    self._conn.execute("ROLLBACK")
+                    temp_path.unlink(missing_ok=True)
+                    return False
+                os.replace(temp_path, self.path)
+                self._conn.execute("UPDATE meta SET value = ? WHERE name = 'snapshot_seq'", (seq,))
+                self._conn.execute("DELETE FROM changes WHERE seq <= ?", (seq,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                temp_path.unlink(missing_ok=True)
+                raise
+        logger.info(f"Saved lexical index snapshot with {state['live_count']} chunks")
+        return True
+
+    def checkpoint(self):
+        """Write a snapshot of the current index and truncate the journal"""
+        with self._lock:
+            self.sync()
+            state, seq = self._state(), self._seq
+        self._write_snapshot(state, seq)
+
+    def _checkpoint_in_background(self):
+        try:
+            self.checkpoint()
+        except Exception as e:
+            logger.error(f"Lexical index snapshot failed: {str(e)}")
+
+    def save(self):
+        """Changes are journaled as they happen; this only starts a background snapshot once enough piled up"""
+        with self._lock:
+            if self._checkpoint_thread is not None and self._checkpoint_thread.is_alive():
+                return
+            pending = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM changes WHERE seq > (SELECT value FROM meta WHERE name = 'snapshot_seq')"
+            ).fetchone()[0]
+            if pending < CHECKPOINT_CHANGES:
+                return
+            self._checkpoint_thread = threading.Thread(
+                target=self._checkpoint_in_background, name="lexical-index-snapshot", daemon=True
+            )
+            self._checkpoint_thread.start()
+
+    def rebuild(self, pages):
+        """Replace the contents with (chunk_ids, texts) pages and snapshot them, without journaling each chunk"""
+        with self._lock:
+            self._reset()
+            for chunk_ids, texts in pages:
+                self._apply_add(chunk_ids, texts)
+            self._write_snapshot(self._state())
+
+    def load(self) -> bool:
+        """Load the snapshot and replay the journal; False when neither exists"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._catch_up(reload=True)
+            finally:
+                self._conn.execute("COMMIT")
+            if not self.path.exists() and not self._seq:
+                return False
+        logger.info(f"Loaded lexical index with {self.live_count} chunks")
+        return True
+
+def reciprocal_rank_fusion(rankings: list, weights: list, k: int = 60) -> dict:
+    """Fuse several ranked id lists into {id: score}"""
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking):
+            fused[item] = fused.get(item, 0.0) + weight / (k + rank + 1)
+    return fused
@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+import requests
+from context_builder import model_context_window
+from logger_config import setup_logger
+from config import settings
+
+logger = setup_logger('llm_registry')
+
+OLLAMA_API_TIMEOUT = 5  # seconds, for model listing and unload requests
+PREWARM_TIMEOUT = 300  # seconds; loading a large model from disk can be slow
+PREWARM_INTERVAL = 60  # seconds between repeated warm-ups of the same model
+MODEL_LIST_RETRY_SECONDS = 10  # how long a failed model listing is cached
+
+class LLMRegistry:
+    """Chat clients shared across the app, keyed by model name.
+
+    Clients are created on first use and kept in LRU order. Once more than
+    settings.llm_max_loaded_models are in use, the least recently used one
+    is dropped and Ollama is asked to unload it (keep_alive=0), or once its
+    last acquire() is released when a question is still being answered
+    with it. prewarm()
+    loads a model in the background so the first question to it does not
+    pay the load time. The list of installed models is cached for
+    settings.model_list_ttl_seconds.
+    """
+
+    def __init__(self, base_url: str, max_models: int, keep_alive: str, model_list_ttl: float):
+        self.base_url = base_url
+        self.max_models = max(1, max_models)
+        self.keep_alive = keep_alive
+        self.model_list_ttl = model_list_ttl
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()
+        self._active = {}  # model -> questions being answered with it
+        self._warmed = {}
+        self._warming = set()
+        self._models = None
+        self._models_expire = 0.0
+        self._session = requests.Session()
+
+    def get(self, model: str = None):
+        """Chat client (a ChatOllama) for a model, created on first use"""
+        model = model or settings.llm_model
+        evicted = []
+        with self._lock:
+            client = self._clients.get(model)
+            if client is None:
+                from langchain_ollama import ChatOllama
+                logger.info(f"Initializing chat client for model: {model}")
+                client = ChatOllama(
+                    model=model,
+                    base_url=self.base_url,
+                    num_ctx=model_context_window(model),
+                    keep_alive=self.keep_alive
+                )
+                self._clients[model] = client
+            self._clients.move_to_end(model)
+            while len(self._clients) > self.max_models:
+                name = self._clients.popitem(last=False)[0]
+                if not self._active.get(name):
+                    evicted.append(name)
+                    self._warmed.pop(name, None)
+        for name in evicted:
+            threading.Thread(target=self.unload, args=(name,), daemon=True).start()
+        return client
+
+    def acquire(self, model: str = None):
+        """Client for a model that stays loaded until release(); also marks it most recently used"""
+        model = model or settings.llm_model
+        client = self.get(model)
+        with self._lock:
+            self._active[model] = self._active.get(model, 0) + 1
+        return client
+
+    def release(self, model: str = None):
+        """End an acquire(); unloads the model if it was evicted while in use"""
+        model = model or settings.llm_model
+        with self._lock:
+            self._active[model] -= 1
+            if self._active[model]:
+                return
+            del self._active[model]
+            if model in self._clients:
+                return
+            self._warmed.pop(model, None)
+        threading.Thread(target=self.unload, args=(model,), daemon=True).start()
+
+    def loaded_models(self) -> list:
+        with self._lock:
+            return list(self._clients)
+
+    def prewarm(self, model: str = None, wait: bool = False):
+        """Ask Ollama to load the model (an empty generate request) without blocking the caller"""
+        model = model or settings.llm_model
+        with self._lock:
+            if model in self._warming or time.monotonic() - self._warmed.get(model, -PREWARM_INTERVAL) < PREWARM_INTERVAL:
+                return
+            self._warming.add(model)
+        thread = threading.Thread(target=self._prewarm, args=(model,), daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+
+    def _prewarm(self, model: str):
+        start = time.perf_counter()
+        try:
+            response = self._session.post(
+                f"{self.base_url}/api/generate",
+                json={"model": model, "keep_alive": self.keep_alive},
+                timeout=PREWARM_TIMEOUT
+            )
+            response.raise_for_status()
+            with self._lock:
+                self._warmed[model] = time.monotonic()
+            logger.info(f"Pre-warmed {model} in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            logger.error(f"Pre-warm of {model} failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._warming.discard(model)
+
+    def unload(self, model: str):
+        try:
+            self._session.post(
+                f"{self.base_url}/api/generate",
+                json={"model": model, "keep_alive": 0},
+                timeout=OLLAMA_API_TIMEOUT
+            ).raise_for_status()
+            logger.info(f"Unloaded {model}")
+        except Exception as e:
+            logger.error(f"Unloading {model} failed: {str(e)}")
+
+    def list_models(self) -> list:
+        """Installed model names from /api/tags, cached; empty if Ollama is unreachable"""
+        now = time.monotonic()
+        if self._models is not None and now < self._models_expire:
+            return self._models
+        try:
+            response = self._session.get(f"{self.base_url}/api/tags", timeout=OLLAMA_API_TIMEOUT)
+            response.raise_for_status()
+            self._models = [m['name'] for m in response.json()['models']]
+            self._models_expire = now + self.model_list_ttl
+        except Exception as e:
+            logger.error(f"Could not list Ollama models: {str(e)}")
+            self._models = []
+            self._models_expire = now + MODEL_LIST_RETRY_SECONDS
+        return self._models
+
+_registry = None
+
+def get_llm_registry():
+    global _registry
+    if _registry is None:
+        _registry = LLMRegistry(
+            settings.ollama_base_url,
+            max_models=settings.llm_max_loaded_models,
+            keep_alive=settings.llm_keep_alive,
+            model_list_ttl=settings.model_list_ttl_seconds
+        )
+    return _registry
@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from logger_config import setup_logger
+from config import settings
+
+logger = setup_logger('metrics')
+
+METRIC_PREFIX = "axbot"
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Metrics:
+    """Process-wide counters and per-stage latency histograms.
+
+    Stages are labelled with the pipeline they belong to ("query" or
+    "ingest"), so e.g. query embedding and ingest embedding are kept apart.
+    Everything is exported in the Prometheus text format, and finished
+    traces (one per query or ingested file) are appended as JSON lines to
+    settings.metrics_log_path when it is set.
+    """
+
+    def __init__(self, log_path: str = ""):
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        if log_path:
+            Path(log_path).parent.mkdir(parents=True, exist_ok=True)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, kind: str, stage: str, seconds: float):
+        key = _label_key({"kind": kind, "stage": stage})
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][i] += 1
+                    break
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    @contextmanager
+    def span(self, kind: str, stage: str, timings: dict = None):
+        """Time a block into the stage histogram and, if given, add it to a trace's timings"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(kind, stage, elapsed)
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0.0) + elapsed
+
+    def record_trace(self, kind: str, timings: dict, observe: bool = True, **fields):
+        """Record one finished trace: observe its stage timings and append it to the JSON-lines log"""
+        if observe:
+            for stage, seconds in timings.items():
+                self.observe(kind, stage, seconds)
+        if not self.log_path:
+            return
+        line = json.dumps({
+            "ts": time.time(),
+            "kind": kind,
+            "timings_ms": {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()},
+            **fields
+        }, default=str)
+        try:
+            with self._lock, open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except Exception as e:
+            logger.error(f"Could not write metrics log: {str(e)}")
+
+    def snapshot(self) -> dict:
+        """Counters and histogram summaries as plain data"""
+        with self._lock:
+            counters = {
+                name + _format_labels(labels): value for (name, labels), value in sorted(self._counters.items())
+            }
+            stages = {
+                _format_labels(key): {
+                    "count": histogram["count"],
+                    "mean_ms": histogram["sum"] / histogram["count"] * 1000 if histogram["count"] else 0.0,
+                }
+                for key, histogram in sorted(self._histograms.items())
+            }
+        return {"counters": counters, "stages": stages}
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, dict(h, buckets=list(h["buckets"]))) for key, h in self._histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{METRIC_PREFIX}_{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+        metric = f"{METRIC_PREFIX}_stage_seconds"
+        if histograms:
+            lines.append(f"# HELP {metric} Latency of each pipeline stage")
+            lines.append(f"# TYPE {metric} histogram")
+        for labels, histogram in histograms:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_format_labels(labels, (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{metric}_bucket{_format_labels(labels, (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+_metrics = None
+
+def get_metrics():
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics(settings.metrics_log_path)
+    return _metrics
@@ -1,15 +1,16 @@
-from langchain_ollama import ChatOllama
-from langchain.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from get_vector_db import get_vector_db, has_documents, get_relevant_sources
+from get_vector_db import get_embeddings, has_documents, search_collections, get_collection_version
+from answer_cache import get_answer_cache, replay
+from relevance import get_relevance_gate
+from reranker import get_reranker
+from metrics import get_metrics
+from context_builder import build_context, context_token_budget, estimate_tokens
+from llm_registry import get_llm_registry
 from logger_config import setup_logger
 from config import settings
-import os
-from datetime import datetime
-import re
+import time
+from contextlib import contextmanager
 
 logger = setup_logger('query')
-os.makedirs(settings.logs_path, exist_ok=True)
 
 RAG_PROMPT = """You're a helpful AI assistant. Use this context to answer:
 {context}
@@ -18,146 +19,284 @@ Question: {question}
 
 Provide a concise, factual answer in Markdown. If unsure, say so."""
 
-RELEVANCE_PROMPT = """Given this context and question, respond with 'relevant' or 'not relevant':
-Context: {context}
-Question: {question}
-Response:"""
+# Number of top hits shown to the relevance check
+RELEVANCE_CONTEXT_DOCS = 2
+
+class QueryContext:
+    """State for one question, built once and shared by every pipeline stage.
+
+    search_query is the question used for retrieval: the question itself,
+    or its standalone rewrite when it is a follow-up in a conversation.
+    """
+
+    def __init__(self, query: str, conversation=None):
+        self.query = query
+        self.search_query = query
+        self.history = conversation.as_messages() if conversation else []
+        self.history_tokens = conversation.token_estimate() if conversation else 0
+        self.embedding = None
+        self.sources = []
+        self.context = ""
+        self.packed = []
+        self.prompt_tokens = 0
+        self.timings = {}
+        self.tokens = 0
+        self.mode = "rag"
+        self.failed = False
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def timed(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - start
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def mark(self, stage: str):
+        """Record time elapsed since the query started, e.g. for first token"""
+        self.timings[stage] = self.elapsed()
+
+    def pack(self, model: str):
+        """Fit the retrieved sources into the model's context budget"""
+        budget = max(context_token_budget(model, RAG_PROMPT + self.query) - self.history_tokens, 0)
+        self.context, self.packed = build_context(self.search_query, self.sources, budget)
+        self.prompt_tokens = estimate_tokens(RAG_PROMPT + self.query + self.context) + self.history_tokens
+
+    def context_sources(self) -> list:
+        return self.packed
+
+    def relevance_sources(self) -> list:
+        return self.sources[:RELEVANCE_CONTEXT_DOCS]
+
+    def timing_summary(self) -> str:
+        return ", ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in self.timings.items())
+
+def retrieval_candidates() -> int:
+    """Chunks retrieved per question, before re-ranking and packing"""
+    candidates = max(settings.context_candidates, RELEVANCE_CONTEXT_DOCS)
+    if settings.rerank_enabled:
+        candidates = max(candidates, settings.rerank_candidates)
+    return candidates
+
+def get_llm(model: str = None):
+    """Chat client for a model, shared by every QueryHandler so HTTP connections to Ollama are pooled"""
+    return get_llm_registry().get(model)
 
 class QueryHandler:
-    def __init__(self):
-        logger.info(f"Initializing QueryHandler with model: {settings.llm_model}")
-        self.llm = ChatOllama(model=settings.llm_model)
-        self.rag_prompt = ChatPromptTemplate.from_template(RAG_PROMPT)
-        self.relevance_prompt = ChatPromptTemplate.from_template(RELEVANCE_PROMPT)
+    def __init__(self, llm=None):
+        self.llm = llm or get_llm()
+        logger.info(f"Initializing QueryHandler with model: {self.llm.model}")
+        # langchain_core.prompts takes most of a second to import, so it waits for the first handler
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+        self.rag_prompt = ChatPromptTemplate.from_messages([
+            MessagesPlaceholder("history", optional=True),
+            ("human", RAG_PROMPT)
+        ])
+        self.relevance_gate = get_relevance_gate()
+        self.collections = [settings.collection_name] + list(settings.search_collections)
         self.last_sources = []
+        self.last_timings = {}
+        self.last_mode = None
+
+    def set_model(self, model: str):
+        """Answer following questions with another model; the client comes from the shared registry"""
+        if model and model != self.llm.model:
+            logger.info(f"Switching model to {model}")
+            self.llm = get_llm(model)
+
+    def set_collections(self, collections: list):
+        """Collections searched for following questions; the current one when empty"""
+        self.collections = list(collections or [settings.collection_name])
 
     def get_welcome_message(self):
         return """**Welcome to AXbot!** 🌟\n\n- Upload documents to chat with them\n- Switch models in the sidebar\n- Clear history anytime"""
 
-    def stream_query(self, query: str, force_direct=False):
+    def stream_query(self, query: str, force_direct=False, conversation=None, embedding=None, sources=None):
+        """Stream the answer to a question.
+
+        With a Conversation, follow-up questions are rewritten into a
+        standalone question for retrieval, and the conversation summary and
+        recent messages are sent along with the question. Batch callers
+        (batch_query.py) pass the question's embedding and its
+        retrieval_candidates() search hits, computed for many questions at once.
+        The model is held in the registry while answering, so other sessions
+        switching models cannot unload it mid-answer.
+        """
+        model = self.llm.model
+        registry = get_llm_registry()
+        self.llm = registry.acquire(model)
         try:
-            if not has_documents() or force_direct:
-                logger.info(f"Using direct chat mode - Reason: {'No documents' if not has_documents() else 'Forced direct'}")
-                self.last_sources = []
-                for chunk in self._direct_chat(query):
+            yield from self._stream_query(query, force_direct, conversation, embedding, sources)
+        finally:
+            registry.release(model)
+
+    def _stream_query(self, query: str, force_direct, conversation, embedding, sources):
+        ctx = QueryContext(query, conversation)
+        self.last_sources = []
+        try:
+            with ctx.timed("has_documents"):
+                docs_available = has_documents(self.collections)
+
+            if not docs_available or force_direct:
+                logger.info(f"Using direct chat mode - Reason: {'No documents' if not docs_available else 'Forced direct'}")
+                ctx.mode = "direct"
+                for chunk in self._timed_stream(ctx, self._direct_chat(ctx)):
                     yield chunk
                 return
 
+            if conversation:
+                with ctx.timed("rewrite"):
+                    ctx.search_query = conversation.rewrite(query, self.llm)
+
+            if embedding is None:
+                with ctx.timed("embed"):
+                    embedding = get_embeddings().embed_query(ctx.search_query)
+            ctx.embedding = embedding
+
+            answer_cache = get_answer_cache()
+            version = get_collection_version()
+            # Answers depend on the collections searched, so they are cached per set of collections
+            cache_model = self.llm.model
+            if self.collections != [settings.collection_name]:
+                cache_model = f"{self.llm.model}@{'+'.join(self.collections)}"
+            if answer_cache:
+                with ctx.timed("cache_lookup"):
+                    cached = answer_cache.lookup(version, cache_model, ctx.search_query, ctx.embedding)
+                get_metrics().increment("answer_cache_lookups", result="hit" if cached else "miss")
+                if cached:
+                    ctx.mode = "cached"
+                    logger.info(f"Serving cached answer - cache stats: {answer_cache.stats()}")
+                    self.last_sources = cached["sources"]
+                    for chunk in self._timed_stream(ctx, replay(cached["answer"])):
+                        yield chunk
+                    return
+
+            if sources is None:
+                with ctx.timed("retrieve"):
+                    sources = search_collections(
+                        ctx.search_query, ctx.embedding, k=retrieval_candidates(), collections=self.collections
+                    )
+            ctx.sources = sources
+            if settings.rerank_enabled:
+                with ctx.timed("rerank"):
+                    ctx.sources = get_reranker().rerank(
+                        ctx.search_query, ctx.sources,
+                        keep=max(settings.context_candidates, RELEVANCE_CONTEXT_DOCS), elapsed=ctx.elapsed()
+                    )
+
             logger.debug("Checking query relevance to documents")
-            if not self._is_query_relevant(query):
+            with ctx.timed("relevance"):
+                relevant = self._is_query_relevant(ctx)
+            if not relevant:
                 logger.info("Query deemed not relevant to documents")
-                self.last_sources = []
+                ctx.mode = "not_relevant"
                 yield "Your question doesn't seem related to the loaded documents. Would you like me to answer using general knowledge? (Yes/No)"
                 return
 
             logger.info("Using RAG mode for relevant query")
-            self.last_sources = get_relevant_sources(query)
-            for chunk in self._rag_chat(query):
+            with ctx.timed("pack"):
+                ctx.pack(self.llm.model)
+            self.last_sources = ctx.context_sources()
+            answer = []
+            for chunk in self._timed_stream(ctx, self._rag_chat(ctx)):
+                answer.append(chunk)
                 yield chunk
 
+            if answer_cache and self.last_sources and not ctx.failed:
+                answer_cache.store(
+                    version, cache_model, ctx.search_query, ctx.embedding, "".join(answer), self.last_sources
+                )
+
         except Exception as e:
             self.last_sources = []
+            ctx.mode = "error"
             error_msg = f"Query failed: {str(e)}"
             logger.error(error_msg)
             yield error_msg
 
+        finally:
+            ctx.mark("total")
+            self.last_timings = dict(ctx.timings)
+            self.last_mode = "error" if ctx.failed else ctx.mode
+            logger.info(f"Query timings: {ctx.timing_summary()}")
+            self._record_metrics(ctx)
+
     def get_last_sources(self):
         """Get sources used in last query"""
         return self.last_sources if hasattr(self, 'last_sources') else []
 
-    def _direct_chat(self, query: str):
+    def get_last_timings(self):
+        """Get per-stage timings (seconds) of the last query"""
+        return self.last_timings
+
+    def _timed_stream(self, ctx: QueryContext, chunks):
+        first = True
+        with ctx.timed("generate"):
+            for chunk in chunks:
+                if first:
+                    ctx.mark("first_token")
+                    first = False
+                ctx.tokens += 1
+                yield chunk
+
+    def _record_metrics(self, ctx: QueryContext):
+        mode = "error" if ctx.failed else ctx.mode
+        metrics = get_metrics()
+        metrics.increment("queries", mode=mode)
+        metrics.increment("tokens", ctx.tokens)
+        metrics.increment("prompt_tokens", ctx.prompt_tokens)
+        metrics.record_trace(
+            "query",
+            ctx.timings,
+            mode=mode,
+            model=getattr(self.llm, 'model', None),
+            tokens=ctx.tokens,
+            prompt_tokens=ctx.prompt_tokens,
+            history_tokens=ctx.history_tokens,
+            rewritten=ctx.search_query != ctx.query,
+            sources=len(self.last_sources)
+        )
+
+    def _direct_chat(self, ctx: QueryContext):
         logger.debug("Processing direct chat query")
-        for chunk in self.llm.stream(query):
+        from langchain_core.messages import HumanMessage
+        for chunk in self.llm.stream(ctx.history + [HumanMessage(content=ctx.query)]):
             yield chunk.content
 
-    def _rag_chat(self, query: str):
+    def _rag_chat(self, ctx: QueryContext):
         logger.debug("Processing RAG query")
         try:
-            # Get more documents for better context
-            self.last_sources = get_relevant_sources(query, k=settings.max_context_docs)
-            
-            if not self.last_sources:
+            if not ctx.context:
                 logger.info("No relevant sources found for query")
-                for chunk in self._direct_chat(query):
+                for chunk in self._direct_chat(ctx):
                     yield chunk
                 return
-            
-            # Format context from relevant sources
-            context = "\n\n".join([doc['content'] for doc in self.last_sources])
-            
-            # Use the chain with context
+
+            logger.debug(f"Prompt of ~{ctx.prompt_tokens} tokens from {len(ctx.packed)} passages")
             chain = self.rag_prompt | self.llm
-            for chunk in chain.stream({"context": context, "question": query}):
+            for chunk in chain.stream({"history": ctx.history, "context": ctx.context, "question": ctx.query}):
+                # Ollama reports prompt evaluation on the final chunk
+                prefill = (chunk.response_metadata or {}).get("prompt_eval_duration")
+                if prefill:
+                    ctx.timings["prefill"] = prefill / 1e9
                 yield chunk.content
-                
+
         except Exception as e:
+            ctx.failed = True
             logger.error(f"RAG chat error: {str(e)}")
             yield f"Error processing query: {str(e)}"
 
-    def _is_query_relevant(self, query: str) -> bool:
+    def _is_query_relevant(self, ctx: QueryContext) -> bool:
         try:
-            retriever = get_vector_db().as_retriever(
-                search_kwargs={"k": 2}
-            )
-            docs = retriever.invoke(query)
-            context = "\n".join([doc.page_content for doc in docs])
-            
-            chain = self.relevance_prompt | self.llm
-            response = chain.invoke({
-                "context": context,
-                "question": query
-            })
-            
-            # Handle AIMessage object properly
-            result = response.content if hasattr(response, 'content') else str(response)
-            result = result.lower().strip()
-            
-            logger.debug(f"Relevance check result: {result}")
-            return 'relevant' in result
-            
-        except Exception as e:
-            logger.error(f"Relevance check failed: {str(e)}")
-            return True  # Default to RAG mode on error
-
-            yield f"Error processing query: {str(e)}"
-def get_query_handler():
-    return QueryHandler()
+            return self.relevance_gate.is_relevant(ctx, self.llm)
 
-    def _is_query_relevant(self, query: str) -> bool:
-        # Skip relevance check for basic conversational patterns
-        basic_patterns = [
-            r'\b(thanks|thank you|okay|ok|bye|goodbye)\b',
-            r'\b(can you|could you|would you|will you)\b',
-            r'\b(what|who|where|when|why|how)\b'
-        ]
-        if any(re.search(pattern, query, re.IGNORECASE) for pattern in basic_patterns):
-            logger.info("Detected conversational pattern, using direct chat")
-            return False
-
-        # Continue with document relevance check
-        try:
-            retriever = get_vector_db().as_retriever(
-                search_kwargs={"k": 2}
-            )
-            docs = retriever.invoke(query)
-            context = "\n".join([doc.page_content for doc in docs])
-            
-            chain = self.relevance_prompt | self.llm
-            response = chain.invoke({
-                "context": context,
-                "question": query
-            })
-            
-            # Handle AIMessage object properly
-            result = response.content if hasattr(response, 'content') else str(response)
-            result = result.lower().strip()
-            
-            logger.debug(f"Relevance check result: {result}")
-            return 'relevant' in result
-            
         except Exception as e:
             logger.error(f"Relevance check failed: {str(e)}")
             return True  # Default to RAG mode on error
 
 def get_query_handler():
-    return QueryHandler()
\ No newline at end of file
+    return QueryHandler()
@@ -0,0 +1,76 @@
+import json
+import requests
+from logger_config import setup_logger
+from config import settings
+
+logger = setup_logger('query_client')
+
+class RemoteQueryHandler:
+    """Drop-in replacement for QueryHandler that streams answers from server.py"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        self.last_sources = []
+        self.last_timings = {}
+        self.model = None
+        self.collections = None
+
+    def set_model(self, model: str):
+        """Model used by the service for following questions"""
+        self.model = model
+
+    def set_collections(self, collections: list):
+        """Collections the service searches for following questions"""
+        self.collections = list(collections) if collections else None
+
+    def get_welcome_message(self):
+        try:
+            response = self.session.get(f"{self.base_url}/welcome", timeout=settings.query_service_timeout)
+            response.raise_for_status()
+            return response.json()["message"]
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Could not reach query service: {str(e)}")
+            return "**Welcome to AXbot!** 🌟\n\n⚠️ The query service is not reachable."
+
+    def stream_query(self, query: str, force_direct=False, conversation=None):
+        self.last_sources = []
+        self.last_timings = {}
+        try:
+            with self.session.post(
+                f"{self.base_url}/query",
+                json={
+                    "query": query,
+                    "force_direct": force_direct,
+                    "model": self.model,
+                    "collections": self.collections,
+                    "conversation": conversation.to_dict() if conversation else None
+                },
+                stream=True,
+                timeout=settings.query_service_timeout
+            ) as response:
+                if response.status_code == 503:
+                    yield "The server is busy right now, please try again in a moment."
+                    return
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data: "):
+                        continue
+                    event = json.loads(line[len("data: "):])
+                    if event["type"] == "token":
+                        yield event["content"]
+                    elif event["type"] == "done":
+                        self.last_sources = event.get("sources") or []
+                        self.last_timings = event.get("timings") or {}
+        except requests.exceptions.RequestException as e:
+            error_msg = f"Query failed: {str(e)}"
+            logger.error(error_msg)
+            yield error_msg
+
+    def get_last_sources(self):
+        """Get sources used in last query"""
+        return self.last_sources
+
+    def get_last_timings(self):
+        """Get per-stage timings (seconds) of the last query"""
+        return self.last_timings
@@ -0,0 +1,164 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from document_registry import hash_text
+from metrics import get_metrics
+from logger_config import setup_logger
+from config import settings
+
+logger = setup_logger('reranker')
+
+_cross_encoders = {}
+_cross_encoder_lock = threading.Lock()
+
+def load_cross_encoder(model_name: str):
+    """Load (once per process) a sentence-transformers CrossEncoder; None if unavailable"""
+    with _cross_encoder_lock:
+        if model_name not in _cross_encoders:
+            try:
+                from sentence_transformers import CrossEncoder
+                logger.info(f"Loading cross-encoder: {model_name}")
+                _cross_encoders[model_name] = CrossEncoder(model_name, device="cpu")
+            except Exception as e:
+                logger.error(f"Could not load cross-encoder {model_name}: {str(e)}")
+                _cross_encoders[model_name] = None
+        return _cross_encoders[model_name]
+
+class ScoreCache:
+    """Bounded LRU of cross-encoder scores keyed by (model, normalised query, chunk)"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model: str, query: str, source: dict) -> tuple:
+        # Chunk ids are derived from the chunk text, so an id always stands for the same passage
+        return model, " ".join(query.lower().split()), source.get('id') or hash_text(source['content'])
+
+    def get(self, key):
+        with self._lock:
+            score = self._entries.get(key)
+            if score is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return score
+
+    def put(self, key, score: float):
+        with self._lock:
+            self._entries[key] = score
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+class CrossEncoderReranker:
+    """Re-order retrieved chunks by a local cross-encoder's (question, passage) score.
+
+    Candidates are scored in batches of settings.rerank_batch_size, in
+    retrieval order, and scores (a probability, metadata 'rerank_score') are
+    cached per question and chunk. Scoring stops early once enough
+    candidates passed the cutoff and a whole batch added none, or when the
+    next batch would not fit in the time budget; candidates left unscored
+    follow the scored ones in their retrieval order.
+    """
+
+    def __init__(self, model_name: str, cache: ScoreCache):
+        self.model_name = model_name
+        self.cache = cache
+        self._seconds_per_pair = None  # Moving average, to predict whether a batch fits the budget
+
+    def score(self, query: str, sources: list, deadline: float = None, keep: int = None) -> list:
+        """Scores for sources in order, None for those not scored (no model, or out of time)"""
+        keys = [self.cache.key(self.model_name, query, source) for source in sources]
+        scores = [self.cache.get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if not missing:
+            return scores
+        model = load_cross_encoder(self.model_name)
+        if model is None:
+            return scores
+
+        passed = 0
+        for start in range(0, len(missing), settings.rerank_batch_size):
+            batch = missing[start:start + settings.rerank_batch_size]
+            if deadline is not None and self._seconds_per_pair is not None:
+                if time.perf_counter() + self._seconds_per_pair * len(batch) > deadline:
+                    logger.debug(f"Re-ranking budget spent after {start} of {len(missing)} candidates")
+                    break
+            began = time.perf_counter()
+            logits = model.predict([(query, sources[i]['content']) for i in batch], batch_size=len(batch))
+            per_pair = (time.perf_counter() - began) / len(batch)
+            self._seconds_per_pair = per_pair if self._seconds_per_pair is None else (
+                0.8 * self._seconds_per_pair + 0.2 * per_pair
+            )
+            added = 0
+            for i, logit in zip(batch, logits):
+                scores[i] = 1 / (1 + math.exp(-float(logit)))
+                self.cache.put(keys[i], scores[i])
+                added += scores[i] >= settings.rerank_min_score
+            passed += added
+            if keep and passed >= keep and not added:
+                break
+        return scores
+
+    def rerank(self, query: str, sources: list, keep: int, elapsed: float = 0.0) -> list:
+        """Best keep sources above settings.rerank_min_score, best first.
+
+        elapsed is how long the query has taken so far, in seconds; the
+        re-ranker is skipped once that exceeds settings.rerank_skip_after_ms,
+        and otherwise gets at most settings.rerank_budget_ms.
+        """
+        metrics = get_metrics()
+        now = time.perf_counter()
+        if settings.rerank_skip_after_ms and elapsed * 1000 > settings.rerank_skip_after_ms:
+            logger.info("Skipping re-ranking: query is already over its latency budget")
+            metrics.increment("rerank", result="skipped")
+            return sources[:keep]
+        deadline = now + settings.rerank_budget_ms / 1000 if settings.rerank_budget_ms else None
+        scores = self.score(query, sources, deadline, keep)
+        if all(score is None for score in scores):
+            metrics.increment("rerank", result="unavailable" if load_cross_encoder(self.model_name) is None else "skipped")
+            return sources[:keep]
+
+        scored = sorted(
+            (dict(source, rerank_score=score) for source, score in zip(sources, scores)
+             if score is not None and score >= settings.rerank_min_score),
+            key=lambda source: source['rerank_score'], reverse=True
+        )
+        unscored = [source for source, score in zip(sources, scores) if score is None]
+        dropped = sum(1 for score in scores if score is not None and score < settings.rerank_min_score)
+        metrics.increment("rerank", result="partial" if unscored else "done")
+        metrics.increment("rerank_dropped", dropped)
+        logger.debug(
+            f"Re-ranked {len(sources) - len(unscored)} of {len(sources)} candidates, "
+            f"dropped {dropped} below {settings.rerank_min_score}"
+        )
+        return (scored + unscored)[:keep]
+
+_score_cache = None
+_rerankers = {}
+
+def get_reranker(model_name: str = None):
+    """Shared re-ranker for a cross-encoder model (settings.rerank_model by default)"""
+    global _score_cache
+    model_name = model_name or settings.rerank_model
+    if _score_cache is None:
+        _score_cache = ScoreCache(settings.rerank_cache_entries)
+    if model_name not in _rerankers:
+        _rerankers[model_name] = CrossEncoderReranker(model_name, _score_cache)
+    return _rerankers[model_name]
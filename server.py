@@ -0,0 +1,124 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from query import QueryHandler, get_llm
+from llm_registry import get_llm_registry
+from conversation import Conversation
+from metrics import get_metrics
+from warmup import warm_up, warmup_status
+from logger_config import setup_logger
+from config import settings
+
+logger = setup_logger('server')
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Creates the data directories; with warm-up on, also opens the collection and loads the models
+    warm_up()
+    if not settings.warmup_enabled and settings.llm_prewarm:
+        get_llm_registry().prewarm(settings.llm_model)
+    yield
+
+app = FastAPI(title="AXBot query service", lifespan=lifespan)
+
+_END = object()
+_slots = None
+_admitted = 0
+
+class _AdmittedStreamingResponse(StreamingResponse):
+    """Frees the query's admission once the response is over, whether or not its body ever started"""
+
+    async def __call__(self, scope, receive, send):
+        global _admitted
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            _admitted -= 1
+
+class QueryRequest(BaseModel):
+    query: str
+    force_direct: bool = False
+    model: Optional[str] = None
+    conversation: Optional[dict] = None  # {"summary": ..., "messages": [[role, content], ...]}
+    collections: Optional[list] = None  # collection names to search; the current one when empty
+
+def _sse(event: dict) -> str:
+    return f"data: {json.dumps(event)}\n\n"
+
+def _get_slots():
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(settings.server_max_concurrent)
+    return _slots
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "admitted": _admitted,
+        "models": get_llm_registry().loaded_models(),
+        "warmup": warmup_status()
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Counters and stage latency histograms in the Prometheus text format"""
+    return PlainTextResponse(get_metrics().prometheus_text(), media_type="text/plain; version=0.0.4")
+
+@app.get("/welcome")
+async def welcome():
+    return {"message": QueryHandler(get_llm()).get_welcome_message()}
+
+@app.post("/query")
+async def query(body: QueryRequest, request: Request):
+    """Stream an answer as server-sent events.
+
+    At most settings.server_max_concurrent queries run at once; up to
+    settings.server_max_queue more wait for a slot and anything beyond that
+    is rejected with 503. Generation stops as soon as the client goes away.
+    """
+    global _admitted
+    if _admitted >= settings.server_max_concurrent + settings.server_max_queue:
+        logger.warning("Query rejected: request queue is full")
+        return JSONResponse({"error": "Server busy, try again shortly"}, status_code=503)
+    _admitted += 1
+
+    async def events():
+        handler = QueryHandler(get_llm(body.model))
+        if body.collections:
+            handler.set_collections(body.collections)
+        conversation = Conversation.from_dict(body.conversation) if body.conversation else None
+        chunks = handler.stream_query(body.query, force_direct=body.force_direct, conversation=conversation)
+        cancelled = False
+        try:
+            async with _get_slots():
+                while True:
+                    if await request.is_disconnected():
+                        cancelled = True
+                        logger.info("Client disconnected, cancelling query")
+                        break
+                    chunk = await asyncio.to_thread(next, chunks, _END)
+                    if chunk is _END:
+                        break
+                    yield _sse({"type": "token", "content": chunk})
+                if not cancelled:
+                    yield _sse({
+                        "type": "done",
+                        "sources": handler.get_last_sources(),
+                        "timings": handler.get_last_timings()
+                    })
+        finally:
+            try:
+                chunks.close()  # Closes the underlying Ollama stream
+            except ValueError:
+                pass  # Still running in a worker thread; it stops at the next token
+
+    return _AdmittedStreamingResponse(events(), media_type="text/event-stream")
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=settings.server_host, port=settings.server_port)
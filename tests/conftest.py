@@ -0,0 +1,24 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+from benchmarks.fake_ollama import FakeOllamaConfig, start_fake_ollama
+from benchmarks.run import reset_state
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Stores under tmp_path, no caches or metrics log, and a fake Ollama server"""
+    server, base_url = start_fake_ollama(FakeOllamaConfig(dim=64, embed_latency_ms=0, embed_item_latency_ms=0))
+    monkeypatch.setattr(settings, "ollama_base_url", base_url)
+    monkeypatch.setattr(settings, "embedding_cache_enabled", False)
+    monkeypatch.setattr(settings, "answer_cache_enabled", False)
+    monkeypatch.setattr(settings, "metrics_log_path", "")
+    reset_state(str(tmp_path))
+    try:
+        yield tmp_path
+    finally:
+        reset_state(str(tmp_path))
+        server.shutdown()
@@ -0,0 +1,59 @@
+import pytest
+import embed
+import get_vector_db
+from benchmarks.corpus import make_chunks, make_files
+from config import settings
+from document_registry import get_document_registry
+
+class FailingEmbeddings:
+    """Embeds normally until the given call, which raises"""
+
+    def __init__(self, embeddings, fail_on_call: int):
+        self.embeddings = embeddings
+        self.fail_on_call = fail_on_call
+        self.calls = 0
+
+    def embed_documents(self, texts: list) -> list:
+        self.calls += 1
+        if self.calls == self.fail_on_call:
+            raise RuntimeError("embedding backend went away")
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list:
+        return self.embeddings.embed_query(text)
+
+def registered_chunk_count() -> int:
+    registry = get_document_registry()
+    return sum(len(registry.chunk_ids(source)) for source in registry.sources())
+
+@pytest.mark.parametrize("streamed", [False, True])
+def test_failure_mid_file_leaves_store_and_registry_in_agreement(workdir, monkeypatch, streamed):
+    monkeypatch.setattr(settings, "embed_batch_size", 10)
+    monkeypatch.setattr(settings, "insert_batch_size", 10)
+    monkeypatch.setattr(settings, "embed_concurrency", 1)
+    monkeypatch.setattr(settings, "stream_threshold_mb", 0 if streamed else 50)
+    failing = FailingEmbeddings(get_vector_db.get_embeddings(), fail_on_call=5)
+    monkeypatch.setattr(embed, "get_embeddings", lambda: failing)
+
+    file = make_files(make_chunks(100, seed=0), chunks_per_file=100)[0]
+    results = embed.embed_files([file])
+
+    assert results == {file.name: False}
+    assert failing.calls >= 5
+    get_vector_db.invalidate_stats()
+    assert get_vector_db.get_collection_stats()["count"] == registered_chunk_count() == 0
+    assert len(get_vector_db.get_lexical_index()) == 0
+
+def test_failed_file_does_not_disturb_the_others(workdir, monkeypatch):
+    monkeypatch.setattr(settings, "embed_batch_size", 10)
+    monkeypatch.setattr(settings, "insert_batch_size", 10)
+    monkeypatch.setattr(settings, "embed_concurrency", 1)
+    failing = FailingEmbeddings(get_vector_db.get_embeddings(), fail_on_call=3)
+    monkeypatch.setattr(embed, "get_embeddings", lambda: failing)
+
+    files = make_files(make_chunks(60, seed=1), chunks_per_file=30)
+    results = embed.embed_files(files)
+
+    assert sorted(results.values()) == [False, True]
+    get_vector_db.invalidate_stats()
+    assert get_vector_db.get_collection_stats()["count"] == registered_chunk_count() > 0
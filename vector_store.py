@@ -0,0 +1,738 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from logger_config import setup_logger
+from config import settings
+
+logger = setup_logger('vector_store')
+
+VECTOR_STORES = ("chroma", "numpy", "quantized")
+QUANTIZED_DTYPES = {"int8": np.int8, "float16": np.float16}
+
+# Chroma's defaults, which apply to collections created without index metadata
+DEFAULT_INDEX_METADATA = {"hnsw:space": "l2", "hnsw:M": 16, "hnsw:construction_ef": 100, "hnsw:search_ef": 10}
+
+EXPORT_PAGE_SIZE = 1000
+
+# Rows scored per matrix product, so a scan never converts the whole vector file at once
+SCAN_BLOCK_ROWS = 65536
+# The quantized store rewrites its vector file once this share of rows is deleted
+COMPACT_RATIO = 0.25
+# Ids per SQL statement, below SQLite's limit on bound parameters
+SQL_BATCH = 500
+
+def index_metadata() -> dict:
+    """HNSW parameters from settings, used when a collection is created"""
+    return {
+        "hnsw:space": settings.vector_space,
+        "hnsw:M": settings.hnsw_m,
+        "hnsw:construction_ef": settings.hnsw_construction_ef,
+        "hnsw:search_ef": settings.hnsw_search_ef,
+    }
+
+def vector_distances(query: list, vectors, space: str) -> np.ndarray:
+    """Exact Chroma-style distances from query to each row of vectors"""
+    query = np.asarray(query, dtype=np.float32)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if space == "l2":
+        return ((vectors - query) ** 2).sum(axis=1)
+    if space == "cosine":
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+        return 1.0 - (vectors @ query) / np.where(norms == 0, 1.0, norms)
+    return 1.0 - vectors @ query
+
+def quantize(vectors: np.ndarray, dtype: str) -> tuple:
+    """Return (quantized rows, per-row scales); int8 uses symmetric per-row scaling"""
+    if dtype == "float16":
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+def _distances(queries: np.ndarray, dots: np.ndarray, squared_norms: np.ndarray, space: str) -> np.ndarray:
+    """Chroma-style distances of (queries, rows) from their dot products and the rows' squared norms"""
+    if space == "l2":
+        return squared_norms - 2 * dots + (queries * queries).sum(axis=1)[:, None]
+    if space == "cosine":
+        norms = np.sqrt(squared_norms) * np.linalg.norm(queries, axis=1)[:, None]
+        return 1.0 - dots / np.where(norms == 0, 1.0, norms)
+    return 1.0 - dots
+
+class VectorStore:
+    """Interface of the engines behind get_vector_db.
+
+    Chunks are (id, embedding, document, metadata) records. Distances follow
+    Chroma's conventions for the store's space ('l2' is squared L2, 'cosine'
+    and 'ip' are 1 - similarity), so scores do not depend on the engine.
+    Pages returned by get() and export() are dicts of parallel lists keyed
+    'ids', 'documents', 'metadatas' and, when asked for, 'embeddings'.
+    """
+
+    space = "l2"
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def add(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        """Insert chunks, replacing any with the same id"""
+        raise NotImplementedError
+
+    def search(self, embedding: list, k: int) -> list:
+        """Nearest chunks as [{"id", "content", "metadata", "similarity_score"}], closest first;
+        similarity_score is the distance"""
+        raise NotImplementedError
+
+    def search_many(self, embeddings: list, k: int) -> list:
+        """search() for several queries at once, one result list per query"""
+        return [self.search(embedding, k) for embedding in embeddings]
+
+    def get(self, ids: list, include_embeddings: bool = False) -> dict:
+        raise NotImplementedError
+
+    def delete(self, ids: list):
+        raise NotImplementedError
+
+    def delete_source(self, source: str) -> list:
+        """Delete every chunk whose metadata 'source' matches and return their ids"""
+        raise NotImplementedError
+
+    def export(self, include_embeddings: bool = True, page_size: int = EXPORT_PAGE_SIZE):
+        """Yield all chunks page by page"""
+        raise NotImplementedError
+
+    def import_pages(self, pages) -> int:
+        """Add pages produced by export(), possibly from another engine; returns the chunk count"""
+        count = 0
+        for page in pages:
+            for i in range(0, len(page['ids']), settings.insert_batch_size):
+                end = i + settings.insert_batch_size
+                self.add(page['ids'][i:end], page['embeddings'][i:end], page['documents'][i:end], page['metadatas'][i:end])
+            count += len(page['ids'])
+        return count
+
+    def drop(self):
+        """Delete all chunks"""
+        raise NotImplementedError
+
+    def persist(self):
+        """Write pending changes to disk, for engines that do not do so on every write"""
+
+    def last_modified(self):
+        raise NotImplementedError
+
+class ChromaVectorStore(VectorStore):
+    """A persistent Chroma collection with an HNSW index"""
+
+    def __init__(self, path: str, collection_name: str):
+        import chromadb  # Heavy; only loaded once a Chroma store is opened
+        Path(path).mkdir(parents=True, exist_ok=True)
+        self.path = Path(path)
+        self.collection_name = collection_name
+        self._client = chromadb.PersistentClient(path=str(path))
+        self._open()
+
+    def _open(self):
+        # Embeddings are always computed by the caller, so no embedding function
+        self._collection = self._client.get_or_create_collection(
+            self.collection_name, metadata=index_metadata(), embedding_function=None
+        )
+        metadata = dict(DEFAULT_INDEX_METADATA, **(self._collection.metadata or {}))
+        self.space = metadata["hnsw:space"]
+        # Chroma fixes index parameters at creation; warn when an existing collection differs
+        differing = {key: metadata.get(key) for key, value in index_metadata().items() if metadata.get(key) != value}
+        if differing:
+            logger.warning(
+                f"Collection {self.collection_name} was created with {differing}; index settings only apply to new "
+                f"collections, so clear or archive the documents and re-ingest to change them"
+            )
+
+    def count(self) -> int:
+        return self._collection.count()
+
+    def add(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        self._collection.upsert(
+            ids=ids,
+            embeddings=embeddings,
+            documents=documents,
+            metadatas=[metadata or None for metadata in metadatas]
+        )
+
+    def search(self, embedding: list, k: int) -> list:
+        return self.search_many([embedding], k)[0]
+
+    def search_many(self, embeddings: list, k: int) -> list:
+        results = self._collection.query(
+            query_embeddings=list(embeddings),
+            n_results=k,
+            include=["documents", "metadatas", "distances"]
+        )
+        return [
+            [
+                {"id": chunk_id, "content": content, "metadata": metadata or {}, "similarity_score": float(distance)}
+                for chunk_id, content, metadata, distance in zip(ids, documents, metadatas, distances)
+            ]
+            for ids, documents, metadatas, distances in zip(
+                results['ids'], results['documents'], results['metadatas'], results['distances']
+            )
+        ]
+
+    def get(self, ids: list, include_embeddings: bool = False) -> dict:
+        include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+        return self._collection.get(ids=ids, include=include)
+
+    def delete(self, ids: list):
+        for i in range(0, len(ids), settings.insert_batch_size):
+            self._collection.delete(ids=ids[i:i + settings.insert_batch_size])
+
+    def delete_source(self, source: str) -> list:
+        ids = self._collection.get(where={"source": source}, include=[])['ids']
+        self.delete(ids)
+        return ids
+
+    def export(self, include_embeddings: bool = True, page_size: int = EXPORT_PAGE_SIZE):
+        include = ["documents", "metadatas"] + (["embeddings"] if include_embeddings else [])
+        offset = 0
+        while True:
+            page = self._collection.get(include=include, limit=page_size, offset=offset)
+            ids = page.get('ids') or []
+            if not ids:
+                return
+            yield page
+            if len(ids) < page_size:
+                return
+            offset += page_size
+
+    def drop(self):
+        self._client.delete_collection(self.collection_name)
+        self._open()
+
+    def last_modified(self):
+        db_file = self.path / "chroma.sqlite3"
+        return db_file.stat().st_mtime if db_file.exists() else None
+
+class NumpyVectorStore(VectorStore):
+    """Brute-force search over a contiguous float32 matrix held in memory.
+
+    Every query is one matrix-vector product (a batch of queries, one
+    matrix-matrix product), so search is exact and, for
+    collections up to a few tens of thousands of chunks, faster than going
+    through Chroma. Rows grow by doubling; a deleted row is
+    filled with the last one so live rows stay contiguous. With a path the
+    store is loaded from, and persist() writes, a single snapshot file.
+    """
+
+    def __init__(self, path: str = None, space: str = None):
+        self.path = Path(path) if path else None
+        self.space = space or settings.vector_space
+        self._lock = threading.RLock()
+        self._clear()
+        if self.path is not None:
+            self._load()
+
+    def _clear(self):
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._squared_norms = np.empty(0, dtype=np.float32)
+        self._size = 0
+        self.ids, self.documents, self.metadatas = [], [], []
+        self._rows = {}
+        self._dirty = False
+        self._modified = None
+
+    def count(self) -> int:
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        return self._vectors[:self._size].nbytes
+
+    def _reserve(self, size: int, dim: int):
+        if self._vectors.shape[1] not in (0, dim):
+            raise ValueError(f"Embedding dimension {dim} does not match the store's {self._vectors.shape[1]}")
+        capacity = len(self._vectors)
+        if size <= capacity and self._vectors.shape[1] == dim:
+            return
+        capacity = max(size, 2 * capacity, 1024)
+        vectors = np.empty((capacity, dim), dtype=np.float32)
+        if self._size:
+            vectors[:self._size] = self._vectors[:self._size]
+        squared_norms = np.empty(capacity, dtype=np.float32)
+        squared_norms[:self._size] = self._squared_norms[:self._size]
+        self._vectors, self._squared_norms = vectors, squared_norms
+
+    def add(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        if not len(ids):
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            self._reserve(self._size + len(ids), embeddings.shape[1])
+            for chunk_id, vector, document, metadata in zip(ids, embeddings, documents, metadatas):
+                row = self._rows.get(chunk_id)
+                if row is None:
+                    row = self._rows[chunk_id] = self._size
+                    self._size += 1
+                    self.ids.append(chunk_id)
+                    self.documents.append(document)
+                    self.metadatas.append(metadata or {})
+                else:
+                    self.documents[row], self.metadatas[row] = document, metadata or {}
+                self._vectors[row] = vector
+                self._squared_norms[row] = vector @ vector
+            self._touch()
+
+    def _touch(self):
+        self._dirty = True
+        self._modified = time.time()
+
+    def search(self, embedding: list, k: int) -> list:
+        return self.search_many([embedding], k)[0]
+
+    def search_many(self, embeddings: list, k: int) -> list:
+        """One matrix product for all queries: distances are (queries, chunks)"""
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        with self._lock:
+            if not self._size or k <= 0:
+                return [[] for _ in range(len(queries))]
+            dots = queries @ self._vectors[:self._size].T
+            distances = _distances(queries, dots, self._squared_norms[:self._size], self.space)
+            k = min(k, self._size)
+            tops = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            results = []
+            for row_distances, top in zip(distances, tops):
+                top = top[np.argsort(row_distances[top])]
+                results.append([
+                    {
+                        "id": self.ids[row],
+                        "content": self.documents[row],
+                        "metadata": self.metadatas[row],
+                        "similarity_score": float(row_distances[row]),
+                    }
+                    for row in top
+                ])
+            return results
+
+    def get(self, ids: list, include_embeddings: bool = False) -> dict:
+        with self._lock:
+            rows = [self._rows[chunk_id] for chunk_id in ids if chunk_id in self._rows]
+            page = {
+                "ids": [self.ids[row] for row in rows],
+                "documents": [self.documents[row] for row in rows],
+                "metadatas": [self.metadatas[row] for row in rows],
+            }
+            if include_embeddings:
+                page["embeddings"] = self._vectors[rows].copy() if rows else np.empty((0, 0), dtype=np.float32)
+            return page
+
+    def delete(self, ids: list):
+        with self._lock:
+            for chunk_id in ids:
+                row = self._rows.pop(chunk_id, None)
+                if row is None:
+                    continue
+                last = self._size - 1
+                if row != last:
+                    self._vectors[row] = self._vectors[last]
+                    self._squared_norms[row] = self._squared_norms[last]
+                    self.ids[row], self.documents[row], self.metadatas[row] = (
+                        self.ids[last], self.documents[last], self.metadatas[last]
+                    )
+                    self._rows[self.ids[row]] = row
+                del self.ids[last], self.documents[last], self.metadatas[last]
+                self._size = last
+            self._touch()
+
+    def delete_source(self, source: str) -> list:
+        with self._lock:
+            ids = [chunk_id for chunk_id, metadata in zip(self.ids, self.metadatas) if metadata.get('source') == source]
+            self.delete(ids)
+            return ids
+
+    def export(self, include_embeddings: bool = True, page_size: int = EXPORT_PAGE_SIZE):
+        offset = 0
+        while True:
+            with self._lock:
+                end = min(offset + page_size, self._size)
+                if offset >= end:
+                    return
+                page = {
+                    "ids": self.ids[offset:end],
+                    "documents": self.documents[offset:end],
+                    "metadatas": self.metadatas[offset:end],
+                }
+                if include_embeddings:
+                    page["embeddings"] = self._vectors[offset:end].copy()
+            yield page
+            offset = end
+
+    def drop(self):
+        with self._lock:
+            self._clear()
+            if self.path is not None:
+                self.path.unlink(missing_ok=True)
+
+    def persist(self):
+        if self.path is None or not self._dirty:
+            return
+        with self._lock:
+            state = {
+                "space": self.space,
+                "vectors": self._vectors[:self._size],
+                "ids": self.ids,
+                "documents": self.documents,
+                "metadatas": self.metadatas,
+            }
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+            vectors = np.ascontiguousarray(state["vectors"], dtype=np.float32)
+            self.space = state["space"]
+            self.ids, self.documents, self.metadatas = state["ids"], state["documents"], state["metadatas"]
+            self._vectors = vectors
+            self._squared_norms = np.einsum("ij,ij->i", vectors, vectors)
+            self._size = len(self.ids)
+            self._rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+            self._modified = self.path.stat().st_mtime
+            if self.space != settings.vector_space:
+                logger.warning(
+                    f"Snapshot {self.path} uses the {self.space} space; clear or archive the documents "
+                    f"and re-ingest to use {settings.vector_space}"
+                )
+        except Exception as e:
+            logger.error(f"Could not load vector snapshot {self.path}: {str(e)}")
+            self._clear()
+
+    def last_modified(self):
+        return self._modified
+
+class QuantizedVectorStore(VectorStore):
+    """Chunks in SQLite, their vectors as int8 or float16 rows of a memory-mapped file.
+
+    Vectors take a quarter (int8, scaled per row) or half (float16) of their
+    float32 size and are only paged in while scanning; there is no float32
+    copy and no graph index, and chunk text is read from SQLite only for the
+    hits. Search is an exact flat scan of the quantized vectors: per query it
+    is slower than HNSW on large collections, in exchange for a fraction of
+    the memory and disk. Embeddings read back (get, export) are the
+    dequantized vectors. Replaced and deleted rows are tombstoned until
+    persist() compacts the file.
+    """
+
+    def __init__(self, path_prefix, dtype: str = "int8", space: str = None):
+        if dtype not in QUANTIZED_DTYPES:
+            raise ValueError(f"Unsupported quantized dtype: {dtype} (expected one of {', '.join(QUANTIZED_DTYPES)})")
+        self.dtype = dtype
+        self.vectors_path = Path(f"{path_prefix}.{dtype}.bin")
+        self.db_path = Path(f"{path_prefix}.{dtype}.sqlite3")
+        self._default_space = space or settings.vector_space
+        self._lock = threading.RLock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                source TEXT,
+                document TEXT,
+                metadata TEXT,
+                scale REAL NOT NULL,
+                squared_norm REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value);
+        """)
+        self._load()
+
+    def _meta(self, name: str):
+        row = self._conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, name: str, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    def _load(self):
+        """Read the per-row scales and norms; rows appended to the file but never committed are cut off"""
+        with self._lock:
+            self.space = self._meta("space") or self._default_space
+            self.dim = self._meta("dim")
+            self._rows = self._meta("rows") or 0
+            self._scales = np.ones(self._rows, dtype=np.float32)
+            self._squared_norms = np.zeros(self._rows, dtype=np.float32)
+            self._alive = np.zeros(self._rows, dtype=bool)
+            for row, scale, squared_norm in self._conn.execute("SELECT row, scale, squared_norm FROM chunks"):
+                self._scales[row], self._squared_norms[row], self._alive[row] = scale, squared_norm, True
+            self._live = int(self._alive.sum())
+            self._matrix = None
+            expected = self._rows * self._row_bytes
+            if self.vectors_path.exists() and self.vectors_path.stat().st_size > expected:
+                os.truncate(self.vectors_path, expected)
+            self._modified = self.db_path.stat().st_mtime if self._rows else None
+            if self._live and self.space != settings.vector_space:
+                logger.warning(
+                    f"Quantized store {self.db_path} uses the {self.space} space; clear or archive the documents "
+                    f"and re-ingest to use {settings.vector_space}"
+                )
+
+    @property
+    def _row_bytes(self) -> int:
+        return (self.dim or 0) * np.dtype(QUANTIZED_DTYPES[self.dtype]).itemsize
+
+    @property
+    def nbytes(self) -> int:
+        return self._rows * self._row_bytes
+
+    def _map(self):
+        if self._matrix is None and self._rows:
+            self._matrix = np.memmap(
+                self.vectors_path, dtype=QUANTIZED_DTYPES[self.dtype], mode="r", shape=(self._rows, self.dim)
+            )
+        return self._matrix
+
+    def _dequantize(self, rows: list) -> np.ndarray:
+        if not rows:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return self._map()[rows].astype(np.float32) * self._scales[rows][:, None]
+
+    def _begin(self):
+        """Start a write; reload first if another process wrote since this one loaded"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        if (self._meta("rows") or 0) != self._rows:
+            self._load()
+
+    def _select(self, columns: str, ids: list) -> list:
+        rows = []
+        for i in range(0, len(ids), SQL_BATCH):
+            batch = ids[i:i + SQL_BATCH]
+            rows.extend(self._conn.execute(
+                f"SELECT {columns} FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+            ).fetchall())
+        return rows
+
+    def _delete_rows(self, rows: list):
+        for i in range(0, len(rows), SQL_BATCH):
+            batch = rows[i:i + SQL_BATCH]
+            self._conn.execute(f"DELETE FROM chunks WHERE row IN ({','.join('?' * len(batch))})", batch)
+        self._alive[rows] = False
+        self._live -= len(rows)
+
+    def count(self) -> int:
+        return self._live
+
+    def add(self, ids: list, embeddings: list, documents: list, metadatas: list):
+        if not len(ids):
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        quantized, scales = quantize(embeddings, self.dtype)
+        squared_norms = ((quantized.astype(np.float32) * scales[:, None]) ** 2).sum(axis=1)
+        with self._lock:
+            self._begin()
+            try:
+                if self.dim is None:
+                    self.dim = embeddings.shape[1]
+                    self._set_meta("dim", self.dim)
+                    self._set_meta("space", self.space)
+                elif embeddings.shape[1] != self.dim:
+                    raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match the store's {self.dim}")
+                self._delete_rows([row for row, in self._select("row", list(ids))])
+                first = self._rows
+                with open(self.vectors_path, "r+b" if self.vectors_path.exists() else "wb") as f:
+                    # Overwrites rows a crashed writer appended but never committed
+                    f.seek(first * self._row_bytes)
+                    f.truncate()
+                    f.write(quantized.tobytes())
+                self._conn.executemany(
+                    "INSERT INTO chunks (row, id, source, document, metadata, scale, squared_norm) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (first + i, chunk_id, (metadata or {}).get('source'), document, json.dumps(metadata or {}),
+                         float(scales[i]), float(squared_norms[i]))
+                        for i, (chunk_id, document, metadata) in enumerate(zip(ids, documents, metadatas))
+                    ]
+                )
+                self._set_meta("rows", first + len(ids))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._load()
+                raise
+            self._rows = first + len(ids)
+            self._scales = np.concatenate([self._scales, scales])
+            self._squared_norms = np.concatenate([self._squared_norms, squared_norms.astype(np.float32)])
+            self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+            self._live += len(ids)
+            self._matrix = None
+            self._modified = time.time()
+
+    def search(self, embedding: list, k: int) -> list:
+        return self.search_many([embedding], k)[0]
+
+    def search_many(self, embeddings: list, k: int) -> list:
+        """One scan for all queries; each block of rows is dequantized once for all of them"""
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        with self._lock:
+            if not self._live or k <= 0:
+                return [[] for _ in range(len(queries))]
+            matrix = self._map()
+            dots = np.empty((len(queries), self._rows), dtype=np.float32)
+            for start in range(0, self._rows, SCAN_BLOCK_ROWS):
+                block = matrix[start:start + SCAN_BLOCK_ROWS].astype(np.float32)
+                dots[:, start:start + len(block)] = queries @ block.T
+            dots *= self._scales
+            distances = _distances(queries, dots, self._squared_norms, self.space)
+            distances[:, ~self._alive] = np.inf
+            k = min(k, self._live)
+            tops = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            tops = [top[np.argsort(row_distances[top])] for row_distances, top in zip(distances, tops)]
+            wanted = sorted({int(row) for top in tops for row in top})
+            records = {}
+            for i in range(0, len(wanted), SQL_BATCH):
+                batch = wanted[i:i + SQL_BATCH]
+                for row, chunk_id, document, metadata in self._conn.execute(
+                    f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({','.join('?' * len(batch))})", batch
+                ):
+                    records[row] = (chunk_id, document, json.loads(metadata or "{}"))
+            return [
+                [
+                    {
+                        "id": records[row][0],
+                        "content": records[row][1],
+                        "metadata": records[row][2],
+                        "similarity_score": float(row_distances[row]),
+                    }
+                    for row in top if row in records
+                ]
+                for row_distances, top in zip(distances, tops)
+            ]
+
+    def get(self, ids: list, include_embeddings: bool = False) -> dict:
+        with self._lock:
+            found = {chunk_id: (row, document, metadata) for row, chunk_id, document, metadata in
+                     self._select("row, id, document, metadata", list(ids))}
+            ordered = [chunk_id for chunk_id in dict.fromkeys(ids) if chunk_id in found]
+            page = {
+                "ids": ordered,
+                "documents": [found[chunk_id][1] for chunk_id in ordered],
+                "metadatas": [json.loads(found[chunk_id][2] or "{}") for chunk_id in ordered],
+            }
+            if include_embeddings:
+                page["embeddings"] = self._dequantize([found[chunk_id][0] for chunk_id in ordered])
+            return page
+
+    def delete(self, ids: list):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._delete_rows([row for row, in self._select("row", list(ids))])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._load()
+                raise
+            self._modified = time.time()
+
+    def delete_source(self, source: str) -> list:
+        with self._lock:
+            ids = [chunk_id for chunk_id, in self._conn.execute("SELECT id FROM chunks WHERE source = ?", (source,))]
+            self.delete(ids)
+            return ids
+
+    def export(self, include_embeddings: bool = True, page_size: int = EXPORT_PAGE_SIZE):
+        after = -1
+        while True:
+            with self._lock:
+                records = self._conn.execute(
+                    "SELECT row, id, document, metadata FROM chunks WHERE row > ? ORDER BY row LIMIT ?",
+                    (after, page_size)
+                ).fetchall()
+                if not records:
+                    return
+                page = {
+                    "ids": [record[1] for record in records],
+                    "documents": [record[2] for record in records],
+                    "metadatas": [json.loads(record[3] or "{}") for record in records],
+                }
+                if include_embeddings:
+                    page["embeddings"] = self._dequantize([record[0] for record in records])
+            yield page
+            after = records[-1][0]
+
+    def drop(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM chunks")
+                self._conn.execute("DELETE FROM meta")
+                self._matrix = None
+                self.vectors_path.unlink(missing_ok=True)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._default_space = settings.vector_space
+            self._load()
+
+    def persist(self):
+        """Rewrite the vector file without deleted rows once they make up COMPACT_RATIO of it"""
+        with self._lock:
+            if self._rows - self._live <= COMPACT_RATIO * self._rows:
+                return
+            live = np.flatnonzero(self._alive)
+            matrix = self._map()
+            tmp_path = self.vectors_path.with_suffix(".tmp")
+            with open(tmp_path, "wb") as f:
+                for start in range(0, len(live), SCAN_BLOCK_ROWS):
+                    f.write(np.ascontiguousarray(matrix[live[start:start + SCAN_BLOCK_ROWS]]).tobytes())
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Ascending, so a row only ever moves into a slot that is already free
+                self._conn.executemany(
+                    "UPDATE chunks SET row = ? WHERE row = ?", [(new, int(old)) for new, old in enumerate(live) if new != old]
+                )
+                self._set_meta("rows", len(live))
+                self._matrix = None
+                os.replace(tmp_path, self.vectors_path)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                tmp_path.unlink(missing_ok=True)
+                raise
+            logger.info(f"Compacted {self.db_path.name} from {self._rows} to {len(live)} rows")
+            self._load()
+
+    def last_modified(self):
+        return self._modified
+
+def list_collections(path: str) -> list:
+    """Names of the collections stored under path by the engine in settings.vector_store"""
+    if settings.vector_store in ("numpy", "quantized"):
+        suffix = ".vectors.pkl" if settings.vector_store == "numpy" else f".{settings.quantized_dtype}.sqlite3"
+        return sorted(snapshot.name[:-len(suffix)] for snapshot in Path(path).glob(f"*{suffix}"))
+    if not (Path(path) / "chroma.sqlite3").exists():
+        return []
+    import chromadb
+    return sorted(chromadb.PersistentClient(path=str(path)).list_collections())
+
+def open_vector_store(path: str, collection_name: str) -> VectorStore:
+    """The engine chosen by settings.vector_store for a collection stored under path"""
+    if settings.vector_store == "chroma":
+        return ChromaVectorStore(path, collection_name)
+    if settings.vector_store == "numpy":
+        snapshot = Path(path) / f"{collection_name}.vectors.pkl" if settings.numpy_store_snapshot else None
+        return NumpyVectorStore(snapshot)
+    if settings.vector_store == "quantized":
+        return QuantizedVectorStore(Path(path) / collection_name, settings.quantized_dtype)
+    raise ValueError(f"Unknown vector store: {settings.vector_store} (expected one of {', '.join(VECTOR_STORES)})")
@@ -0,0 +1,105 @@
+import importlib
+import threading
+import time
+from metrics import get_metrics
+from logger_config import setup_logger
+from config import settings
+
+logger = setup_logger('warmup')
+
+# Imported lazily by the rest of the code; loading them here moves the cost
+# off the first upload and the first question
+HEAVY_MODULES = ("langchain_ollama", "chromadb", "embed")
+QUERY_MODULES = ("query", "langchain_core.prompts")
+
+_thread = None
+_paths_ready = False
+_lock = threading.Lock()
+_status = {"state": "idle", "timings": {}, "errors": {}}
+
+def _import_modules(names: tuple):
+    for name in names:
+        _step(f"import_{name}", importlib.import_module, name)
+
+def _open_collection():
+    from get_vector_db import get_collection_stats, get_lexical_index, get_vector_db
+    get_vector_db()
+    get_collection_stats()  # Counts the chunks once; later calls read the cached figure
+    if settings.hybrid_search:
+        get_lexical_index()
+
+def _load_embedding_model():
+    from get_vector_db import get_embeddings
+    embeddings = get_embeddings()
+    # Bypass the embedding cache so Ollama actually loads the model
+    getattr(embeddings, "embeddings", embeddings).embed_query("warm-up")
+
+def _load_cross_encoders():
+    from reranker import load_cross_encoder
+    if settings.rerank_enabled:
+        load_cross_encoder(settings.rerank_model)
+    if settings.relevance_mode == "cross_encoder":
+        load_cross_encoder(settings.relevance_cross_encoder_model)
+
+def _load_chat_model():
+    from llm_registry import get_llm_registry
+    registry = get_llm_registry()
+    registry.get(settings.llm_model)
+    if settings.llm_prewarm:
+        registry.prewarm(settings.llm_model, wait=True)
+
+def _step(name: str, function, *args):
+    start = time.perf_counter()
+    try:
+        function(*args)
+    except Exception as e:
+        logger.error(f"Warm-up step {name} failed: {str(e)}")
+        _status["errors"][name] = str(e)
+    finally:
+        _status["timings"][name] = time.perf_counter() - start
+
+def _run(answer_queries: bool):
+    start = time.perf_counter()
+    _status["state"] = "running"
+    _import_modules(HEAVY_MODULES + (QUERY_MODULES if answer_queries else ()))
+    _step("collection", _open_collection)
+    _step("embedding_model", _load_embedding_model)
+    if answer_queries:
+        if settings.rerank_enabled or settings.relevance_mode == "cross_encoder":
+            _step("cross_encoder", _load_cross_encoders)
+        _step("chat_model", _load_chat_model)
+    _status["timings"]["total"] = time.perf_counter() - start
+    _status["state"] = "failed" if _status["errors"] else "done"
+    get_metrics().record_trace("startup", _status["timings"], state=_status["state"], errors=_status["errors"])
+    logger.info(
+        f"Warm-up {_status['state']} in {_status['timings']['total']:.2f}s: "
+        + ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in _status["timings"].items() if name != "total")
+    )
+
+def warm_up(answer_queries: bool = True, wait: bool = False):
+    """Open the collection and load the models in a background thread, once per process.
+
+    Without answer_queries (a UI that sends questions to the query service)
+    only what ingestion needs is loaded: the collection and the embedding
+    model. Timings of each step are logged, recorded as a 'startup' trace and
+    observed in the metrics. The data directories are created first, on the
+    caller's thread and even when settings.warmup_enabled is off, so the
+    first upload never races them; the rest is skipped when it is off.
+    """
+    global _thread, _paths_ready
+    with _lock:
+        if not _paths_ready:
+            settings.validate_paths()
+            _paths_ready = True
+    if not settings.warmup_enabled:
+        return
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, args=(answer_queries,), name="warmup", daemon=True)
+            _thread.start()
+    if wait:
+        _thread.join()
+
+def warmup_status() -> dict:
+    """{"state": idle | running | done | failed, "timings": {step: seconds}, "errors": {step: message}}"""
+    return {"state": _status["state"], "timings": dict(_status["timings"]), "errors": dict(_status["errors"])}